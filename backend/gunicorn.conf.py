@@ -0,0 +1,74 @@
+"""
+Gunicorn configuration for the ML service (production)
+=======================================================
+    gunicorn -c gunicorn.conf.py ml_service:app
+
+- preload_app: ml_service, the pipeline code and the trained artifacts are
+  loaded once in the master, then frozen out of the garbage collector
+  (gc.freeze) so forked workers share those pages copy-on-write
+- gthread workers: ML_WORKERS processes x ML_THREADS threads; training and
+  scoring release the GIL in NumPy/BLAS, and processes isolate the rest
+- max_requests (+ jitter) recycles workers gracefully to bound memory growth;
+  graceful_timeout lets an in-flight training request finish first
+- The index check runs once in the master; the retraining scheduler runs in
+  exactly one worker, chosen by a file lock that passes on when it is recycled
+
+Settings come from the environment (see ML_SERVICE_PRODUCTION.md).
+"""
+
+import fcntl
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PY_SERVICE_PORT', 5000)}"
+worker_class = 'gthread'
+workers = int(os.getenv('ML_WORKERS', 2))
+threads = int(os.getenv('ML_THREADS', 4))
+preload_app = True
+
+# Worker recycling
+max_requests = int(os.getenv('ML_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('ML_MAX_REQUESTS_JITTER', 100))
+graceful_timeout = int(os.getenv('ML_GRACEFUL_TIMEOUT', 300))
+
+# gthread workers heartbeat from the main loop, so long training requests do not trip this
+timeout = int(os.getenv('ML_WORKER_TIMEOUT', 120))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('ML_LOG_LEVEL', 'info')
+
+SCHEDULER_LOCK_PATH = os.getenv('ML_SCHEDULER_LOCK', '/tmp/yatrik-ml-scheduler.lock')
+
+
+def when_ready(server):
+    """Master, after the app is preloaded and before workers fork"""
+    import ml_service
+
+    ml_service.preload_models()
+    if ml_service.INDEX_CHECK_ON_STARTUP:
+        ml_service.check_indexes_on_startup()
+
+    # Keep preloaded objects out of GC passes so workers don't dirty shared pages
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Start the retraining scheduler in the single worker that holds the lock"""
+    import ml_service
+
+    if not ml_service.SCHEDULER_ENABLED:
+        return
+
+    lock_file = open(SCHEDULER_LOCK_PATH, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return
+
+    # The lock is held until this worker exits, then the next new worker takes over
+    worker.scheduler_lock = lock_file
+    ml_service.scheduler.start()
+    worker.log.info("Retraining scheduler running in worker %s", worker.pid)
@@ -22,21 +22,24 @@ class DemandPredictionLSTM:
     def prepare_data(self, df):
         """
         Prepare time-series data for LSTM
-        df should have columns: date, route_id, passengers, day_of_week, 
-                                is_weekend, is_holiday, time_slot
+        df should have one row per route and day (snapshot dataset
+        'demand_daily'), with columns: date, route_id, passengers,
+        day_of_week, is_weekend, is_holiday, hour, month
         """
         # Feature engineering
         features = ['passengers', 'day_of_week', 'is_weekend', 
                    'is_holiday', 'hour', 'month']
         
         # Normalize features
+        df = df.sort_values(['route_id', 'date'])
         scaled_data = self.scaler.fit_transform(df[features])
         
-        # Create sequences
+        # Create sequences within each route, never across two
         X, y = [], []
-        for i in range(len(scaled_data) - self.sequence_length):
-            X.append(scaled_data[i:i+self.sequence_length])
-            y.append(scaled_data[i+self.sequence_length, 0])  # Predict passengers
+        for rows in np.split(scaled_data, np.flatnonzero(np.diff(pd.factorize(df['route_id'])[0])) + 1):
+            for i in range(len(rows) - self.sequence_length):
+                X.append(rows[i:i+self.sequence_length])
+                y.append(rows[i+self.sequence_length, 0])  # Predict passengers
             
         return np.array(X), np.array(y)
     
@@ -85,8 +88,10 @@ class DemandPredictionLSTM:
 
 # Example usage
 if __name__ == "__main__":
-    # TODO: Load data from MongoDB
-    # df = load_data_from_mongodb()
+    # Load the latest snapshot (export with: python ml_models/snapshot.py export)
+    # sys.path.insert(0, '../ml_models')
+    # from snapshot import load_snapshot
+    # df = load_snapshot('demand_daily')
     
     # Initialize model
     lstm_model = DemandPredictionLSTM(sequence_length=7)
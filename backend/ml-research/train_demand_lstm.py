@@ -0,0 +1,350 @@
+"""
+Headless Demand LSTM Trainer
+Research Area: Time-Series Forecasting for Transportation
+
+Command-line version of colab_demand_prediction.py for our training machines:
+no Colab uploads, `!pip`, plots or downloads.
+
+- Data: a collect_training_data.js JSON export or a snapshot Arrow file
+  (--data), a snapshot version (--snapshot), or MongoDB directly (default)
+- Series: `trips` (default) is the notebook's per-trip rows in date order,
+  dataset 'demand_training'. `route_daily` is what /forecast/demand serves:
+  daily passengers per route from route_daily_features (dataset
+  'demand_daily', demand_forecast.fetch_demand_daily_data), with the
+  forecaster's features. Windows never cross from one route into another,
+  and each route's last 20% of windows are held out for testing
+- Input pipeline: tf.data cuts the sequences lazily from the scaled array,
+  then shuffles, batches and prefetches them, so the (samples, days, features)
+  tensor is never built in memory. The scaler is fitted on training rows only
+- Checkpoints: model and optimizer state are backed up after every epoch in
+  <out>/checkpoints. Re-running the same command after an interruption
+  resumes from the last completed epoch. The best epoch (val_loss) is kept
+  separately and is the one saved as the model. Checkpoints are removed once
+  a run finishes
+- Artifacts in <out>: demand_lstm_model.h5, demand_scaler.pkl,
+  feature_columns.json, demand_model.json (series, features, sequence
+  length) and training_report.json with the notebook's MAE, RMSE, MAPE and
+  R² (in passengers)
+
+The default features and architecture are the notebook's. /forecast/demand
+only serves a model trained with --series route_daily (its demand_model.json
+is checked on load).
+
+Usage:
+    python train_demand_lstm.py [--data FILE | --snapshot VERSION] [--out models]
+                                [--series trips|route_daily]
+                                [--epochs 100] [--batch-size 32] [--sequence-length 7]
+                                [--features a,b,...] [--restart]
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+ML_MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ml_models')
+
+NOTEBOOK_FEATURES = ['passengers', 'day_of_week', 'hour', 'is_weekend',
+                     'is_peak_hour', 'month', 'utilization']
+# demand_forecast.DEMAND_FEATURES, the forecaster's input columns
+ROUTE_DAILY_FEATURES = ['passengers', 'day_of_week', 'is_weekend', 'is_holiday', 'hour', 'month']
+# Series -> snapshot dataset
+SERIES_DATASETS = {'trips': 'demand_training', 'route_daily': 'demand_daily'}
+TEST_SIZE = 0.2
+SHUFFLE_BUFFER = 10000
+BENCHMARKS = {'mae': 5.0, 'rmse': 8.0, 'mape': 15.0, 'r2': 0.85}
+
+
+def load_data(data_path=None, snapshot=None, series='trips'):
+    """Demand rows from a JSON/Arrow file, a snapshot version or MongoDB"""
+    if data_path:
+        if data_path.endswith('.json'):
+            with open(data_path) as f:
+                return pd.DataFrame(json.load(f))
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        return ipc.open_file(pa.memory_map(data_path, 'r')).read_all().to_pandas()
+
+    sys.path.insert(0, ML_MODELS_DIR)
+    from snapshot import load_snapshot
+    if snapshot:
+        return load_snapshot(SERIES_DATASETS[series], snapshot)
+    if series == 'route_daily':
+        from demand_forecast import fetch_demand_daily_data
+        return fetch_demand_daily_data()
+    from snapshot import fetch_demand_training_data
+    return fetch_demand_training_data()
+
+
+def prepare_rows(df, features, series='trips'):
+    """Feature matrix with the notebook's mean imputation, and the row range of each series
+
+    `trips` is one date-ordered series. `route_daily` has one series per
+    route_id, each in date order.
+    """
+    missing = [column for column in features if column not in df.columns]
+    if series == 'route_daily' and 'route_id' not in df.columns:
+        missing.append('route_id')
+    if missing:
+        raise ValueError(f"Data has no column(s): {', '.join(missing)}")
+
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'])
+    if series == 'route_daily':
+        df['route_id'] = df['route_id'].astype(str)
+        df = df.sort_values(['route_id', 'date'], kind='stable').reset_index(drop=True)
+        ends = np.flatnonzero(df['route_id'].to_numpy()[1:] != df['route_id'].to_numpy()[:-1]) + 1
+        bounds = list(zip(np.r_[0, ends], np.r_[ends, len(df)]))
+    else:
+        df = df.sort_values('date', kind='stable').reset_index(drop=True)
+        bounds = [(0, len(df))]
+    rows = df[features].astype(float)
+    return rows.fillna(rows.mean()).to_numpy(), bounds
+
+
+def split_sequences(bounds, sequence_length):
+    """Start rows of training and test sequences: per series, the first 80% and the rest
+
+    Sequence i is rows[i:i+L] with target rows[i+L], always inside one series.
+    Per series this is train_test_split(shuffle=False).
+    """
+    train_starts, test_starts = [], []
+    for start, end in bounds:
+        n_sequences = end - start - sequence_length
+        if n_sequences <= 0:
+            continue
+        n_train = n_sequences - math.ceil(n_sequences * TEST_SIZE)
+        train_starts.append(np.arange(start, start + n_train))
+        test_starts.append(np.arange(start + n_train, start + n_sequences))
+    train_starts = np.concatenate(train_starts) if train_starts else np.zeros(0, dtype=int)
+    test_starts = np.concatenate(test_starts) if test_starts else np.zeros(0, dtype=int)
+    if len(train_starts) < 10 or not len(test_starts):
+        raise ValueError(f"Need at least 10 training and 1 test sequence of {sequence_length + 1} rows, "
+                         f"got {len(train_starts)} and {len(test_starts)}")
+    return train_starts, test_starts
+
+
+def training_rows(starts, sequence_length, n_rows):
+    """Mask of the rows the training sequences read (inputs and targets)"""
+    covered = np.zeros(n_rows + 1, dtype=int)
+    np.add.at(covered, starts, 1)
+    np.add.at(covered, starts + sequence_length + 1, -1)
+    return np.cumsum(covered[:-1]) > 0
+
+
+def make_dataset(tf, scaled, starts, sequence_length, batch_size, shuffle=False, seed=42):
+    """Streaming (window, next passengers) batches for the sequences starting at `starts`"""
+    rows = tf.constant(scaled, dtype=tf.float32)
+    dataset = tf.data.Dataset.from_tensor_slices(starts.astype(np.int64))
+    if shuffle:
+        dataset = dataset.shuffle(SHUFFLE_BUFFER, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(lambda i: (rows[i:i + sequence_length], rows[i + sequence_length, 0]),
+                          num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def build_lstm_model(tf, input_shape):
+    """The notebook's 128-64-32-16-1 architecture"""
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import LSTM, Dense, Dropout, Input
+
+    model = Sequential([
+        Input(shape=input_shape),
+        LSTM(128, return_sequences=True),
+        Dropout(0.2),
+        LSTM(64, return_sequences=False),
+        Dropout(0.2),
+        Dense(32, activation='relu'),
+        Dropout(0.1),
+        Dense(16, activation='relu'),
+        Dense(1)
+    ])
+    model.compile(optimizer='adam', loss='mse', metrics=['mae', 'mape'])
+    return model
+
+
+def inverse_passengers(y_scaled, scaler, n_features):
+    """Scaled passengers (column 0) back to passenger counts"""
+    padded = np.concatenate([y_scaled.reshape(-1, 1), np.zeros((len(y_scaled), n_features - 1))], axis=1)
+    return scaler.inverse_transform(padded)[:, 0]
+
+
+def demand_metrics(y_true, y_pred):
+    """MAE, RMSE, MAPE (%) and R² as computed by the notebook"""
+    return {
+        'mae': float(mean_absolute_error(y_true, y_pred)),
+        'rmse': float(np.sqrt(mean_squared_error(y_true, y_pred))),
+        'mape': float(np.mean(np.abs((y_true - y_pred) / (y_true + 1e-10))) * 100),
+        'r2_score': float(r2_score(y_true, y_pred))
+    }
+
+
+def run_fingerprint(rows, features, sequence_length, batch_size, series='trips', bounds=None):
+    """Identifies a training run, so a checkpoint is only resumed by the same run"""
+    digest = hashlib.sha256(np.ascontiguousarray(rows).tobytes())
+    digest.update(json.dumps([features, sequence_length, batch_size]).encode())
+    if series != 'trips':
+        digest.update(json.dumps([series, [[int(a), int(b)] for a, b in bounds]]).encode())
+    return digest.hexdigest()[:16]
+
+
+def _best_val_loss(log_path):
+    """Lowest val_loss logged by earlier attempts of a resumed run"""
+    if not os.path.exists(log_path):
+        return None
+    log = pd.read_csv(log_path)
+    return float(log['val_loss'].min()) if 'val_loss' in log and len(log) else None
+
+
+def train(df, out_dir, features=NOTEBOOK_FEATURES, sequence_length=7, epochs=100, batch_size=32, restart=False,
+          series='trips'):
+    """Train (or resume) the demand LSTM and save its artifacts and report"""
+    import tensorflow as tf
+
+    rows, bounds = prepare_rows(df, features, series)
+    train_starts, test_starts = split_sequences(bounds, sequence_length)
+    scaler = MinMaxScaler().fit(rows[training_rows(train_starts, sequence_length, len(rows))])
+    scaled = scaler.transform(rows)
+
+    checkpoint_dir = os.path.join(out_dir, 'checkpoints')
+    run_file = os.path.join(checkpoint_dir, 'run.json')
+    fingerprint = run_fingerprint(rows, features, sequence_length, batch_size, series, bounds)
+    if restart and os.path.exists(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+    if os.path.exists(run_file):
+        with open(run_file) as f:
+            previous = json.load(f)
+        if previous['fingerprint'] != fingerprint:
+            raise SystemExit(f"{checkpoint_dir} belongs to a run on other data or settings. "
+                             f"Use --restart to discard it.")
+        print(f"♻️  Resuming run {fingerprint} from {checkpoint_dir}")
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(run_file, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'series': series, 'features': features,
+                   'sequence_length': sequence_length, 'batch_size': batch_size}, f)
+
+    train_ds = make_dataset(tf, scaled, train_starts, sequence_length, batch_size, shuffle=True)
+    test_ds = make_dataset(tf, scaled, test_starts, sequence_length, batch_size)
+    print(f"✅ {len(train_starts)} training / {len(test_starts)} test sequences from {len(bounds)} series, "
+          f"{len(features)} features")
+
+    model = build_lstm_model(tf, (sequence_length, len(features)))
+    log_path = os.path.join(checkpoint_dir, 'history.csv')
+    best_path = os.path.join(checkpoint_dir, 'best.weights.h5')
+    callbacks = [
+        # Restores weights, optimizer state and the epoch counter after an interruption
+        tf.keras.callbacks.BackupAndRestore(os.path.join(checkpoint_dir, 'backup')),
+        tf.keras.callbacks.ModelCheckpoint(best_path, monitor='val_loss', save_best_only=True,
+                                           save_weights_only=True,
+                                           initial_value_threshold=_best_val_loss(log_path)),
+        tf.keras.callbacks.CSVLogger(log_path, append=True),
+        tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=15, verbose=1),
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=5, min_lr=0.00001, verbose=1)
+    ]
+
+    print("🚀 Starting training...")
+    try:
+        model.fit(train_ds, validation_data=test_ds, epochs=epochs, callbacks=callbacks, verbose=2)
+    except KeyboardInterrupt:
+        print(f"\n⏸️  Interrupted. Re-run the same command to resume from the last completed epoch.")
+        raise SystemExit(130)
+
+    if os.path.exists(best_path):
+        model.load_weights(best_path)
+
+    y_pred = model.predict(test_ds, verbose=0).reshape(-1)
+    y_true = inverse_passengers(scaled[test_starts + sequence_length, 0], scaler, len(features))
+    metrics = demand_metrics(y_true, inverse_passengers(y_pred, scaler, len(features)))
+    epochs_trained = len(pd.read_csv(log_path)) if os.path.exists(log_path) else None
+
+    os.makedirs(out_dir, exist_ok=True)
+    model.save(os.path.join(out_dir, 'demand_lstm_model.h5'))
+    joblib.dump(scaler, os.path.join(out_dir, 'demand_scaler.pkl'))
+    with open(os.path.join(out_dir, 'feature_columns.json'), 'w') as f:
+        json.dump(features, f)
+    # Read by demand_forecast.load_demand_model, which only serves route_daily models
+    with open(os.path.join(out_dir, 'demand_model.json'), 'w') as f:
+        json.dump({'series': series, 'features': features, 'sequence_length': sequence_length}, f)
+
+    report = {
+        'model_info': {
+            'model_type': 'LSTM',
+            'architecture': '128-64-32-16-1',
+            'series': series,
+            'sequence_length': sequence_length,
+            'features': features,
+            'total_parameters': model.count_params()
+        },
+        'training_info': {
+            'run': fingerprint,
+            'series_count': len(bounds),
+            'training_samples': len(train_starts),
+            'test_samples': len(test_starts),
+            'epochs_trained': epochs_trained,
+            'batch_size': batch_size
+        },
+        'performance_metrics': metrics,
+        'benchmarks': {
+            'mae_target': BENCHMARKS['mae'], 'mae_pass': metrics['mae'] < BENCHMARKS['mae'],
+            'rmse_target': BENCHMARKS['rmse'], 'rmse_pass': metrics['rmse'] < BENCHMARKS['rmse'],
+            'mape_target': BENCHMARKS['mape'], 'mape_pass': metrics['mape'] < BENCHMARKS['mape'],
+            'r2_target': BENCHMARKS['r2'], 'r2_pass': metrics['r2_score'] > BENCHMARKS['r2']
+        }
+    }
+    with open(os.path.join(out_dir, 'training_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    # Finished: the next run of this command starts fresh
+    shutil.rmtree(checkpoint_dir)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the demand LSTM headlessly with checkpoint/resume')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--data', help='collect_training_data.js JSON export or snapshot .arrow file')
+    source.add_argument('--snapshot', help="Snapshot version ('latest' or a name); default: MongoDB")
+    parser.add_argument('--series', choices=sorted(SERIES_DATASETS), default='trips',
+                        help="'route_daily' trains the model /forecast/demand serves")
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--sequence-length', type=int, default=7)
+    parser.add_argument('--features', help='Comma-separated feature columns, passengers first '
+                                           '(default: the notebook\'s, or the forecaster\'s for route_daily)')
+    parser.add_argument('--restart', action='store_true', help='Discard checkpoints and train from scratch')
+    args = parser.parse_args()
+
+    default_features = ROUTE_DAILY_FEATURES if args.series == 'route_daily' else NOTEBOOK_FEATURES
+    features = args.features.split(',') if args.features else default_features
+    if features[0] != 'passengers':
+        parser.error("the first feature must be 'passengers' (the prediction target)")
+
+    df = load_data(args.data, args.snapshot, args.series)
+    print(f"✅ Loaded {len(df)} records")
+    report = train(df, args.out, features, args.sequence_length, args.epochs, args.batch_size, args.restart,
+                   args.series)
+
+    metrics = report['performance_metrics']
+    print("\n" + "=" * 50)
+    print("📊 MODEL PERFORMANCE METRICS")
+    print("=" * 50)
+    print(f"Mean Absolute Error (MAE):  {metrics['mae']:.2f} passengers")
+    print(f"Root Mean Squared Error:    {metrics['rmse']:.2f} passengers")
+    print(f"Mean Absolute % Error:      {metrics['mape']:.2f}%")
+    print(f"R² Score:                   {metrics['r2_score']:.4f}")
+    print("=" * 50)
+    print(f"✅ Artifacts saved in {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Bootstrap Confidence Intervals
+==============================
+Percentile bootstrap intervals for the metrics reported by the pipelines
+(MSE/RMSE/MAE/R2_Score for regression, Accuracy/Precision/Recall/F1_Score for
+classification), computed on the test set.
+
+Every metric is a ratio of sums over the test rows (squared errors, absolute
+errors, correct predictions, per-class counts). A bootstrap replicate only
+reweights rows, so all replicates are evaluated together:
+
+- one (replicates x rows) index matrix is drawn and turned into per-row
+  resample counts with a single bincount
+- each sum becomes one matrix-vector product of the counts with a per-row
+  vector, for all replicates at once
+
+The matrix is built in chunks of BOOTSTRAP_CHUNK_CELLS cells, so memory
+stays bounded on large test sets. Values match scikit-learn's metrics on the
+same resample, including zero_division=0 and R² of a constant target.
+
+Usage:
+    test_metrics['confidence_intervals'] = regression_intervals(y_test, y_pred_test)
+    test_metrics['confidence_intervals'] = classification_intervals(y_test, y_pred_test, average='weighted')
+"""
+
+import numpy as np
+
+from config import *
+
+
+def resample_counts(n_rows, replicates=BOOTSTRAP_REPLICATES, random_state=RANDOM_STATE,
+                    chunk_cells=BOOTSTRAP_CHUNK_CELLS):
+    """Yield (chunk replicates x n_rows) matrices of how often each row was drawn"""
+    rng = np.random.default_rng(random_state)
+    chunk = max(1, min(replicates, chunk_cells // max(n_rows, 1)))
+    for start in range(0, replicates, chunk):
+        size = min(chunk, replicates - start)
+        index = rng.integers(0, n_rows, size=(size, n_rows))
+        index += np.arange(size)[:, None] * n_rows
+        yield np.bincount(index.ravel(), minlength=size * n_rows).reshape(size, n_rows).astype(np.float64)
+
+
+def _divide(numerator, denominator):
+    """Elementwise ratio that is 0 where the denominator is 0 (zero_division=0)"""
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=np.float64),
+                     where=denominator != 0)
+
+
+def _summarize(replicates, confidence):
+    """Percentile interval and standard error of each metric's replicate values"""
+    tail = (1 - confidence) / 2 * 100
+    intervals = {
+        name: {
+            'low': float(np.percentile(values, tail)),
+            'high': float(np.percentile(values, 100 - tail)),
+            'std': float(np.std(values))
+        }
+        for name, values in replicates.items()
+    }
+    return {'confidence': confidence, 'replicates': len(next(iter(replicates.values()))), **intervals}
+
+
+def _collect(chunks):
+    """Concatenate per-chunk metric arrays into one array per metric"""
+    chunks = list(chunks)
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def regression_intervals(y_true, y_pred, replicates=BOOTSTRAP_REPLICATES, confidence=BOOTSTRAP_CONFIDENCE):
+    """Bootstrap intervals of MSE, RMSE, MAE and R2_Score; None if disabled or no rows"""
+    y_true = np.asarray(y_true, dtype=np.float64).ravel()
+    y_pred = np.asarray(y_pred, dtype=np.float64).ravel()
+    n_rows = len(y_true)
+    if replicates <= 0 or n_rows == 0:
+        return None
+
+    error = y_pred - y_true
+    centered = y_true - y_true.mean()  # keeps the total sum of squares numerically stable
+    per_row = np.column_stack([error ** 2, np.abs(error), centered, centered ** 2])
+
+    def chunk_metrics(counts):
+        squared, absolute, total, total_squared = (counts @ per_row).T
+        mse = squared / n_rows
+        ss_tot = total_squared - total ** 2 / n_rows
+        constant = ss_tot <= 1e-12 * max(float(per_row[:, 3].sum()), 1.0)
+        r2 = np.where(constant, np.where(squared == 0, 1.0, 0.0), 1 - squared / np.where(constant, 1, ss_tot))
+        return {'MSE': mse, 'RMSE': np.sqrt(mse), 'MAE': absolute / n_rows, 'R2_Score': r2}
+
+    return _summarize(_collect(chunk_metrics(counts) for counts in resample_counts(n_rows, replicates)),
+                      confidence)
+
+
+def classification_intervals(y_true, y_pred, average='binary', pos_label=1,
+                             replicates=BOOTSTRAP_REPLICATES, confidence=BOOTSTRAP_CONFIDENCE):
+    """Bootstrap intervals of Accuracy, Precision, Recall and F1_Score; None if disabled or no rows
+
+    average is 'binary' (scores of pos_label) or 'weighted' (per-class scores
+    weighted by the class's support in the resample), as in scikit-learn.
+    """
+    y_true = np.asarray(y_true).ravel()
+    y_pred = np.asarray(y_pred).ravel()
+    n_rows = len(y_true)
+    if replicates <= 0 or n_rows == 0:
+        return None
+
+    labels, codes = np.unique(np.concatenate([y_true, y_pred]), return_inverse=True)
+    true_codes, pred_codes = codes[:n_rows], codes[n_rows:]
+    if average == 'binary':
+        positive = np.flatnonzero(labels == pos_label)
+        columns = positive if len(positive) else np.array([len(labels)])  # absent label scores 0
+    elif average == 'weighted':
+        columns = np.arange(len(labels))
+    else:
+        raise ValueError("average must be 'binary' or 'weighted'")
+
+    correct = (true_codes == pred_codes).astype(np.float64)
+    true_onehot = (true_codes[:, None] == columns).astype(np.float64)
+    pred_onehot = (pred_codes[:, None] == columns).astype(np.float64)
+    per_row = np.column_stack([correct, true_onehot, pred_onehot, true_onehot * correct[:, None]])
+    k = len(columns)
+
+    def chunk_metrics(counts):
+        sums = counts @ per_row
+        accuracy = sums[:, 0] / n_rows
+        support, predicted, hits = sums[:, 1:1 + k], sums[:, 1 + k:1 + 2 * k], sums[:, 1 + 2 * k:]
+        precision = _divide(hits, predicted)
+        recall = _divide(hits, support)
+        f1 = _divide(2 * hits, support + predicted)
+        if average == 'binary':
+            return {'Accuracy': accuracy, 'Precision': precision[:, 0], 'Recall': recall[:, 0], 'F1_Score': f1[:, 0]}
+        weights = _divide(support, support.sum(axis=1, keepdims=True))
+        return {
+            'Accuracy': accuracy,
+            'Precision': (weights * precision).sum(axis=1),
+            'Recall': (weights * recall).sum(axis=1),
+            'F1_Score': (weights * f1).sum(axis=1)
+        }
+
+    return _summarize(_collect(chunk_metrics(counts) for counts in resample_counts(n_rows, replicates)),
+                      confidence)
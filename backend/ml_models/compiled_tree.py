@@ -0,0 +1,190 @@
+"""
+Compiled Decision Tree
+======================
+Exports a fitted scikit-learn decision tree into flat node arrays and
+evaluates it without estimator overhead (input validation, dtype checks,
+per-call dispatch), which dominates the cost of a depth-5 tree.
+
+- predict_one: plain Python walk over lists for a single trip, where
+  estimator overhead dominates
+- predict_proba / predict / apply: vectorized, one gather + compare per tree
+  level for all rows at once (leaves loop back to themselves, so every row
+  takes exactly max_depth steps). Used for the parity check; in bulk,
+  scikit-learn's own traversal is about twice as fast (`benchmark`), so
+  batch scoring keeps the estimator
+
+Thresholds are compared against float32 inputs, as scikit-learn does, so
+results are identical to the estimator's output.
+
+Usage:
+    python compiled_tree.py benchmark [--rows 1000000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from config import *
+from utils import load_model_artifact
+
+
+TREE_LEAF = -1
+
+
+class CompiledTree:
+    """Flat-array form of a fitted DecisionTreeClassifier"""
+
+    def __init__(self, feature, threshold, left, right, missing_left, proba, classes, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.proba = proba
+        self.classes = classes
+        self.max_depth = max_depth
+        self._lists = None
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Compile a fitted DecisionTreeClassifier"""
+        tree = model.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == TREE_LEAF
+
+        # Leaves point to themselves and compare feature 0 against +inf
+        left = np.where(is_leaf, nodes, tree.children_left).astype(np.intp)
+        right = np.where(is_leaf, nodes, tree.children_right).astype(np.intp)
+        feature = np.where(is_leaf, 0, tree.feature).astype(np.intp)
+        threshold = np.where(is_leaf, np.inf, tree.threshold)
+        missing_left = getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=np.uint8)).astype(bool)
+        missing_left = missing_left | is_leaf
+
+        value = tree.value[:, 0, :]
+        proba = value / value.sum(axis=1, keepdims=True)
+
+        return cls(feature, threshold, left, right, missing_left, proba,
+                   np.asarray(model.classes_), int(tree.max_depth))
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+    def apply(self, X):
+        """Leaf index per row"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        row_base = np.arange(n_rows, dtype=np.int64) * n_features
+        has_missing = bool(np.isnan(flat).any())
+
+        node = np.zeros(n_rows, dtype=np.intp)
+        for _ in range(self.max_depth):
+            values = flat.take(row_base + self.feature.take(node))
+            go_left = values <= self.threshold.take(node)
+            if has_missing:
+                go_left |= np.isnan(values) & self.missing_left.take(node)
+            node = np.where(go_left, self.left.take(node), self.right.take(node))
+        return node
+
+    def predict_proba(self, X):
+        return self.proba[self.apply(X)]
+
+    def predict(self, X):
+        return self.classes[self.proba[self.apply(X)].argmax(axis=1)]
+
+    def predict_one(self, x):
+        """Class probabilities for a single row (sequence of feature values)"""
+        if self._lists is None:
+            self._lists = (self.feature.tolist(), self.threshold.tolist(), self.left.tolist(),
+                           self.right.tolist(), self.missing_left.tolist(), self.proba.tolist())
+        feature, threshold, left, right, missing_left, proba = self._lists
+
+        x = np.asarray(x, dtype=np.float32).tolist()
+        node = 0
+        while left[node] != node:
+            value = x[feature[node]]
+            if value != value:
+                node = left[node] if missing_left[node] else right[node]
+            elif value <= threshold[node]:
+                node = left[node]
+            else:
+                node = right[node]
+        return proba[node]
+
+
+def verify_against_sklearn(model, compiled, X):
+    """Check the compiled tree reproduces scikit-learn's predictions exactly"""
+    X = np.asarray(X, dtype=float)
+    expected_proba = model.predict_proba(X)
+    actual_proba = compiled.predict_proba(X)
+    single = [compiled.predict_one(row) for row in X[:1000]]
+
+    result = {
+        'rows_checked': int(len(X)),
+        'predict_equal': bool(np.array_equal(model.predict(X), compiled.predict(X))),
+        'proba_equal': bool(np.array_equal(expected_proba, actual_proba)),
+        'leaves_equal': bool(np.array_equal(model.apply(X), compiled.apply(X))),
+        'single_row_equal': bool(np.array_equal(np.array(single).reshape(-1, len(compiled.classes)),
+                                                expected_proba[:1000]))
+    }
+    result['equal'] = all(result[key] for key in ('predict_equal', 'proba_equal', 'leaves_equal', 'single_row_equal'))
+    return result
+
+
+def benchmark(model, compiled, n_rows=1_000_000, single_repeats=10000):
+    """Time single-row and bulk evaluation, compiled vs scikit-learn"""
+    rng = np.random.default_rng(RANDOM_STATE)
+    X = rng.normal(size=(n_rows, model.n_features_in_)) * 20 + 10
+    row = X[0]
+
+    start = time.perf_counter()
+    for _ in range(single_repeats):
+        compiled.predict_one(row)
+    compiled_single_us = (time.perf_counter() - start) / single_repeats * 1e6
+
+    repeats = min(single_repeats, 1000)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict_proba(row.reshape(1, -1))
+    sklearn_single_us = (time.perf_counter() - start) / repeats * 1e6
+
+    start = time.perf_counter()
+    compiled.predict_proba(X)
+    compiled_bulk = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.predict_proba(X)
+    sklearn_bulk = time.perf_counter() - start
+
+    return {
+        'rows': n_rows,
+        'nodes': compiled.node_count,
+        'max_depth': compiled.max_depth,
+        'single_row_us': {'compiled': round(compiled_single_us, 2), 'sklearn': round(sklearn_single_us, 2)},
+        'bulk_seconds': {'compiled': round(compiled_bulk, 4), 'sklearn': round(sklearn_bulk, 4)},
+        'parity': verify_against_sklearn(model, compiled, X[:100000])
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the compiled delay-prediction tree')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark', help='Compare compiled vs scikit-learn evaluation')
+    bench_parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    artifact = load_model_artifact('dt_delay_prediction')
+    model = artifact['model']
+    compiled = artifact.get('compiled') or CompiledTree.from_sklearn(model)
+
+    result = benchmark(model, compiled, args.rows)
+    print(f"🌳 {result['nodes']} nodes, depth {result['max_depth']}")
+    print(f"⏱️  Single row: {result['single_row_us']['compiled']} µs compiled vs {result['single_row_us']['sklearn']} µs sklearn")
+    print(f"⏱️  {result['rows']} rows: {result['bulk_seconds']['compiled']} s compiled vs {result['bulk_seconds']['sklearn']} s sklearn")
+    print(f"{'✅' if result['parity']['equal'] else '❌'} Parity: {result['parity']}")
+
+
+if __name__ == '__main__':
+    main()
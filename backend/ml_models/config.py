@@ -18,11 +18,111 @@ CREW_COLLECTION = 'crews'
 DRIVERS_COLLECTION = 'drivers'
 CONDUCTORS_COLLECTION = 'conductors'
 ML_REPORTS_COLLECTION = 'ml_reports'
+TRAINING_STATE_COLLECTION = 'ml_training_state'
+TRAINING_CACHE_COLLECTION = 'ml_training_cache'
+DEMAND_PREDICTIONS_COLLECTION = 'demandpredictions'
+CREW_FATIGUE_COLLECTION = 'crewfatigues'
+DELAY_PREDICTIONS_COLLECTION = 'trip_delay_predictions'
+DUTIES_COLLECTION = 'duties'
+JOBS_COLLECTION = 'ml_jobs'
+ROUTE_FEATURES_COLLECTION = 'route_daily_features'
+FEATURE_STORE_STATE_COLLECTION = 'ml_feature_store_state'
+FEATURE_STORE_KEYS_COLLECTION = 'route_daily_feature_keys'
+
+# ml_reports Retention: the newest REPORT_KEEP_FULL reports per model stay complete;
+# older ones are compacted to metrics-only summaries or expired after REPORT_TTL_DAYS
+REPORT_KEEP_FULL = max(1, int(os.getenv('ML_REPORT_KEEP_FULL', 20)))
+REPORT_RETENTION = os.getenv('ML_REPORT_RETENTION', 'compact')  # 'compact', 'expire' or 'off'
+REPORT_TTL_DAYS = float(os.getenv('ML_REPORT_TTL_DAYS', 30))  # 'expire': days after the run
 
 # Model Settings
 RANDOM_STATE = 42
 TEST_SIZE = 0.2
 
+# Split Registry: stored train/test/fold assignments per entity key
+SPLIT_DIR = os.getenv('ML_SPLIT_DIR', os.path.join(os.path.dirname(__file__), 'splits'))
+SPLIT_FOLDS = int(os.getenv('ML_SPLIT_FOLDS', 5))  # cross-validation folds over the training entities
+
+# Bootstrap confidence intervals of test metrics (0 replicates disables them)
+BOOTSTRAP_REPLICATES = int(os.getenv('ML_BOOTSTRAP_REPLICATES', 1000))
+BOOTSTRAP_CONFIDENCE = float(os.getenv('ML_BOOTSTRAP_CONFIDENCE', 0.95))
+BOOTSTRAP_CHUNK_CELLS = 4_000_000  # replicates x test rows resampled per batch
+
+# Permutation feature importance on the test set
+IMPORTANCE_REPEATS = int(os.getenv('ML_IMPORTANCE_REPEATS', 5))  # shuffles per feature (0 disables)
+IMPORTANCE_MAX_ROWS = int(os.getenv('ML_IMPORTANCE_MAX_ROWS', 2000))  # test rows sampled for scoring
+IMPORTANCE_TIME_BUDGET = float(os.getenv('ML_IMPORTANCE_TIME_BUDGET', 30))  # seconds; later shuffles are skipped
+IMPORTANCE_WORKERS = int(os.getenv('ML_IMPORTANCE_WORKERS', 0))  # 0 = one per available core
+
+# Trained model artifacts (joblib) used by batch scoring
+ARTIFACT_DIR = os.getenv('ML_ARTIFACT_DIR', os.path.join(os.path.dirname(__file__), 'artifacts'))
+
+# Batch Scoring
+SCORING_BATCH_SIZE = int(os.getenv('ML_SCORING_BATCH_SIZE', 1000))
+
+# Roster-wide crew fitness scoring target (depot of several hundred crew)
+CREW_FITNESS_LATENCY_MS = int(os.getenv('ML_CREW_FITNESS_LATENCY_MS', 500))
+# The roster reads this many days of duties beyond the longest workload window; longer streaks are capped
+CREW_STREAK_CAP_DAYS = int(os.getenv('ML_CREW_STREAK_CAP_DAYS', 30))
+
 # Visualization Settings
 FIG_SIZE = (12, 6)
 DPI = 100
+
+# Dataset Snapshots
+SNAPSHOT_DIR = os.getenv('ML_SNAPSHOT_DIR', os.path.join(os.path.dirname(__file__), 'snapshots'))
+SNAPSHOT_VERSION = os.getenv('ML_SNAPSHOT_VERSION')  # e.g. 'latest' to train from snapshots
+
+# Sampling Budgets (unset = train on full history)
+SAMPLE_BUDGET = int(os.getenv('ML_SAMPLE_BUDGET', 0))
+SAMPLE_STRATEGY = os.getenv('ML_SAMPLE_STRATEGY', 'uniform')
+
+# Retraining Scheduler
+SCHEDULER_ENABLED = os.getenv('ML_SCHEDULER_ENABLED', 'false').lower() == 'true'
+SCHEDULER_INTERVAL = int(os.getenv('ML_SCHEDULER_INTERVAL', 3600))  # seconds between checks
+DRIFT_THRESHOLD = float(os.getenv('ML_DRIFT_THRESHOLD', 0.05))  # fraction of changed documents
+SCHEDULER_STAGGER = int(os.getenv('ML_SCHEDULER_STAGGER', 60))  # seconds between retrains
+
+# Index Advisor
+INDEX_CHECK_ON_STARTUP = os.getenv('ML_INDEX_CHECK', 'true').lower() == 'true'
+CREATE_MISSING_INDEXES = os.getenv('ML_CREATE_INDEXES', 'false').lower() == 'true'
+EXPLAIN_PROBE_DOCS = int(os.getenv('ML_EXPLAIN_PROBE_DOCS', 100))  # source docs run through explain
+
+# Training Coalescing
+MIN_RETRAIN_INTERVAL = int(os.getenv('ML_MIN_RETRAIN_INTERVAL', 60))  # seconds between retrains of a model
+TRAINING_LEASE_SECONDS = int(os.getenv('ML_TRAINING_LEASE', 3600))  # cross-process lease; expires if a worker dies
+TRAINING_LEASE_POLL = float(os.getenv('ML_TRAINING_LEASE_POLL', 2))
+
+# Supervised Training Jobs
+JOB_TIMEOUT = int(os.getenv('ML_JOB_TIMEOUT', 1800))  # wall-clock seconds per model run
+JOB_MEMORY_MB = int(os.getenv('ML_JOB_MEMORY_MB', 4096))  # RSS ceiling per model run
+JOB_POLL_SECONDS = float(os.getenv('ML_JOB_POLL', 0.5))
+JOB_START_METHOD = os.getenv('ML_JOB_START_METHOD', 'spawn')
+
+# Per-stage memory accounting of pipeline runs
+MEMORY_TRACE = os.getenv('ML_MEMORY_TRACE', 'false').lower() == 'true'  # tracemalloc peaks (slows allocation; opt-in)
+MEMORY_WARN_MB = int(os.getenv('ML_MEMORY_WARN_MB', 512))  # warn when a stage uses more (0 disables)
+
+# CPU Thread Budget
+THREAD_BUDGET_ENABLED = os.getenv('ML_THREAD_BUDGET', 'true').lower() == 'true'
+SERVING_CORES = int(os.getenv('ML_SERVING_CORES', 1))  # reserved for the HTTP path
+JOB_SLOTS = int(os.getenv('ML_JOB_SLOTS', 2))  # concurrent trainings; the other cores are split between them
+JOB_NICE = int(os.getenv('ML_JOB_NICE', 5))
+THREAD_BUDGET_DIR = os.getenv('ML_THREAD_BUDGET_DIR', '/tmp/yatrik-ml-slots')
+
+# Route-Daily Feature Store
+FEATURE_STORE_ENABLED = os.getenv('ML_FEATURE_STORE', 'true').lower() == 'true'
+FEATURE_STORE_DAYS_PER_BATCH = 31  # changed days recomputed per $merge aggregation
+FEATURE_STORE_LEASE_SECONDS = int(os.getenv('ML_FEATURE_STORE_LEASE', 600))  # renewed per batch; expires if a refresh dies
+FEATURE_STORE_LEASE_POLL = float(os.getenv('ML_FEATURE_STORE_LEASE_POLL', 1))
+
+# Demand Forecasting (LSTM from ml-research/demand_prediction_lstm.py)
+DEMAND_MODEL_PATH = os.getenv('ML_DEMAND_MODEL', os.path.join(ARTIFACT_DIR, 'demand_lstm_model.h5'))
+DEMAND_SCALER_PATH = os.getenv('ML_DEMAND_SCALER', os.path.join(ARTIFACT_DIR, 'demand_scaler.pkl'))
+# Written by train_demand_lstm.py next to the model: series, features and sequence length
+DEMAND_MODEL_INFO_PATH = os.getenv('ML_DEMAND_MODEL_INFO', os.path.join(ARTIFACT_DIR, 'demand_model.json'))
+# NumPy inference export of DEMAND_MODEL_PATH (python lstm_export.py export); served instead of Keras.
+# Experimental: parity and latency against Keras not yet measured (see ML_SERVICE_PRODUCTION.md)
+DEMAND_NUMPY_MODEL_PATH = os.getenv('ML_DEMAND_NUMPY_MODEL', os.path.join(ARTIFACT_DIR, 'demand_lstm_numpy.npz'))
+FORECAST_MAX_HORIZON = int(os.getenv('ML_FORECAST_MAX_HORIZON', 30))  # days
+FORECAST_CACHE_SIZE = int(os.getenv('ML_FORECAST_CACHE_SIZE', 10000))  # (route, horizon, model, day) entries
@@ -0,0 +1,245 @@
+"""
+Crew Workload Window Engine
+===========================
+Computes per-duty crew workload windows for every crew member at once using
+sorted, segmented array operations (no per-crew Python loops):
+
+- consecutive_days: true streak of consecutive calendar days worked
+- duty_number:      running count of duties per crew
+- hours_7d:         shift hours in the trailing 7 days (inclusive)
+- trips_7d:         trips in the trailing 7 days
+- night_shifts_14d: night-shift duties in the trailing 14 days
+- rest_gap_hours:   hours between the end of the previous duty and this start
+
+Rows are sorted by (crew, time). Rolling sums use prefix sums with
+`searchsorted` on a combined (crew, day) key, so every window is answered in
+O(log n) without crossing crew boundaries.
+
+Ties on (crew, start) are ordered by duty_id when the frame has one (the
+roster fetch does), otherwise they keep the input order (the sort is
+stable).
+
+Training and the roster endpoint recompute the windows from the fetched
+duty history. `CrewWindowState` maintains them incrementally for the
+crew_fitness batch job: per crew it keeps the duties of the last
+MAX_WINDOW_DAYS days worked, how many earlier duties were trimmed away and
+the streak carried into the first kept day. New duties are folded into that
+tail and get exactly the values a full recompute would give them. A crew
+whose new duty sorts before one already folded, or whose folded duty
+changed, is reported for a rebuild from its full history instead.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+WINDOWS = {
+    'hours_7d': ('shift_hours', 7),
+    'trips_7d': ('trips_count', 7),
+    'night_shifts_14d': ('is_night_shift', 14),
+}
+MAX_WINDOW_DAYS = max(days for _, days in WINDOWS.values())
+
+NIGHT_START_HOUR = 20
+NIGHT_END_HOUR = 5
+
+NS_PER_DAY = 86400 * 10**9
+NS_PER_HOUR = 3600 * 10**9
+
+
+def _segment_starts(codes):
+    """Boolean mask marking the first row of each crew segment"""
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = codes[1:] != codes[:-1]
+    return starts
+
+
+def _rolling_sum(keys, values, window):
+    """Sum of values with key in (key - window, key] for each row; keys sorted"""
+    prefix = np.concatenate([[0.0], np.cumsum(values, dtype=float)])
+    left = np.searchsorted(keys, keys - window + 1, side='left')
+    right = np.arange(1, len(keys) + 1)
+    return prefix[right] - prefix[left]
+
+
+def compute_crew_windows(df):
+    """Add streak, rolling and rest-gap columns to a duty frame
+
+    Expects columns: crew_id, date, and optionally start_time, shift_hours,
+    trips_count, duty_id. Returns a copy sorted by (crew_id, start, duty_id).
+    """
+    return _windows(df).drop(columns=['_day', '_start_ns'])
+
+
+def _windows(df):
+    """compute_crew_windows, keeping each duty's day number and start (ns) as _day and _start_ns"""
+    if df.empty:
+        return df.assign(**{name: pd.Series(dtype=float) for name in
+                            ['consecutive_days', 'duty_number', 'rest_gap_hours', *WINDOWS, '_day', '_start_ns']})
+
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    start = pd.to_datetime(df['start_time'], errors='coerce') if 'start_time' in df else pd.Series(pd.NaT, index=df.index)
+    df['_start'] = start.fillna(df['date'])
+    df = df.dropna(subset=['crew_id', '_start'])
+
+    codes, _ = pd.factorize(df['crew_id'])
+    start_ns = df['_start'].values.astype('datetime64[ns]').astype(np.int64)
+    tie = np.unique(df['duty_id'].astype(str).to_numpy(), return_inverse=True)[1] if 'duty_id' in df \
+        else np.zeros(len(df), dtype=np.int64)
+    order = np.lexsort((tie, start_ns, codes))
+    df = df.iloc[order].reset_index(drop=True)
+    codes = codes[order]
+    start_ns = start_ns[order]
+
+    n = len(df)
+    index = np.arange(n)
+    seg_start = _segment_starts(codes)
+    seg_first = np.maximum.accumulate(np.where(seg_start, index, 0))
+
+    # Streaks over distinct calendar days
+    day = start_ns // NS_PER_DAY
+    gap = np.empty(n, dtype=np.int64)
+    gap[0] = 0
+    gap[1:] = day[1:] - day[:-1]
+    new_day = seg_start | (gap != 0)
+    streak_break = seg_start | (gap > 1)
+    distinct_days = np.cumsum(new_day)
+    run_first = np.maximum.accumulate(np.where(streak_break, index, 0))
+    df['consecutive_days'] = distinct_days - distinct_days[run_first] + 1
+    df['duty_number'] = index - seg_first + 1
+
+    # Rolling window sums on a (crew, day) key that never overlaps across crews
+    span = int(day.max() - day.min()) + MAX_WINDOW_DAYS + 1
+    keys = codes.astype(np.int64) * span + (day - day.min())
+
+    shift_hours = df['shift_hours'].fillna(0).to_numpy(dtype=float) if 'shift_hours' in df else np.zeros(n)
+    hour_of_start = (start_ns % NS_PER_DAY) // NS_PER_HOUR
+    has_start_time = df['start_time'].notna().to_numpy() if 'start_time' in df else np.zeros(n, dtype=bool)
+    df['is_night_shift'] = has_start_time & ((hour_of_start >= NIGHT_START_HOUR) | (hour_of_start < NIGHT_END_HOUR))
+
+    for name, (column, days) in WINDOWS.items():
+        values = df[column].fillna(0).to_numpy(dtype=float) if column in df else np.zeros(n)
+        df[name] = _rolling_sum(keys, values, days)
+
+    # Rest gap: previous duty's end to this duty's start
+    previous_end = np.empty(n, dtype=float)
+    previous_end[0] = np.nan
+    previous_end[1:] = start_ns[:-1] + shift_hours[:-1] * NS_PER_HOUR
+    rest_gap = (start_ns - previous_end) / NS_PER_HOUR
+    rest_gap[seg_start] = np.nan
+    df['rest_gap_hours'] = rest_gap
+    df['_day'] = day
+    df['_start_ns'] = start_ns
+
+    return df.drop(columns=['_start'])
+
+
+WINDOW_COLUMNS = ['consecutive_days', 'duty_number', 'rest_gap_hours', 'is_night_shift', *WINDOWS]
+
+
+class CrewWindowState:
+    """Crew windows maintained incrementally over a bounded tail of duties per crew
+
+    Needs a duty_id column, so folded duties can be recognised when they change.
+    """
+
+    def __init__(self):
+        self.tail = pd.DataFrame()   # duties of each crew's last MAX_WINDOW_DAYS days worked, without windows
+        self.latest = pd.DataFrame()  # window row of each crew's most recent duty
+        self.duty_offsets = {}        # crew -> duties trimmed from the tail
+        self.streak_offsets = {}      # crew -> streak (days) before the first kept day
+        self.last_key = {}            # crew -> (start ns, duty_id) of the last folded duty
+        self.seen = {}                # crew -> ids of every folded duty
+
+    @classmethod
+    def from_history(cls, history):
+        state = cls()
+        state.rebuild(history)
+        return state
+
+    def rebuild(self, history):
+        """Replace the state of the crews in `history` (their full duty history); returns its windows"""
+        if history is None or history.empty:
+            return pd.DataFrame()
+        crews = set(history['crew_id'])
+        self._drop(crews)
+        windows = _windows(history)
+        self._absorb(windows)
+        return self._public(windows)
+
+    def fold(self, duties):
+        """Fold new duties in; returns (their windows, crews that need a rebuild from full history)"""
+        if duties is None or duties.empty:
+            return pd.DataFrame(), set()
+
+        start = pd.to_datetime(duties['start_time'], errors='coerce') if 'start_time' in duties else \
+            pd.Series(pd.NaT, index=duties.index)
+        start_ns = start.fillna(pd.to_datetime(duties['date'], errors='coerce')).values \
+            .astype('datetime64[ns]').astype(np.int64)
+        ids = duties['duty_id'].astype(str).to_numpy()
+
+        stale = set()
+        for crew_id, duty_start, duty_id in zip(duties['crew_id'], start_ns, ids):
+            last = self.last_key.get(crew_id)
+            if duty_id in self.seen.get(crew_id, ()) or (last is not None and (duty_start, duty_id) <= last):
+                stale.add(crew_id)
+
+        fresh = duties[~duties['crew_id'].isin(stale)].assign(_is_new=True)
+        if fresh.empty:
+            return pd.DataFrame(), stale
+        crews = set(fresh['crew_id'])
+        tail = self.tail[self.tail['crew_id'].isin(crews)].assign(_is_new=False) if not self.tail.empty \
+            else pd.DataFrame()
+        windows = self._offset(_windows(pd.concat([tail, fresh], ignore_index=True)))
+
+        self._drop(crews, keep_offsets=True)
+        self._absorb(windows)
+        new = windows[windows['_is_new'].astype(bool)]
+        return self._public(new).drop(columns=['_is_new']), stale
+
+    def _offset(self, windows):
+        """Add the trimmed duties and the carried-in streak to tail-relative windows"""
+        crew = windows['crew_id']
+        windows['duty_number'] += crew.map(self.duty_offsets).fillna(0).astype(int)
+        first_day = windows.groupby('crew_id')['_day'].transform('min')
+        # Rows whose streak runs unbroken from the first kept day continue the carried-in streak
+        unbroken = windows['consecutive_days'] == windows['_day'] - first_day + 1
+        windows['consecutive_days'] += np.where(unbroken, crew.map(self.streak_offsets).fillna(0), 0).astype(int)
+        return windows
+
+    def _drop(self, crews, keep_offsets=False):
+        if not self.tail.empty:
+            self.tail = self.tail[~self.tail['crew_id'].isin(crews)]
+        if not self.latest.empty:
+            self.latest = self.latest[~self.latest['crew_id'].isin(crews)]
+        if not keep_offsets:
+            for crew_id in crews:
+                for offsets in (self.duty_offsets, self.streak_offsets, self.last_key, self.seen):
+                    offsets.pop(crew_id, None)
+
+    def _absorb(self, windows):
+        """Take the windows of whole crews: record their latest row, ids and last key, and trim their tail"""
+        windows = windows.drop(columns=['_is_new'], errors='ignore')
+        last_rows = windows.groupby('crew_id', sort=False).tail(1)
+        self.latest = pd.concat([self.latest, self._public(last_rows)], ignore_index=True)
+        for crew_id, ids in windows.groupby('crew_id', sort=False)['duty_id']:
+            self.seen.setdefault(crew_id, set()).update(ids.astype(str))
+        for crew_id, start_ns, duty_id in zip(last_rows['crew_id'], last_rows['_start_ns'], last_rows['duty_id']):
+            self.last_key[crew_id] = (int(start_ns), str(duty_id))
+
+        last_day = windows.groupby('crew_id')['_day'].transform('max')
+        keep = (last_day - windows['_day']) < MAX_WINDOW_DAYS
+        for crew_id, count in windows[~keep].groupby('crew_id').size().items():
+            self.duty_offsets[crew_id] = self.duty_offsets.get(crew_id, 0) + int(count)
+        first_kept = windows[keep].groupby('crew_id', sort=False).head(1)
+        for crew_id, streak in zip(first_kept['crew_id'], first_kept['consecutive_days']):
+            self.streak_offsets[crew_id] = int(streak) - 1
+
+        kept = windows.loc[keep, [c for c in windows.columns if c not in WINDOW_COLUMNS and not c.startswith('_')]]
+        self.tail = pd.concat([self.tail, kept], ignore_index=True)
+
+    @staticmethod
+    def _public(windows):
+        return windows.drop(columns=['_day', '_start_ns'], errors='ignore').reset_index(drop=True)
+
@@ -0,0 +1,471 @@
+"""
+Multi-Horizon Demand Forecasting
+================================
+N-day-ahead passenger forecasts per route from the LSTM trained by
+`ml-research/train_demand_lstm.py --series route_daily` (model at
+DEMAND_MODEL_PATH, scaler at DEMAND_SCALER_PATH, demand_model.json at
+DEMAND_MODEL_INFO_PATH). Its NumPy export (lstm_export.py,
+DEMAND_NUMPY_MODEL_PATH; experimental, not yet verified against Keras) is
+served instead when present, without importing TensorFlow.
+
+- History: daily passengers (seats booked on trips departing that day) and
+  the trip-weighted mean departure hour per route, read from
+  `route_daily_features` in one aggregation for every requested route.
+  The model is trained on the same series (fetch_demand_daily_data, snapshot
+  dataset 'demand_daily'); a model whose demand_model.json says otherwise,
+  e.g. one trained on the notebook's per-trip rows, is refused
+- Batched generation: all routes are forecast together. Each step is one
+  model call on a (routes, sequence_length, features) batch; the predictions
+  are appended to every window at once, so a horizon of H costs H model calls
+  whatever the number of routes
+- Cache: one entry per (route, horizon, model version, first forecast day).
+  New or changed bookings (`updatedAt` past the last one seen) refresh the
+  feature store and drop the entries of the routes they belong to; a new
+  model file changes the version and drops everything
+
+Usage:
+    python demand_forecast.py [--routes id1,id2] [--horizon 7]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+
+from config import *
+from utils import get_mongo_client
+from feature_store import refresh_route_daily_features
+from lstm_export import NumpyLSTM
+
+
+# Input columns of the LSTM, in the order the scaler was fitted on
+DEMAND_FEATURES = ['passengers', 'day_of_week', 'is_weekend', 'is_holiday', 'hour', 'month']
+
+
+def calendar_features(dates):
+    """day_of_week (Monday=0), is_weekend, is_holiday and month for each date"""
+    dates = pd.DatetimeIndex(dates)
+    day_of_week = np.asarray(dates.dayofweek, dtype=float)
+    return {
+        'day_of_week': day_of_week,
+        'is_weekend': (day_of_week >= 5).astype(float),
+        'is_holiday': np.zeros(len(dates)),
+        'month': np.asarray(dates.month, dtype=float)
+    }
+
+
+def feature_rows(passengers, hours, dates):
+    """Stack per-route values for the given dates into (routes, days, features) in DEMAND_FEATURES order"""
+    calendar = calendar_features(dates)
+    n_routes = passengers.shape[0]
+    columns = {
+        'passengers': passengers,
+        'hour': hours,
+        **{name: np.broadcast_to(values, (n_routes, len(dates))) for name, values in calendar.items()}
+    }
+    return np.stack([columns[name] for name in DEMAND_FEATURES], axis=-1)
+
+
+class DemandModel:
+    """LSTM and scaler loaded for inference, with a content-derived version"""
+
+    def __init__(self, predict, scaler, sequence_length, version):
+        self.predict = predict
+        self.scaler = scaler
+        self.sequence_length = sequence_length
+        self.version = version
+
+
+def _file_version(*paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _use_numpy_export(model_path, numpy_path):
+    """The NumPy export is served when present and not older than the Keras file"""
+    return os.path.exists(numpy_path) and (
+        not os.path.exists(model_path) or os.path.getmtime(numpy_path) >= os.path.getmtime(model_path)
+    )
+
+
+TRAIN_HINT = "Train with ml-research/train_demand_lstm.py --series route_daily and copy its " \
+             "demand_lstm_model.h5, demand_scaler.pkl and demand_model.json to"
+
+
+def check_model_info(info_path=DEMAND_MODEL_INFO_PATH):
+    """demand_model.json of the model, if it was trained on the per-route daily series this module serves"""
+    if not os.path.exists(info_path):
+        raise FileNotFoundError(f"No demand model info at {info_path}. {TRAIN_HINT} {ARTIFACT_DIR}.")
+    with open(info_path) as f:
+        info = json.load(f)
+    if info.get('series') != 'route_daily' or info.get('features') != DEMAND_FEATURES:
+        raise RuntimeError(f"The demand model was trained on series {info.get('series')!r} with features "
+                           f"{info.get('features')}, but /forecast/demand serves per-route daily series with "
+                           f"{DEMAND_FEATURES}. {TRAIN_HINT} {ARTIFACT_DIR}.")
+    return info
+
+
+def load_demand_model(model_path=DEMAND_MODEL_PATH, scaler_path=DEMAND_SCALER_PATH,
+                      numpy_path=DEMAND_NUMPY_MODEL_PATH, info_path=DEMAND_MODEL_INFO_PATH):
+    """Load the LSTM as a batched predict function over scaled windows
+
+    Uses the NumPy export (lstm_export.py) when available, so TensorFlow is
+    only imported for a Keras model that has not been exported.
+    """
+    check_model_info(info_path)
+    if not os.path.exists(scaler_path):
+        raise FileNotFoundError(f"No demand scaler at {scaler_path}. {TRAIN_HINT} {ARTIFACT_DIR}.")
+    scaler = joblib.load(scaler_path)
+
+    if _use_numpy_export(model_path, numpy_path):
+        model = NumpyLSTM.load(numpy_path)
+        return DemandModel(model.predict, scaler, model.sequence_length, _file_version(numpy_path, scaler_path))
+
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"No demand model at {model_path}. {TRAIN_HINT} {ARTIFACT_DIR}.")
+    try:
+        from tensorflow import keras
+    except ImportError:
+        raise RuntimeError("The demand LSTM needs TensorFlow, which is not installed. "
+                           "Export it for NumPy inference with lstm_export.py on a machine that has it.")
+
+    model = keras.models.load_model(model_path, compile=False)
+    sequence_length = model.input_shape[1]
+
+    # Direct call: one forward pass without model.predict's per-call setup
+    def predict(X):
+        return model(X.astype(np.float32), training=False).numpy().reshape(-1)
+
+    return DemandModel(predict, scaler, sequence_length, _file_version(model_path, scaler_path))
+
+
+def _route_day_rows(db, match):
+    """Passengers, trips and trip-weighted hour sum per (route, day) from the feature store"""
+    rows = list(db[ROUTE_FEATURES_COLLECTION].aggregate([
+        {'$match': match},
+        {
+            '$group': {
+                '_id': {'route': '$route', 'date': '$date'},
+                'passengers': {'$sum': '$seats_booked'},
+                'trips': {'$sum': '$trips'},
+                'hour_sum': {'$sum': {'$multiply': ['$hour', '$trips']}}
+            }
+        }
+    ]))
+    df = pd.DataFrame([{**row['_id'], **{k: v for k, v in row.items() if k != '_id'}} for row in rows])
+    if not df.empty:
+        df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def _daily_grid(df, dates):
+    """(route ids, passengers, hours) with one row per route and one column per date
+
+    Days without trips have 0 passengers and the route's mean hour over `df`.
+    Training (fetch_demand_daily_data) and serving (fetch_route_history) both
+    build their series here, so a model sees the same rows in both.
+    """
+    passengers = df.pivot_table(index='route', columns='date', values='passengers', aggfunc='sum')
+    passengers = passengers.reindex(columns=dates).fillna(0)
+    hour = df.pivot_table(index='route', columns='date', values='hour_sum', aggfunc='sum') / \
+        df.pivot_table(index='route', columns='date', values='trips', aggfunc='sum')
+    totals = df.groupby('route')[['hour_sum', 'trips']].sum()
+    mean_hour = totals['hour_sum'] / totals['trips']
+    hour = hour.reindex(index=passengers.index, columns=dates)
+    hour = hour.apply(lambda row: row.fillna(mean_hour[row.name]), axis=1)
+
+    return list(passengers.index), passengers.to_numpy(dtype=float), hour.to_numpy(dtype=float)
+
+
+def fetch_route_history(db, end, days, routes=None):
+    """Daily passengers and mean departure hour per route for the `days` days before `end`
+
+    Returns (route ids, passengers, hours) with one row per route and one column
+    per day, oldest first. Days without trips have 0 passengers and the route's
+    mean hour over the window.
+    """
+    first = end - timedelta(days=days)
+    match = {'date': {'$gte': first, '$lt': end}, 'trips': {'$gt': 0}}
+    if routes is not None:
+        match['route'] = {'$in': list(routes)}
+
+    df = _route_day_rows(db, match)
+    if df.empty:
+        return [], np.zeros((0, days)), np.zeros((0, days))
+    return _daily_grid(df, pd.date_range(first, periods=days, freq='D'))
+
+
+def fetch_demand_daily_data():
+    """Per-route daily series the forecaster serves, as training rows for the LSTM
+
+    One row per route and day (route_id, date and DEMAND_FEATURES) from the
+    route's first to its last day with trips, built with the same fill rules
+    as fetch_route_history. Rows are sorted by route, then date, so windows
+    can be cut per route without crossing into another one.
+    """
+    print("📊 Fetching per-route daily demand...")
+    refresh_route_daily_features()
+    client = get_mongo_client()
+    db = client[DB_NAME]
+    try:
+        df = _route_day_rows(db, {'trips': {'$gt': 0}})
+    finally:
+        client.close()
+
+    if df.empty:
+        print("✅ Fetched 0 route-days")
+        return pd.DataFrame(columns=['route_id', 'date', *DEMAND_FEATURES])
+
+    dates = pd.date_range(df['date'].min(), df['date'].max(), freq='D')
+    route_ids, passengers, hours = _daily_grid(df, dates)
+    features = feature_rows(passengers, hours, dates)
+
+    # Only the span each route actually ran, not the whole store's range
+    span = df.groupby('route')['date'].agg(['min', 'max']).reindex(route_ids)
+    day_index = np.arange(len(dates))
+    first = dates.searchsorted(span['min'].to_numpy())
+    last = dates.searchsorted(span['max'].to_numpy())
+    keep = (day_index >= first[:, None]) & (day_index <= last[:, None])
+
+    route_idx, date_idx = np.nonzero(keep)
+    data = pd.DataFrame(features[route_idx, date_idx], columns=DEMAND_FEATURES)
+    data.insert(0, 'date', dates[date_idx])
+    data.insert(0, 'route_id', [str(route_ids[i]) for i in route_idx])
+    print(f"✅ Fetched {len(data)} route-days for {len(route_ids)} routes")
+    return data
+
+
+def forecast_batch(model, passengers, hours, start, horizon):
+    """Recursive H-step forecast for every route at once
+
+    passengers/hours hold the last sequence_length days per route. Future days
+    use the route's mean hour over that window. Returns (forecasts of shape
+    (routes, horizon), model calls).
+    """
+    n_routes, length = passengers.shape
+    history_dates = pd.date_range(start - timedelta(days=length), periods=length, freq='D')
+    future_dates = pd.date_range(start, periods=horizon, freq='D')
+    n_features = len(DEMAND_FEATURES)
+    passenger_col = DEMAND_FEATURES.index('passengers')
+
+    window = model.scaler.transform(
+        feature_rows(passengers, hours, history_dates).reshape(-1, n_features)
+    ).reshape(n_routes, length, n_features)
+    future = feature_rows(np.zeros((n_routes, horizon)), np.repeat(hours.mean(axis=1, keepdims=True), horizon, axis=1),
+                          future_dates)
+
+    forecasts = np.empty((n_routes, horizon))
+    for step in range(horizon):
+        scaled = model.predict(window)
+
+        # Unscale through the scaler so any fitted feature range works
+        next_scaled = model.scaler.transform(future[:, step, :])
+        next_scaled[:, passenger_col] = scaled
+        predicted = np.maximum(model.scaler.inverse_transform(next_scaled)[:, passenger_col], 0)
+        forecasts[:, step] = predicted
+
+        next_raw = future[:, step, :].copy()
+        next_raw[:, passenger_col] = predicted
+        window = np.concatenate([window[:, 1:, :], model.scaler.transform(next_raw)[:, None, :]], axis=1)
+
+    return forecasts, horizon
+
+
+def changed_routes(db, since):
+    """Routes whose trips received new or changed bookings after `since`"""
+    return {doc['_id'] for doc in db[BOOKINGS_COLLECTION].aggregate([
+        {'$match': {'updatedAt': {'$gt': since}}},
+        {'$lookup': {
+            'from': TRIPS_COLLECTION,
+            'localField': 'trip',
+            'foreignField': '_id',
+            'pipeline': [{'$project': {'route': 1}}],
+            'as': 'trip_info'
+        }},
+        {'$unwind': '$trip_info'},
+        {'$group': {'_id': '$trip_info.route'}}
+    ])}
+
+
+class DemandForecaster:
+    """Batched multi-horizon forecasts with a per-route cache invalidated by new bookings"""
+
+    def __init__(self, cache_size=FORECAST_CACHE_SIZE, model_path=DEMAND_MODEL_PATH, scaler_path=DEMAND_SCALER_PATH,
+                 numpy_path=DEMAND_NUMPY_MODEL_PATH, info_path=DEMAND_MODEL_INFO_PATH):
+        self.cache_size = cache_size
+        self.model_path = model_path
+        self.scaler_path = scaler_path
+        self.numpy_path = numpy_path
+        self.info_path = info_path
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._model = None
+        self._model_mtime = None
+        self._bookings_seen = None
+        self._synced = False
+        self._counts = {'hits': 0, 'misses': 0, 'model_calls': 0, 'invalidated': 0}
+
+    def model(self):
+        """Loaded model, reloaded (and the cache cleared) when one of its files changes"""
+        paths = (self.model_path, self.scaler_path, self.numpy_path, self.info_path)
+        mtime = tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in paths)
+        if self._model is None or mtime != self._model_mtime:
+            model = load_demand_model(*paths)
+            with self._lock:
+                self._model, self._model_mtime = model, mtime
+                self._cache.clear()
+        return self._model
+
+    def _sync_bookings(self, db):
+        """Refresh the store and drop cached routes when bookings changed; returns routes invalidated
+
+        One request at a time syncs; requests arriving meanwhile serve the
+        cache and the store as they are.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return 0
+        try:
+            latest = db[BOOKINGS_COLLECTION].find_one(
+                {'updatedAt': {'$type': 'date'}}, {'updatedAt': 1}, sort=[('updatedAt', -1)]
+            )
+            latest = latest['updatedAt'] if latest else None
+            with self._lock:
+                synced, seen = self._synced, self._bookings_seen
+            if synced and (latest is None or (seen is not None and latest <= seen)):
+                return 0
+
+            # Another process already refreshing: serve the store as it is and retry on the next request
+            if refresh_route_daily_features(wait=False)['mode'] == 'skipped':
+                return 0
+
+            # Dropped after the refresh, so entries recomputed meanwhile from the old store go too
+            routes = {str(route) for route in changed_routes(db, seen)} if synced and seen is not None else None
+            with self._lock:
+                if not synced:
+                    dropped = 0
+                elif routes is None:
+                    dropped = len(self._cache)
+                    self._cache.clear()
+                else:
+                    stale = [key for key in self._cache if key[0] in routes]
+                    for key in stale:
+                        del self._cache[key]
+                    dropped = len(stale)
+                self._counts['invalidated'] += dropped
+                self._bookings_seen, self._synced = latest, True
+            return dropped
+        finally:
+            self._sync_lock.release()
+
+    def forecast(self, routes=None, horizon=7, start=None):
+        """Forecast daily passengers for `horizon` days from `start` (today, UTC) for routes (all if None)"""
+        if not 1 <= horizon <= FORECAST_MAX_HORIZON:
+            raise ValueError(f"horizon must be between 1 and {FORECAST_MAX_HORIZON} days")
+
+        started = time.perf_counter()
+        model = self.model()
+        start = pd.Timestamp(start or datetime.utcnow()).normalize().to_pydatetime()
+        routes = None if routes is None else [ObjectId(route) for route in routes]
+
+        client = get_mongo_client()
+        db = client[DB_NAME]
+        try:
+            invalidated = self._sync_bookings(db)
+
+            def key(route):
+                return (str(route), horizon, model.version, start.date())
+
+            with self._lock:
+                cached = {} if routes is None else {
+                    str(route): self._cache[key(route)] for route in routes if key(route) in self._cache
+                }
+            missing = None if routes is None else [route for route in routes if str(route) not in cached]
+
+            route_ids, passengers, hours = [], None, None
+            if missing is None or missing:
+                route_ids, passengers, hours = fetch_route_history(db, start, model.sequence_length, missing)
+        finally:
+            client.close()
+
+        # All-routes requests read every history, then serve what is cached
+        if routes is None:
+            with self._lock:
+                cached = {str(route): self._cache[key(route)] for route in route_ids if key(route) in self._cache}
+        compute = [i for i, route in enumerate(route_ids) if str(route) not in cached]
+
+        calls = 0
+        computed = {}
+        if compute:
+            values, calls = forecast_batch(model, passengers[compute], hours[compute], start, horizon)
+            computed = {str(route_ids[i]): [round(float(v), 1) for v in row] for i, row in zip(compute, values)}
+            with self._lock:
+                for route, path in computed.items():
+                    self._cache[(route, horizon, model.version, start.date())] = path
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        with self._lock:
+            self._counts['hits'] += len(cached)
+            self._counts['misses'] += len(computed)
+            self._counts['model_calls'] += calls
+
+        dates = [(start + timedelta(days=step)).date().isoformat() for step in range(horizon)]
+        paths = {**cached, **computed}
+        requested = [str(route) for route in routes] if routes is not None else [str(route) for route in route_ids]
+        return {
+            'model_version': model.version,
+            'horizon': horizon,
+            'start_date': dates[0],
+            'forecasts': {
+                route: [{'date': date, 'passengers': value} for date, value in zip(dates, paths[route])]
+                for route in requested if route in paths
+            },
+            'no_history': [route for route in requested if route not in paths],
+            'cache': {'hits': len(cached), 'misses': len(computed), 'invalidated': invalidated},
+            'model_calls': calls,
+            'timings_ms': {'total': round((time.perf_counter() - started) * 1000, 1)}
+        }
+
+    def status(self):
+        with self._lock:
+            return {
+                'model_version': self._model.version if self._model else None,
+                'cached_entries': len(self._cache),
+                'bookings_seen': self._bookings_seen,
+                **self._counts
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Forecast daily passenger demand per route')
+    parser.add_argument('--routes', help='Comma-separated route ids (default: every route with recent trips)')
+    parser.add_argument('--horizon', type=int, default=7)
+    args = parser.parse_args()
+
+    routes = args.routes.split(',') if args.routes else None
+    result = DemandForecaster().forecast(routes, args.horizon)
+    print(f"📈 {len(result['forecasts'])} routes x {result['horizon']} days from {result['start_date']} "
+          f"(model {result['model_version']}, {result['model_calls']} batched model calls, "
+          f"{result['timings_ms']['total']} ms)")
+    for route, path in result['forecasts'].items():
+        print(f"  {route}: {', '.join(str(day['passengers']) for day in path)}")
+    if result['no_history']:
+        print(f"⚠️  No recent history: {', '.join(result['no_history'])}")
+
+
+if __name__ == '__main__':
+    main()
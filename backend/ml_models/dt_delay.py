@@ -19,7 +19,6 @@ Visualization: Feature importance bar chart
 
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
@@ -27,19 +26,23 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 import base64
+import time
 from io import BytesIO
 
 from config import *
-from utils import get_mongo_client, save_model_report
+from utils import get_mongo_client, save_model_report, save_model_artifact, booking_totals_lookup, booking_total
+from snapshot import load_training_data
+from splits import get_split
+from bootstrap import classification_intervals
+from importance import permutation_importance
+from memory_stages import track_memory, mark_stage, memory_summary
+from sampling import normalize_sampling, default_sampling, build_sampling_stages, describe_sampling
+from compiled_tree import CompiledTree, verify_against_sklearn
 
 
-def fetch_trip_delay_data():
-    """Fetch trip data with delay information"""
-    client = get_mongo_client()
-    db = client[DB_NAME]
-    
-    # Aggregate trips with route and booking info
-    pipeline = [
+def build_trip_delay_pipeline():
+    """Aggregation stages joining trips with route, booking and duty info"""
+    return [
         {
             '$lookup': {
                 'from': 'routes',
@@ -49,14 +52,7 @@ def fetch_trip_delay_data():
             }
         },
         {'$unwind': '$route_info'},
-        {
-            '$lookup': {
-                'from': 'bookings',
-                'localField': '_id',
-                'foreignField': 'trip',
-                'as': 'bookings'
-            }
-        },
+        booking_totals_lookup(),
         {
             '$lookup': {
                 'from': 'duties',
@@ -73,14 +69,24 @@ def fetch_trip_delay_data():
                 'scheduled_arrival': '$scheduledArrival',
                 'actual_arrival': '$actualArrival',
                 'capacity': '$bus.capacity',
-                'seats_booked': {'$sum': '$bookings.seats'},
+                'seats_booked': booking_total('seats'),
                 'shift_hours': {'$ifNull': [{'$first': '$duty_info.hours'}, 8]},
                 'traffic_level': {'$ifNull': ['$trafficLevel', 'medium']}
             }
         }
     ]
+
+
+def fetch_trip_delay_data(sampling=None):
+    """Fetch trip data with delay information"""
+    client = get_mongo_client()
+    db = client[DB_NAME]
     
-    trips = list(db[TRIPS_COLLECTION].aggregate(pipeline))
+    # Aggregate trips with route and booking info
+    pipeline = build_trip_delay_pipeline()
+    pipeline[0:0] = build_sampling_stages(db[TRIPS_COLLECTION], sampling)
+
+    trips = list(db[TRIPS_COLLECTION].aggregate(pipeline, allowDiskUse=bool(sampling)))
     client.close()
     
     return pd.DataFrame(trips)
@@ -174,13 +180,19 @@ def create_feature_importance_plot(model, feature_names):
     return f"data:image/png;base64,{image_base64}"
 
 
-def run_decision_tree_delay_prediction():
+@track_memory
+def run_decision_tree_delay_prediction(sampling=None):
     """Main function to run Decision Tree trip delay prediction"""
     print("🚀 Starting Decision Tree Trip Delay Prediction...")
     
+    sampling = normalize_sampling(sampling or default_sampling(), by='route', time_field='scheduledDeparture')
+
     # Fetch data
+    mark_stage('fetch')
     print("📊 Fetching trip data...")
-    df = fetch_trip_delay_data()
+    fetch_start = time.perf_counter()
+    df = load_training_data('dt_delay_prediction', fetch_trip_delay_data, sampling)
+    fetch_seconds = time.perf_counter() - fetch_start
     
     if df.empty:
         print("❌ No trip data found!")
@@ -189,6 +201,7 @@ def run_decision_tree_delay_prediction():
     print(f"✅ Loaded {len(df)} trip records")
     
     # Preprocess
+    mark_stage('features')
     print("🔄 Preprocessing data...")
     processed_df = preprocess_delay_data(df)
     
@@ -205,10 +218,9 @@ def run_decision_tree_delay_prediction():
     
     # Handle class imbalance if necessary
     if len(y) > 0:
-        # Train-test split
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y
-        )
+        # Train-test split, stable per trip
+        split = get_split('dt_delay_prediction', processed_df['_id'])
+        X_train, X_test, y_train, y_test = X[split.train], X[split.test], y[split.train], y[split.test]
     else:
         print("❌ Insufficient data for training!")
         return None
@@ -216,20 +228,34 @@ def run_decision_tree_delay_prediction():
     print(f"📈 Training set: {len(X_train)}, Test set: {len(X_test)}")
     
     # Train model
+    mark_stage('train')
     print("🤖 Training Decision Tree model...")
+    train_start = time.perf_counter()
     dt, y_pred_train, y_pred_test = train_decision_tree_model(X_train, y_train, X_test, y_test)
+    train_seconds = time.perf_counter() - train_start
     
     # Calculate metrics
+    mark_stage('evaluate')
     train_metrics = calculate_classification_metrics(y_train, y_pred_train)
     test_metrics = calculate_classification_metrics(y_test, y_pred_test)
     
     print("📊 Training Metrics:", train_metrics)
     print("📊 Testing Metrics:", test_metrics)
+    test_metrics['confidence_intervals'] = classification_intervals(y_test, y_pred_test)
+    importance = permutation_importance(dt.predict, X_test, y_test, feature_cols, 'Accuracy')
     
     # Create visualization
+    mark_stage('visualization')
     print("📈 Creating feature importance plot...")
     viz_image = create_feature_importance_plot(dt, feature_cols)
     
+    # Compile to flat node arrays for fast scoring; only ship it if it matches exactly
+    compiled = CompiledTree.from_sklearn(dt)
+    compiled_parity = verify_against_sklearn(dt, compiled, X)
+    if not compiled_parity['equal']:
+        print(f"⚠️  Compiled tree disagrees with scikit-learn, scoring will use the estimator: {compiled_parity}")
+        compiled = None
+    
     # Feature importance details
     feature_importance = {
         feature: float(importance) 
@@ -242,8 +268,11 @@ def run_decision_tree_delay_prediction():
         'description': 'Trip delay prediction (On-time vs Delayed)',
         'train_metrics': train_metrics,
         'test_metrics': test_metrics,
+        'split': split.summary(),
+        'sampling': describe_sampling(sampling, TRIPS_COLLECTION, len(df), fetch_seconds, train_seconds),
         'visualization': viz_image,
         'feature_importance': feature_importance,
+        'permutation_importance': importance,
         'hyperparameters': {
             'max_depth': 5,
             'min_samples_split': 20,
@@ -252,9 +281,24 @@ def run_decision_tree_delay_prediction():
         'class_distribution': {
             'on_time': int((y == 0).sum()),
             'delayed': int((y == 1).sum())
+        },
+        'compiled_tree': {
+            'nodes': int(dt.tree_.node_count),
+            'depth': int(dt.get_depth()),
+            'parity': compiled_parity
         }
     }
     
+    # Save trained model for batch scoring
+    mark_stage('artifact')
+    save_model_artifact('dt_delay_prediction', {
+        'model': dt,
+        'compiled': compiled,
+        'feature_cols': feature_cols
+    })
+    
+    report_data['memory'] = memory_summary()
+    
     # Save to MongoDB
     print("💾 Saving report to MongoDB...")
     report_id = save_model_report('dt_delay_prediction', report_data)
@@ -0,0 +1,495 @@
+"""
+Route-Daily Feature Store
+=========================
+Materializes route-level aggregates into `route_daily_features`, one
+document per (route, date, hour), so the route models train from a few
+thousand pre-aggregated rows instead of re-joining every trip and booking.
+
+Each document carries two groups of fields:
+
+- trip side, keyed by scheduled departure: trips, seats_booked, revenue,
+  fuel_cost, delay_count (> DELAY_THRESHOLD_MINUTES), abs_delay_minutes_sum,
+  and <feature>_sum / <feature>_n for the per-trip means occupancy_percentage,
+  fuel_per_km and revenue_per_km
+- booking side, keyed by booking time: bookings, booking_seats,
+  booking_fare_sum, booking_fare_n, distance
+
+Sums and counts (not means) are stored so any roll-up is exact: a route's
+mean occupancy is sum(occupancy_percentage_sum) / sum(occupancy_percentage_n).
+
+Updates are incremental. Trips and bookings changed since the last refresh
+(`updatedAt`) determine the changed days, and only those days are recomputed
+and written with `$merge`. A booking changes its trip's departure day as well
+as its own booking day. Rows of a recomputed day that no longer receive data
+are cleared.
+
+`route_daily_feature_keys` records, per trip and booking, the trip-side
+(route, day) it was last counted in. A rescheduled trip, a trip moved to
+another route or a booking moved to another trip therefore also recomputes
+the day it used to count in, so its old contribution is removed. Deleted
+trips or bookings leave no `updatedAt` trail, so run a full refresh after
+bulk deletes.
+
+Trips without a scheduled departure are not in the store.
+
+Refreshes are serialized across threads and processes by a lease on the
+store's `ml_feature_store_state` document, since two concurrent refreshes
+would clear each other's rows. A refresh that finds the lease held waits
+for it (then refreshes whatever changed meanwhile), or with wait=False
+returns at once with mode 'skipped'. The holder renews the lease before
+every batch; a lease left by a dead process expires after
+FEATURE_STORE_LEASE_SECONDS.
+
+Usage:
+    python feature_store.py refresh [--full]
+    python feature_store.py status
+"""
+
+import argparse
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from config import *
+from utils import get_mongo_client, booking_totals_lookup, booking_total
+
+
+STATE_ID = ROUTE_FEATURES_COLLECTION
+KEY_FIELDS = ['route', 'date', 'hour']
+DELAY_THRESHOLD_MINUTES = 15
+TRIP_MEAN_FEATURES = ['occupancy_percentage', 'fuel_per_km', 'revenue_per_km']
+TRIP_FIELDS = (
+    ['trips', 'seats_booked', 'revenue', 'fuel_cost', 'delay_count', 'abs_delay_minutes_sum'] +
+    [f'{feature}_{suffix}' for feature in TRIP_MEAN_FEATURES for suffix in ('sum', 'n')]
+)
+BOOKING_FIELDS = ['bookings', 'booking_seats', 'booking_fare_sum', 'booking_fare_n', 'distance']
+
+
+def _per_km(field):
+    """field / distance, with a zero distance treated as 1 km (as the models do)"""
+    return {'$divide': [field, {'$cond': [{'$eq': ['$distance', 0]}, 1, '$distance']}]}
+
+
+def _sum_and_count(field):
+    return {
+        f'{field}_sum': {'$sum': f'${field}'},
+        f'{field}_n': {'$sum': {'$cond': [{'$isNumber': f'${field}'}, 1, 0]}}
+    }
+
+
+def _day_ranges(field, days):
+    return {'$or': [{field: {'$gte': day, '$lt': day + timedelta(days=1)}} for day in days]}
+
+
+def _merge_stage():
+    return {
+        '$merge': {
+            'into': ROUTE_FEATURES_COLLECTION,
+            'on': KEY_FIELDS,
+            'whenMatched': 'merge',
+            'whenNotMatched': 'insert'
+        }
+    }
+
+
+def build_trip_feature_pipeline(days=None, refreshed_at=None):
+    """Per-trip features grouped by (route, departure date, hour), merged into the store"""
+    match = {'scheduledDeparture': {'$type': 'date'}}
+    if days is not None:
+        match.update(_day_ranges('scheduledDeparture', days))
+
+    return [
+        {'$match': match},
+        {
+            '$lookup': {
+                'from': ROUTES_COLLECTION,
+                'localField': 'route',
+                'foreignField': '_id',
+                'as': 'route_info'
+            }
+        },
+        {'$unwind': '$route_info'},
+        booking_totals_lookup(),
+        {
+            '$project': {
+                'route': '$route_info._id',
+                'departure': '$scheduledDeparture',
+                'distance': '$route_info.distance',
+                'capacity': '$bus.capacity',
+                'seats_booked': booking_total('seats'),
+                'revenue': booking_total('revenue'),
+                'fuel_cost': {'$ifNull': ['$fuelCost', 0]},
+                'delay_minutes': {'$ifNull': [
+                    {'$divide': [{'$subtract': ['$actualDeparture', '$scheduledDeparture']}, 60000]}, 0
+                ]}
+            }
+        },
+        {
+            '$addFields': {
+                'occupancy_percentage': {'$cond': [
+                    {'$isNumber': '$capacity'},
+                    {'$min': [100, {'$max': [0, {'$multiply': [
+                        {'$divide': ['$seats_booked', {'$cond': [{'$eq': ['$capacity', 0]}, 1, '$capacity']}]}, 100
+                    ]}]}]},
+                    None
+                ]},
+                'fuel_per_km': _per_km('$fuel_cost'),
+                'revenue_per_km': _per_km('$revenue')
+            }
+        },
+        {
+            '$group': {
+                '_id': {
+                    'route': '$route',
+                    'date': {'$dateTrunc': {'date': '$departure', 'unit': 'day'}},
+                    'hour': {'$hour': '$departure'}
+                },
+                'trips': {'$sum': 1},
+                'seats_booked': {'$sum': '$seats_booked'},
+                'revenue': {'$sum': '$revenue'},
+                'fuel_cost': {'$sum': '$fuel_cost'},
+                'delay_count': {'$sum': {'$cond': [{'$gt': ['$delay_minutes', DELAY_THRESHOLD_MINUTES]}, 1, 0]}},
+                'abs_delay_minutes_sum': {'$sum': {'$abs': '$delay_minutes'}},
+                **{name: expr for feature in TRIP_MEAN_FEATURES for name, expr in _sum_and_count(feature).items()}
+            }
+        },
+        {
+            '$project': {
+                '_id': 0,
+                'route': '$_id.route',
+                'date': '$_id.date',
+                'hour': '$_id.hour',
+                **{field: 1 for field in TRIP_FIELDS},
+                'trips_refreshed_at': {'$literal': refreshed_at or datetime.utcnow()}
+            }
+        },
+        _merge_stage()
+    ]
+
+
+def build_booking_feature_pipeline(days=None, refreshed_at=None):
+    """Bookings grouped by (route, booking date, hour), merged into the store"""
+    match = {'createdAt': {'$type': 'date'}}
+    if days is not None:
+        match.update(_day_ranges('createdAt', days))
+
+    return [
+        {'$match': match},
+        {
+            '$lookup': {
+                'from': TRIPS_COLLECTION,
+                'localField': 'trip',
+                'foreignField': '_id',
+                'pipeline': [{'$project': {'route': 1}}],
+                'as': 'trip_info'
+            }
+        },
+        {'$unwind': '$trip_info'},
+        {
+            '$group': {
+                '_id': {
+                    'route': '$trip_info.route',
+                    'date': {'$dateTrunc': {'date': '$createdAt', 'unit': 'day'}},
+                    'hour': {'$hour': '$createdAt'}
+                },
+                'bookings': {'$sum': 1},
+                'booking_seats': {'$sum': '$seats'},
+                'booking_fare_sum': {'$sum': '$fare'},
+                'booking_fare_n': {'$sum': {'$cond': [{'$isNumber': '$fare'}, 1, 0]}}
+            }
+        },
+        # One route lookup per group rather than per booking
+        {
+            '$lookup': {
+                'from': ROUTES_COLLECTION,
+                'localField': '_id.route',
+                'foreignField': '_id',
+                'pipeline': [{'$project': {'distance': 1}}],
+                'as': 'route_info'
+            }
+        },
+        {'$unwind': '$route_info'},
+        {
+            '$project': {
+                '_id': 0,
+                'route': '$_id.route',
+                'date': '$_id.date',
+                'hour': '$_id.hour',
+                'bookings': 1,
+                'booking_seats': 1,
+                'booking_fare_sum': 1,
+                'booking_fare_n': 1,
+                'distance': '$route_info.distance',
+                'bookings_refreshed_at': {'$literal': refreshed_at or datetime.utcnow()}
+            }
+        },
+        _merge_stage()
+    ]
+
+
+def _distinct_days(collection, match, date_field, lookup=None):
+    """Distinct UTC days of date_field over the matching documents"""
+    pipeline = [{'$match': match}]
+    if lookup:
+        pipeline += lookup
+    pipeline += [
+        {'$match': {date_field: {'$type': 'date'}}},
+        {'$group': {'_id': {'$dateTrunc': {'date': f'${date_field}', 'unit': 'day'}}}}
+    ]
+    return {doc['_id'] for doc in collection.aggregate(pipeline)}
+
+
+def _trip_departure_lookup():
+    """Stages adding a booking's trip as `trip_info` (route and scheduled departure)"""
+    return [
+        {'$lookup': {
+            'from': TRIPS_COLLECTION,
+            'localField': 'trip',
+            'foreignField': '_id',
+            'pipeline': [{'$project': {'route': 1, 'scheduledDeparture': 1}}],
+            'as': 'trip_info'
+        }},
+        {'$unwind': '$trip_info'}
+    ]
+
+
+def _previous_key_lookup():
+    """Stages adding the (route, day) a document was last counted in as `key`"""
+    return [
+        {'$lookup': {
+            'from': FEATURE_STORE_KEYS_COLLECTION,
+            'localField': '_id',
+            'foreignField': '_id',
+            'as': 'key'
+        }},
+        {'$unwind': '$key'}
+    ]
+
+
+def changed_days(db, since):
+    """(trip-side days, booking-side days) touched by changes after `since`
+
+    Trip-side days include the days the changed trips and bookings were
+    counted in before the change (from the key collection).
+    """
+    changed = {'updatedAt': {'$gt': since}}
+    trip_days = _distinct_days(db[TRIPS_COLLECTION], changed, 'scheduledDeparture')
+    trip_days |= _distinct_days(db[BOOKINGS_COLLECTION], changed, 'trip_info.scheduledDeparture',
+                                _trip_departure_lookup())
+    for source in (TRIPS_COLLECTION, BOOKINGS_COLLECTION):
+        trip_days |= _distinct_days(db[source], changed, 'key.date', _previous_key_lookup())
+    booking_days = _distinct_days(db[BOOKINGS_COLLECTION], changed, 'createdAt')
+    return sorted(trip_days), sorted(booking_days)
+
+
+def record_keys(db, since=None):
+    """Store the trip-side (route, day) of each trip and booking changed after `since` (all if None)"""
+    match = {} if since is None else {'updatedAt': {'$gt': since}}
+    merge = {'$merge': {'into': FEATURE_STORE_KEYS_COLLECTION, 'on': '_id',
+                        'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+
+    def key(trip):
+        return {'$project': {
+            'route': f'{trip}.route',
+            'date': {'$dateTrunc': {'date': f'{trip}.scheduledDeparture', 'unit': 'day'}}
+        }}
+
+    db[TRIPS_COLLECTION].aggregate([{'$match': match}, key('$$ROOT'), merge], allowDiskUse=True)
+    db[BOOKINGS_COLLECTION].aggregate([{'$match': match}, *_trip_departure_lookup(), key('$trip_info'), merge],
+                                      allowDiskUse=True)
+
+
+def ensure_feature_store_indexes(db):
+    """$merge needs a unique index on its `on` fields"""
+    db[ROUTE_FEATURES_COLLECTION].create_index([(field, 1) for field in KEY_FIELDS], unique=True)
+
+
+def _acquire_lease(db, owner):
+    """Take the refresh lease if it is free or expired; True if taken"""
+    now = datetime.utcnow()
+    state = db[FEATURE_STORE_STATE_COLLECTION]
+    state.update_one({'_id': STATE_ID}, {'$setOnInsert': {'_id': STATE_ID}}, upsert=True)
+    return state.find_one_and_update(
+        {'_id': STATE_ID, '$or': [{'lease': None}, {'lease.expires_at': {'$lt': now}}]},
+        {'$set': {'lease': {
+            'owner': owner,
+            'started_at': now,
+            'expires_at': now + timedelta(seconds=FEATURE_STORE_LEASE_SECONDS)
+        }}}
+    ) is not None
+
+
+def _renew_lease(db, owner):
+    """Extend the lease; fails if it expired and another refresh took it"""
+    result = db[FEATURE_STORE_STATE_COLLECTION].update_one(
+        {'_id': STATE_ID, 'lease.owner': owner},
+        {'$set': {'lease.expires_at': datetime.utcnow() + timedelta(seconds=FEATURE_STORE_LEASE_SECONDS)}}
+    )
+    if not result.matched_count:
+        raise RuntimeError("Lost the feature store refresh lease to another refresh; "
+                           "raise ML_FEATURE_STORE_LEASE if batches take longer than it")
+
+
+def _release_lease(db, owner):
+    db[FEATURE_STORE_STATE_COLLECTION].update_one({'_id': STATE_ID, 'lease.owner': owner},
+                                                  {'$unset': {'lease': ''}})
+
+
+def _merge_days(db, source, build_pipeline, days, refreshed_at, refreshed_field, fields, renew=None):
+    """Recompute the given days (all if None) and clear rows that received no data"""
+    batches = [None] if days is None else [
+        days[i:i + FEATURE_STORE_DAYS_PER_BATCH] for i in range(0, len(days), FEATURE_STORE_DAYS_PER_BATCH)
+    ]
+    for batch in batches:
+        if renew:
+            renew()
+        db[source].aggregate(build_pipeline(batch, refreshed_at), allowDiskUse=True)
+
+    if renew:
+        renew()
+    stale = {refreshed_field: {'$ne': refreshed_at}}
+    if days is not None:
+        stale['date'] = {'$in': days}
+    result = db[ROUTE_FEATURES_COLLECTION].update_many(
+        stale, {'$set': {**dict.fromkeys(fields, 0), refreshed_field: refreshed_at}}
+    )
+    return result.modified_count
+
+
+def refresh_route_daily_features(full=False, wait=True):
+    """Bring route_daily_features up to date; recomputes only changed days unless full
+
+    Holds the refresh lease while it runs. If another refresh holds it, waits
+    until it is released (or expires) and then refreshes what changed since,
+    or returns a 'skipped' summary at once when wait is False.
+    """
+    client = get_mongo_client()
+    db = client[DB_NAME]
+    start = time.perf_counter()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    try:
+        while not _acquire_lease(db, owner):
+            if not wait:
+                state = db[FEATURE_STORE_STATE_COLLECTION].find_one({'_id': STATE_ID}, {'watermark': 1})
+                return {
+                    'mode': 'skipped',
+                    'trip_days': 0,
+                    'booking_days': 0,
+                    'rows_cleared': 0,
+                    'rows': db[ROUTE_FEATURES_COLLECTION].estimated_document_count(),
+                    'seconds': round(time.perf_counter() - start, 3),
+                    'watermark': state.get('watermark') if state else None
+                }
+            time.sleep(FEATURE_STORE_LEASE_POLL)
+        try:
+            summary = _refresh(db, full, lambda: _renew_lease(db, owner))
+        finally:
+            _release_lease(db, owner)
+    finally:
+        client.close()
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def _refresh(db, full, renew):
+    """One refresh under the lease; returns its summary"""
+    ensure_feature_store_indexes(db)
+    state = db[FEATURE_STORE_STATE_COLLECTION].find_one({'_id': STATE_ID})
+    # Changes made while this refresh runs are picked up by the next one
+    refreshed_at = datetime.utcnow().replace(microsecond=0)
+
+    # Without recorded keys, earlier days of changed trips are unknown; rebuild everything
+    if full or not state or 'watermark' not in state or \
+            not db[FEATURE_STORE_KEYS_COLLECTION].find_one({}, {'_id': 1}):
+        trip_days = booking_days = None
+    else:
+        trip_days, booking_days = changed_days(db, state['watermark'])
+
+    cleared = 0
+    if trip_days is None or trip_days:
+        cleared += _merge_days(db, TRIPS_COLLECTION, build_trip_feature_pipeline, trip_days,
+                               refreshed_at, 'trips_refreshed_at', TRIP_FIELDS, renew)
+    if booking_days is None or booking_days:
+        cleared += _merge_days(db, BOOKINGS_COLLECTION, build_booking_feature_pipeline, booking_days,
+                               refreshed_at, 'bookings_refreshed_at', BOOKING_FIELDS, renew)
+
+    renew()
+    if trip_days is None:
+        db[FEATURE_STORE_KEYS_COLLECTION].delete_many({})
+        record_keys(db)
+    elif trip_days or booking_days:
+        record_keys(db, state['watermark'])
+
+    db[FEATURE_STORE_STATE_COLLECTION].update_one(
+        {'_id': STATE_ID}, {'$set': {'watermark': refreshed_at}}, upsert=True
+    )
+    return {
+        'mode': 'full' if trip_days is None else 'incremental',
+        'trip_days': None if trip_days is None else len(trip_days),
+        'booking_days': None if booking_days is None else len(booking_days),
+        'rows_cleared': cleared,
+        'rows': db[ROUTE_FEATURES_COLLECTION].estimated_document_count(),
+        'watermark': refreshed_at
+    }
+
+
+def use_feature_store(sampling):
+    """Train from the store unless sampling raw documents or reading a snapshot"""
+    return FEATURE_STORE_ENABLED and not sampling and not SNAPSHOT_VERSION
+
+
+def load_route_daily_features(side):
+    """Refresh the store, then read its trip-side or booking-side rows"""
+    if side not in ('trips', 'bookings'):
+        raise ValueError("side must be 'trips' or 'bookings'")
+
+    refresh = refresh_route_daily_features()
+    fields = TRIP_FIELDS if side == 'trips' else BOOKING_FIELDS
+    projection = {'_id': 0, **{field: 1 for field in KEY_FIELDS + fields}}
+
+    client = get_mongo_client()
+    rows = list(client[DB_NAME][ROUTE_FEATURES_COLLECTION].find({side: {'$gt': 0}}, projection))
+    client.close()
+    return pd.DataFrame(rows, columns=KEY_FIELDS + fields), refresh
+
+
+def route_totals(rows, fields):
+    """Roll store rows up to one row of summed fields per route"""
+    return rows.groupby('route')[fields].sum().rename_axis('route_id')
+
+
+def mean_from_sums(totals, feature):
+    """Exact per-route mean of a per-trip feature from its stored sum and count"""
+    return totals[f'{feature}_sum'] / totals[f'{feature}_n'].where(totals[f'{feature}_n'] > 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the route_daily_features collection')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    refresh_parser = subparsers.add_parser('refresh', help='Recompute changed days (or everything with --full)')
+    refresh_parser.add_argument('--full', action='store_true')
+    subparsers.add_parser('status', help='Row count and last refresh')
+    args = parser.parse_args()
+
+    if args.command == 'refresh':
+        summary = refresh_route_daily_features(full=args.full)
+        print(f"✅ {summary['mode']} refresh in {summary['seconds']}s: "
+              f"{summary['trip_days'] if summary['trip_days'] is not None else 'all'} trip days, "
+              f"{summary['booking_days'] if summary['booking_days'] is not None else 'all'} booking days, "
+              f"{summary['rows']} rows")
+    else:
+        client = get_mongo_client()
+        db = client[DB_NAME]
+        state = db[FEATURE_STORE_STATE_COLLECTION].find_one({'_id': STATE_ID})
+        print(f"📦 {db[ROUTE_FEATURES_COLLECTION].estimated_document_count()} rows, "
+              f"last refresh: {state.get('watermark', 'never') if state else 'never'}")
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+HTTP Throughput Benchmark
+=========================
+Closed-loop load generator for comparing the Flask dev server with the
+gunicorn deployment: N client threads with keep-alive connections send
+requests back to back for a fixed duration.
+
+Usage:
+    python http_benchmark.py --url http://localhost:5000/health --concurrency 16 --seconds 10
+"""
+
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+
+def _client_loop(url, method, body, deadline, latencies, errors):
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    headers = {'Content-Type': 'application/json'} if body else {}
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+            latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    connection.close()
+
+
+def run_http_benchmark(url, concurrency=16, seconds=10, method='GET', body=None):
+    """Requests/second and latency percentiles at a fixed client concurrency"""
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=_client_loop, args=(url, method, body, deadline, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latency_ms = np.array(latencies) * 1000
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(latency_ms, 50)), 2) if len(latency_ms) else None,
+        'p99_ms': round(float(np.percentile(latency_ms, 99)), 2) if len(latency_ms) else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Closed-loop HTTP throughput benchmark')
+    parser.add_argument('--url', default='http://localhost:5000/health')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--method', default='GET')
+    parser.add_argument('--body', help='JSON request body')
+    args = parser.parse_args()
+
+    result = run_http_benchmark(args.url, args.concurrency, args.seconds, args.method, args.body)
+    print(f"🚦 {result['requests_per_second']} req/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms "
+          f"({result['requests']} requests, {result['errors']} errors, concurrency {result['concurrency']})")
+
+
+if __name__ == '__main__':
+    main()
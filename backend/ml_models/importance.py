@@ -0,0 +1,118 @@
+"""
+Permutation Feature Importance
+==============================
+Model-agnostic feature importance for any fitted pipeline: the drop in the
+test score when one feature column is shuffled, breaking its relation to the
+target.
+
+- Evaluated on at most IMPORTANCE_MAX_ROWS test rows (a fixed random sample),
+  since the cost is one prediction pass per feature per repeat
+- Each feature is shuffled IMPORTANCE_REPEATS times. Rounds are scheduled
+  repeat by repeat, so every feature gets its first shuffle before any gets
+  its second
+- Shuffles run on a thread pool with one worker per available core (the
+  job's CPU slot). Prediction in NumPy, scikit-learn and TensorFlow releases
+  the GIL; native pools are limited to one thread each meanwhile so the
+  workers do not oversubscribe the slot
+- The stage stops scheduling shuffles once IMPORTANCE_TIME_BUDGET seconds
+  have passed. Features report how many repeats finished, and the result is
+  marked 'timed_out'
+
+Every shuffle draws from its own generator seeded by (feature, repeat), so
+results do not depend on the number of workers or on completion order.
+
+Usage:
+    predict = lambda X: model.predict(scaler.transform(X))
+    report_data['permutation_importance'] = permutation_importance(
+        predict, X_test, y_test, feature_cols, metric='Accuracy')
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from sklearn.metrics import accuracy_score, r2_score
+from threadpoolctl import threadpool_limits
+
+from config import *
+from thread_budget import available_cores
+
+
+# Report metric -> scorer (higher is better)
+SCORERS = {
+    'Accuracy': accuracy_score,
+    'R2_Score': r2_score,
+}
+
+
+def _shuffled_score(predict, X, y, scorer, column, repeat, random_state):
+    rng = np.random.default_rng([random_state, column, repeat])
+    X_shuffled = X.copy()
+    X_shuffled[:, column] = X_shuffled[rng.permutation(len(X)), column]
+    return scorer(y, np.ravel(predict(X_shuffled)))
+
+
+def permutation_importance(predict, X, y, feature_names, metric, n_repeats=IMPORTANCE_REPEATS,
+                           max_rows=IMPORTANCE_MAX_ROWS, time_budget=IMPORTANCE_TIME_BUDGET,
+                           workers=IMPORTANCE_WORKERS, random_state=RANDOM_STATE):
+    """Mean and std of the score drop per shuffled feature, ranked; None if disabled or no rows"""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    if n_repeats <= 0 or len(X) == 0:
+        return None
+
+    start = time.perf_counter()
+    scorer = SCORERS[metric]
+    if len(X) > max_rows:
+        rows = np.sort(np.random.default_rng(random_state).choice(len(X), max_rows, replace=False))
+        X, y = X[rows], y[rows]
+    baseline = scorer(y, np.ravel(predict(X)))
+
+    tasks = [(column, repeat) for repeat in range(n_repeats) for column in range(X.shape[1])]
+    workers = max(1, min(workers or len(available_cores()), len(tasks)))
+    drops = [[] for _ in feature_names]
+    timed_out = False
+
+    with threadpool_limits(limits=1 if workers > 1 else None), ThreadPoolExecutor(workers) as executor:
+        pending = {}
+        queue = iter(tasks)
+        while True:
+            while len(pending) < workers and not timed_out:
+                task = next(queue, None)
+                if task is None:
+                    break
+                if time.perf_counter() - start > time_budget:
+                    timed_out = True
+                    break
+                pending[executor.submit(_shuffled_score, predict, X, y, scorer, *task, random_state)] = task
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                column, _ = pending.pop(future)
+                drops[column].append(baseline - future.result())
+
+    features = {
+        name: {
+            'mean': float(np.mean(values)) if values else None,
+            'std': float(np.std(values)) if values else None,
+            'repeats': len(values)
+        }
+        for name, values in zip(feature_names, drops)
+    }
+    ranked = sorted(features, key=lambda name: -np.inf if features[name]['mean'] is None else features[name]['mean'],
+                    reverse=True)
+    seconds = time.perf_counter() - start
+    print(f"🔀 Permutation importance: {sum(map(len, drops))}/{len(tasks)} shuffles on {len(X)} rows "
+          f"with {workers} workers in {seconds:.2f}s{' (time budget reached)' if timed_out else ''}")
+    return {
+        'metric': metric,
+        'baseline': float(baseline),
+        'rows': int(len(X)),
+        'repeats': n_repeats,
+        'workers': workers,
+        'seconds': round(seconds, 4),
+        'timed_out': timed_out,
+        'ranking': ranked,
+        'features': features
+    }
@@ -0,0 +1,207 @@
+"""
+Index Advisor
+=============
+Lists the indexes the ML pipelines rely on, checks which are missing, and
+explains each training pipeline to find collection scans in its joins.
+
+Without an index on a `$lookup` foreign field, every input document scans
+the whole foreign collection. The explain runs on a small probe of source
+documents (`$limit` in front of the pipeline) with executionStats, so it is
+cheap even on large collections and still reports how each join was executed:
+- classic engine: `collectionScans` / `indexesUsed` per `$lookup` stage
+- slot-based engine: EQ_LOOKUP `strategy` (IndexedLoopJoin vs NestedLoopJoin/HashJoin)
+
+The scan of the source collection itself is expected for full-history
+training pipelines and is reported separately from join scans.
+
+Usage:
+    python indexes.py                  # list missing indexes and explain pipelines
+    python indexes.py --no-explain     # index check only
+    python indexes.py --create         # also create missing indexes
+"""
+
+import argparse
+import importlib
+
+from config import *
+from utils import get_mongo_client
+
+
+# (collection, index keys, why the pipelines need it)
+REQUIRED_INDEXES = [
+    (BOOKINGS_COLLECTION, [('trip', 1)], 'trip -> bookings $lookup (nb, dt, svm, demand snapshot)'),
+    (TRIPS_COLLECTION, [('route', 1)], 'per-route trip joins and filters'),
+    (TRIPS_COLLECTION, [('scheduledDeparture', 1)], 'upcoming-trip delay scoring'),
+    (DUTIES_COLLECTION, [('trips', 1)], 'trip -> duties $lookup (dt)'),
+    (DUTIES_COLLECTION, [('driver', 1), ('date', 1)], 'crew roster lookups by driver, date-bounded'),
+    (DUTIES_COLLECTION, [('conductor', 1), ('date', 1)], 'crew roster lookups by conductor, date-bounded'),
+    (DUTIES_COLLECTION, [('depot', 1), ('date', 1)], 'date-bounded depot roster for crew fitness'),
+    (TRIPS_COLLECTION, [('updatedAt', 1)], 'changed trips (scheduler drift, feature store, nb incremental)'),
+    (BOOKINGS_COLLECTION, [('updatedAt', 1)], 'changed bookings (scheduler drift, feature store, nb incremental)'),
+    (ROUTES_COLLECTION, [('updatedAt', 1)], 'scheduler drift signal and training cache fingerprint'),
+    (DUTIES_COLLECTION, [('updatedAt', 1)], 'scheduler drift signal and training cache fingerprint'),
+    (DRIVERS_COLLECTION, [('updatedAt', 1)], 'scheduler drift signal and training cache fingerprint'),
+    (CONDUCTORS_COLLECTION, [('updatedAt', 1)], 'scheduler drift signal and training cache fingerprint'),
+    (BOOKINGS_COLLECTION, [('createdAt', 1)], 'booking-day ranges for the feature store refresh'),
+    (ML_REPORTS_COLLECTION, [('model_name', 1), ('timestamp', -1)], 'latest report per model'),
+    (TRAINING_STATE_COLLECTION, [('model_name', 1)], 'scheduler baselines'),
+    (DELAY_PREDICTIONS_COLLECTION, [('trip', 1)], 'delay risk upsert key'),
+    (DEMAND_PREDICTIONS_COLLECTION, [('routeId', 1), ('predictionDate', 1), ('timeSlot', 1)], 'demand upsert key'),
+    (CREW_FATIGUE_COLLECTION, [('crewId', 1), ('date', 1)], 'crew fitness upsert key'),
+]
+
+# Model name -> (source collection, module, pipeline builder)
+PIPELINES = {
+    'knn_demand_prediction': (BOOKINGS_COLLECTION, 'knn_demand', 'build_booking_pipeline'),
+    'nb_route_performance': (TRIPS_COLLECTION, 'nb_route_performance', 'build_route_performance_pipeline'),
+    'dt_delay_prediction': (TRIPS_COLLECTION, 'dt_delay', 'build_trip_delay_pipeline'),
+    'svm_route_optimization': (TRIPS_COLLECTION, 'svm_route_opt', 'build_route_optimization_pipeline'),
+    'nn_crew_load_balancing': (DUTIES_COLLECTION, 'nn_crewload', 'build_crew_load_pipeline'),
+}
+
+
+def _covers(existing_keys, required_keys):
+    """An index covers the requirement if the required fields are its prefix
+
+    Directions are ignored: every requirement is equality matches plus at most
+    one trailing sort field, which an index serves in either direction.
+    """
+    prefix = existing_keys[:len(required_keys)]
+    return [field for field, _ in prefix] == [field for field, _ in required_keys] and \
+        all(not isinstance(direction, str) for _, direction in prefix)
+
+
+def check_indexes(db):
+    """Status of every required index"""
+    existing = {}
+    results = []
+    for collection, keys, reason in REQUIRED_INDEXES:
+        if collection not in existing:
+            existing[collection] = [
+                [(field, direction if isinstance(direction, str) else int(direction)) for field, direction in info['key']]
+                for info in db[collection].index_information().values()
+            ]
+        results.append({
+            'collection': collection,
+            'keys': keys,
+            'reason': reason,
+            'present': any(_covers(index, keys) for index in existing[collection])
+        })
+    return results
+
+
+def create_missing_indexes(db, statuses=None):
+    """Create every required index that is missing; returns the created index names"""
+    created = []
+    for status in statuses or check_indexes(db):
+        if status['present']:
+            continue
+        name = db[status['collection']].create_index(status['keys'])
+        status['present'] = True
+        status['created'] = name
+        created.append(f"{status['collection']}.{name}")
+    return created
+
+
+def _walk_plan(node, path, findings):
+    """Collect collection scans and non-indexed joins anywhere in an explain document"""
+    if isinstance(node, list):
+        for i, item in enumerate(node):
+            _walk_plan(item, f'{path}[{i}]', findings)
+        return
+    if not isinstance(node, dict):
+        return
+
+    if node.get('stage') == 'COLLSCAN':
+        findings['collscans'].append(path)
+    if node.get('stage') == 'EQ_LOOKUP' and node.get('strategy') != 'IndexedLoopJoin':
+        findings['join_scans'].append({'foreign': node.get('foreignCollection'), 'strategy': node.get('strategy')})
+    if '$lookup' in node and node.get('collectionScans'):
+        findings['join_scans'].append({
+            'foreign': node['$lookup'].get('from'),
+            'collection_scans': node['collectionScans'],
+            'indexes_used': node.get('indexesUsed', [])
+        })
+
+    for key, value in node.items():
+        _walk_plan(value, f'{path}.{key}' if path else key, findings)
+
+
+def explain_pipeline(db, collection, pipeline, probe_docs=EXPLAIN_PROBE_DOCS):
+    """Explain a pipeline on a probe of source documents and report its scans"""
+    explain = db.command(
+        'explain',
+        {'aggregate': collection, 'pipeline': [{'$limit': probe_docs}] + pipeline, 'cursor': {}},
+        verbosity='executionStats'
+    )
+    findings = {'collscans': [], 'join_scans': []}
+    _walk_plan(explain, '', findings)
+    return {
+        'collection': collection,
+        'probe_docs': probe_docs,
+        'source_collscan': bool(findings['collscans']),
+        'join_scans': findings['join_scans'],
+        'collscan_stages': findings['collscans']
+    }
+
+
+def explain_pipelines(db, models=None):
+    """Explain every registered training pipeline"""
+    reports = {}
+    for model_name in models or PIPELINES:
+        collection, module_name, builder_name = PIPELINES[model_name]
+        pipeline = getattr(importlib.import_module(module_name), builder_name)()
+        try:
+            reports[model_name] = explain_pipeline(db, collection, pipeline)
+        except Exception as e:
+            reports[model_name] = {'collection': collection, 'error': str(e)}
+    return reports
+
+
+def run_index_advisor(create=False, explain=True):
+    """Check indexes, optionally create the missing ones, and explain the pipelines"""
+    client = get_mongo_client()
+    db = client[DB_NAME]
+
+    statuses = check_indexes(db)
+    created = create_missing_indexes(db, statuses) if create else []
+    plans = explain_pipelines(db) if explain else {}
+    client.close()
+
+    return {
+        'indexes': statuses,
+        'missing': [f"{s['collection']}({', '.join(f for f, _ in s['keys'])})" for s in statuses if not s['present']],
+        'created': created,
+        'pipelines': plans
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and bootstrap the indexes the ML pipelines join on')
+    parser.add_argument('--create', action='store_true', help='Create missing indexes')
+    parser.add_argument('--no-explain', action='store_true', help='Skip explaining the pipelines')
+    args = parser.parse_args()
+
+    result = run_index_advisor(create=args.create, explain=not args.no_explain)
+
+    print("📇 Required indexes:")
+    for status in result['indexes']:
+        mark = '🆕' if status.get('created') else ('✅' if status['present'] else '❌')
+        keys = ', '.join(f'{field}: {direction}' for field, direction in status['keys'])
+        print(f"  {mark} {status['collection']} {{{keys}}} - {status['reason']}")
+
+    if result['missing']:
+        print(f"⚠️  Missing: {', '.join(result['missing'])} (run with --create to build them)")
+
+    for model_name, plan in result['pipelines'].items():
+        if 'error' in plan:
+            print(f"❌ {model_name}: explain failed: {plan['error']}")
+        elif plan['join_scans']:
+            print(f"❌ {model_name}: collection scans in joins: {plan['join_scans']}")
+        else:
+            source = ' (source collection scan)' if plan['source_collscan'] else ''
+            print(f"✅ {model_name}: all joins use indexes{source}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+"""
+Supervised Training Jobs
+========================
+Runs each model training in its own worker process under a supervisor
+thread that enforces:
+
+- a wall-clock deadline (timeout)
+- a memory ceiling on the worker's resident set size (oom)
+- cancellation via cancel() / DELETE /jobs/<id> (cancelled)
+- a CPU share: with a ThreadBudget, a job waits (queued) for a free slot and
+  its worker's thread pools, core affinity and priority follow that slot
+
+Breaching a limit terminates the worker process, which releases all of its
+memory, and the outcome is recorded instead of the service hanging or being
+OOM-killed itself. Workers are started with the 'spawn' method by default so
+they never inherit locks or TensorFlow state from the threaded service, and
+are terminated when the service exits.
+
+A succeeded job's record includes the run's per-stage memory summary
+(memory_stages.py) next to the supervisor's peak RSS.
+
+Job records are kept in memory and in the `ml_jobs` collection. A cancel
+request for a job owned by another service process (gunicorn worker) is
+stored on its record and picked up by the owning supervisor.
+
+Statuses: queued, running, succeeded, failed, timeout, oom, cancelled, crashed
+"""
+
+import atexit
+import multiprocessing
+import multiprocessing.util  # registers its exit join first, so shutdown() below runs before it
+import os
+import signal
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import pymongo
+
+from config import *
+from memory_stages import rss_bytes
+from utils import buffered_reports
+
+
+ACTIVE_STATUSES = ('queued', 'running')
+FINAL_STATUSES = ('succeeded', 'failed', 'timeout', 'oom', 'cancelled', 'crashed')
+MAX_JOBS_IN_MEMORY = 200
+CANCEL_CHECK_SECONDS = 2.0
+KILL_GRACE_SECONDS = 5
+# An unreachable MongoDB must not stall supervision: fail fast, then back off
+MONGO_TIMEOUT_MS = 2000
+MONGO_BACKOFF_SECONDS = 30.0
+
+
+class JobError(Exception):
+    """A job that did not succeed; carries the job record"""
+
+    def __init__(self, job):
+        super().__init__(f"Job {job.id} ({job.model_name}) {job.status}: {job.error}")
+        self.job = job
+
+
+def _job_entry(fn, kwargs, conn, nice=0, collect_reports=False):
+    """Worker process body: run the model and send back the result
+
+    With collect_reports, the reports it saves are sent back for the caller
+    to write instead of being inserted by the worker.
+    """
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+    try:
+        if collect_reports:
+            with buffered_reports() as reports:
+                result = fn(**kwargs)
+            conn.send(('ok', result, reports))
+        else:
+            conn.send(('ok', fn(**kwargs), []))
+    except MemoryError:
+        conn.send(('oom', 'MemoryError in training process'))
+    except BaseException as e:
+        traceback.print_exc()
+        conn.send(('error', f'{type(e).__name__}: {e}', type(e).__name__))
+    finally:
+        conn.close()
+
+
+class Job:
+    def __init__(self, model_name, timeout, memory_mb):
+        self.id = uuid.uuid4().hex[:12]
+        self.model_name = model_name
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.status = 'queued'
+        self.error = None
+        self.error_type = None
+        self.pid = None
+        self.exitcode = None
+        self.peak_rss_mb = None
+        self.memory = None
+        self.threads = None
+        self.cores = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        self.result = None
+        self.reports = []
+        self.cancel_requested = False
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'model_name': self.model_name,
+            'status': self.status,
+            'error': self.error,
+            'error_type': self.error_type,
+            'timeout_seconds': self.timeout,
+            'memory_limit_mb': self.memory_mb,
+            'peak_rss_mb': self.peak_rss_mb,
+            'memory': self.memory,
+            'threads': self.threads,
+            'cores': self.cores,
+            'pid': self.pid,
+            'exitcode': self.exitcode,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'duration_seconds': round((self.finished_at or datetime.utcnow()).timestamp() - self.created_at.timestamp(), 2)
+        }
+
+
+class JobSupervisor:
+    """Runs model trainings in worker processes with time, memory and CPU limits"""
+
+    def __init__(self, timeout=JOB_TIMEOUT, memory_mb=JOB_MEMORY_MB, poll_seconds=JOB_POLL_SECONDS,
+                 start_method=JOB_START_METHOD, budget=None):
+        self.budget = budget
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.poll_seconds = poll_seconds
+        self.start_method = start_method
+        self._jobs = OrderedDict()
+        self._processes = {}
+        self._client = None
+        self._mongo_retry_at = 0.0
+        self._lock = threading.Lock()
+        # Worker environments are set around process start, one start at a time
+        self._start_lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def submit(self, model_name, fn, kwargs=None, timeout=None, memory_mb=None, env=None, collect_reports=False):
+        """Start a job once a CPU slot is free; returns it without waiting for the result"""
+        job = Job(model_name, timeout or self.timeout, memory_mb or self.memory_mb)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOBS_IN_MEMORY:
+                self._jobs.popitem(last=False)
+
+        slot = None
+        nice = 0
+        if self.budget is not None:
+            self._record(job)
+            slot = self.budget.acquire(
+                should_stop=lambda: job.cancel_requested or self._cancel_requested_remotely(job)
+            )
+            if slot is None:
+                job.status, job.error = 'cancelled', 'cancelled while queued'
+                self._finish(job)
+                return job
+            env = {**slot.env(), **(env or {})}
+            job.threads, job.cores, nice = slot.threads, slot.cores, self.budget.nice
+
+        context = multiprocessing.get_context(self.start_method)
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(target=_job_entry, args=(fn, kwargs or {}, child_conn, nice, collect_reports),
+                                  name=f'ml-job-{model_name}')
+
+        # The worker's environment (thread pool sizes) is set only around its start
+        with self._start_lock:
+            saved = {key: os.environ.get(key) for key in (env or {})}
+            os.environ.update(env or {})
+            try:
+                process.start()
+            except Exception:
+                if slot is not None:
+                    self.budget.release(slot)
+                raise
+            finally:
+                for key, value in saved.items():
+                    if value is None:
+                        os.environ.pop(key, None)
+                    else:
+                        os.environ[key] = value
+        started = time.monotonic()
+        child_conn.close()
+        if slot is not None:
+            self.budget.pin(process.pid, slot)
+
+        job.pid = process.pid
+        job.status = 'running'
+        with self._lock:
+            self._processes[job.id] = process
+        self._record(job)
+
+        threading.Thread(target=self._supervise, args=(job, process, parent_conn, started, slot),
+                         name=f'ml-job-supervisor-{job.id}', daemon=True).start()
+        share = f", {job.threads} threads on cores {job.cores}" if slot is not None else ''
+        print(f"🧵 Job {job.id}: {model_name} in pid {job.pid} "
+              f"(timeout {job.timeout}s, memory {job.memory_mb} MB{share})")
+        return job
+
+    def run(self, model_name, fn, kwargs=None, timeout=None, memory_mb=None, env=None, reports=None):
+        """Run a job to completion; returns its result or raises JobError
+
+        If a reports list is given, the job's reports are appended to it
+        unwritten (see utils.save_reports) instead of being inserted by the worker.
+        """
+        job = self.submit(model_name, fn, kwargs, timeout, memory_mb, env, collect_reports=reports is not None)
+        job.done.wait()
+        if job.status != 'succeeded':
+            raise JobError(job)
+        if reports is not None:
+            reports.extend(job.reports)
+        return job.result
+
+    def _supervise(self, job, process, conn, started, slot=None):
+        next_cancel_check = started + CANCEL_CHECK_SECONDS
+        message = None
+
+        while True:
+            if conn.poll(self.poll_seconds):
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    message = None
+                break
+            if not process.is_alive():
+                break
+
+            rss = rss_bytes(process.pid)
+            if rss is not None:
+                job.peak_rss_mb = max(job.peak_rss_mb or 0, round(rss / 2**20, 1))
+                if rss > job.memory_mb * 2**20:
+                    self._stop(job, process, 'oom', f'RSS {rss / 2**20:.0f} MB exceeded {job.memory_mb} MB')
+                    break
+
+            if time.monotonic() - started > job.timeout:
+                self._stop(job, process, 'timeout', f'exceeded {job.timeout}s deadline')
+                break
+
+            if not job.cancel_requested and time.monotonic() >= next_cancel_check:
+                job.cancel_requested = self._cancel_requested_remotely(job)
+                next_cancel_check = time.monotonic() + CANCEL_CHECK_SECONDS
+            if job.cancel_requested:
+                self._stop(job, process, 'cancelled', 'cancelled on request')
+                break
+
+        process.join(KILL_GRACE_SECONDS)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        conn.close()
+        job.exitcode = process.exitcode
+        if slot is not None:
+            self.budget.release(slot)
+
+        if job.status == 'running':
+            if message and message[0] == 'ok':
+                job.status, job.result, job.reports = 'succeeded', message[1], message[2]
+                if isinstance(job.result, dict):
+                    job.memory = job.result.get('memory')
+            elif message and message[0] == 'oom':
+                job.status, job.error = 'oom', message[1]
+            elif message:
+                job.status, job.error, job.error_type = 'failed', message[1], message[2]
+            elif process.exitcode == -signal.SIGKILL:
+                job.status, job.error = 'oom', 'worker killed by SIGKILL (likely the system OOM killer)'
+            else:
+                job.status, job.error = 'crashed', f'worker exited with code {process.exitcode}'
+
+        with self._lock:
+            self._processes.pop(job.id, None)
+        self._finish(job)
+
+    def _finish(self, job):
+        job.finished_at = datetime.utcnow()
+        self._record(job)
+        print(f"{'✅' if job.status == 'succeeded' else '❌'} Job {job.id} ({job.model_name}): {job.status}")
+        job.done.set()
+
+    def _stop(self, job, process, status, error):
+        """Terminate the worker, escalating to SIGKILL after a grace period"""
+        job.status, job.error = status, error
+        process.terminate()
+        process.join(KILL_GRACE_SECONDS)
+        if process.is_alive():
+            process.kill()
+
+    def shutdown(self):
+        """Terminate running workers when the service exits"""
+        with self._lock:
+            running = list(self._processes.items())
+            for job in self._jobs.values():
+                job.cancel_requested = True
+        for job_id, process in running:
+            job = self._jobs[job_id]
+            job.status, job.error = 'cancelled', 'service shut down'
+            process.terminate()
+
+    def cancel(self, job_id):
+        """Cancel a running job; returns its record, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            if job.status in ACTIVE_STATUSES:
+                job.cancel_requested = True
+            return job.to_dict()
+
+        # Owned by another service process: flag it on the shared record
+        records = self._collection()
+        return records.find_one_and_update(
+            {'_id': job_id, 'status': {'$in': list(ACTIVE_STATUSES)}},
+            {'$set': {'cancel_requested': True}}
+        ) or records.find_one({'_id': job_id})
+
+    def _collection(self):
+        if time.monotonic() < self._mongo_retry_at:
+            raise ConnectionError('MongoDB unavailable, retrying later')
+        # One client per process, created lazily so it is never inherited across fork
+        if self._client is None:
+            self._client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+        return self._client[DB_NAME][JOBS_COLLECTION]
+
+    def _cancel_requested_remotely(self, job):
+        try:
+            record = self._collection().find_one({'_id': job.id}, {'cancel_requested': 1})
+        except ConnectionError:
+            return False
+        except Exception:
+            self._mongo_retry_at = time.monotonic() + MONGO_BACKOFF_SECONDS
+            return False
+        return bool(record and record.get('cancel_requested'))
+
+    def _record(self, job):
+        try:
+            self._collection().update_one({'_id': job.id}, {'$set': job.to_dict()}, upsert=True)
+        except ConnectionError:
+            pass
+        except Exception as e:
+            self._mongo_retry_at = time.monotonic() + MONGO_BACKOFF_SECONDS
+            print(f"Warning: Could not record job {job.id}: {e}")
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self._collection().find_one({'_id': job_id})
+
+    def list(self):
+        """Jobs started by this process, newest first"""
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
@@ -14,11 +14,13 @@ Output: Passenger count
 
 Metrics: MSE, R², MAE
 Visualization: Actual vs Predicted scatter plot
+
+Unsampled runs train from the booking-side rows of the route_daily_features
+store; sampled or snapshot runs aggregate raw bookings.
 """
 
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.neighbors import KNeighborsRegressor
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
@@ -26,19 +28,23 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 import base64
+import time
 from io import BytesIO
 
 from config import *
-from utils import get_mongo_client, save_model_report
+from utils import get_mongo_client, save_model_report, save_model_artifact
+from snapshot import load_training_data
+from splits import get_split
+from bootstrap import regression_intervals
+from importance import permutation_importance
+from memory_stages import track_memory, mark_stage, memory_summary
+from sampling import normalize_sampling, default_sampling, build_sampling_stages, describe_sampling
+from feature_store import use_feature_store, load_route_daily_features
 
 
-def fetch_booking_data():
-    """Fetch booking and trip data from MongoDB"""
-    client = get_mongo_client()
-    db = client[DB_NAME]
-    
-    # Aggregate bookings with trip and route info
-    pipeline = [
+def build_booking_pipeline():
+    """Aggregation stages joining bookings with trip and route info"""
+    return [
         {
             '$lookup': {
                 'from': 'trips',
@@ -69,8 +75,21 @@ def fetch_booking_data():
             }
         }
     ]
+
+
+def fetch_booking_data(sampling=None):
+    """Fetch booking and trip data from MongoDB"""
+    client = get_mongo_client()
+    db = client[DB_NAME]
+    
+    # Aggregate bookings with trip and route info
+    pipeline = build_booking_pipeline()
     
-    bookings = list(db[BOOKINGS_COLLECTION].aggregate(pipeline))
+    # Stratifying by route needs the trip join first; other strategies sample raw bookings
+    position = 2 if sampling and sampling['strategy'] == 'stratified' else 0
+    pipeline[position:position] = build_sampling_stages(db[BOOKINGS_COLLECTION], sampling)
+
+    bookings = list(db[BOOKINGS_COLLECTION].aggregate(pipeline, allowDiskUse=bool(sampling)))
     client.close()
     
     return pd.DataFrame(bookings)
@@ -99,6 +118,34 @@ def preprocess_data(df):
     return grouped, route_mapping
 
 
+def preprocess_feature_store(rows):
+    """Same (route, day of week, hour) demand rows as preprocess_data, from store rows"""
+    rows = rows.assign(
+        day_of_week=pd.to_datetime(rows['date']).dt.dayofweek,
+        hour_of_day=rows['hour']
+    )
+    route_mapping = {route: idx for idx, route in enumerate(rows['route'].unique())}
+    rows['route_encoded'] = rows['route'].map(route_mapping)
+
+    grouped = rows.groupby(['route_encoded', 'day_of_week', 'hour_of_day']).agg(
+        passenger_count=('booking_seats', 'sum'),
+        fare_sum=('booking_fare_sum', 'sum'),
+        fare_n=('booking_fare_n', 'sum'),
+        distance=('distance', 'mean')
+    ).reset_index()
+
+    # Mean fare per booking, as preprocess_data computes it; slots without a numeric fare
+    # take the route's mean fare (or the overall one) instead of NaN
+    grouped['fare'] = grouped['fare_sum'] / grouped['fare_n'].where(grouped['fare_n'] > 0)
+    route_fares = grouped.groupby('route_encoded')[['fare_sum', 'fare_n']].transform('sum')
+    overall_fare = grouped['fare_sum'].sum() / grouped['fare_n'].sum() if grouped['fare_n'].sum() > 0 else 0.0
+    grouped['fare'] = grouped['fare'].fillna(
+        (route_fares['fare_sum'] / route_fares['fare_n'].where(route_fares['fare_n'] > 0)).fillna(overall_fare)
+    )
+
+    return grouped.drop(columns=['fare_sum', 'fare_n']), route_mapping
+
+
 def train_knn_model(X_train, y_train, X_test, y_test):
     """Train KNN model and return predictions"""
     # Standardize features
@@ -157,23 +204,34 @@ def create_visualization(y_test, y_pred):
     return f"data:image/png;base64,{image_base64}"
 
 
-def run_knn_demand_prediction():
+@track_memory
+def run_knn_demand_prediction(sampling=None):
     """Main function to run KNN passenger demand prediction"""
     print("🚀 Starting KNN Passenger Demand Prediction...")
     
+    sampling = normalize_sampling(sampling or default_sampling(), by='trip_info.route', time_field='createdAt')
+
     # Fetch data
+    mark_stage('fetch')
+    from_store = use_feature_store(sampling)
     print("📊 Fetching booking data...")
-    df = fetch_booking_data()
+    fetch_start = time.perf_counter()
+    if from_store:
+        df, feature_store = load_route_daily_features('bookings')
+    else:
+        df = load_training_data('knn_demand_prediction', fetch_booking_data, sampling)
+    fetch_seconds = time.perf_counter() - fetch_start
     
     if df.empty:
         print("❌ No booking data found!")
         return None
     
-    print(f"✅ Loaded {len(df)} booking records")
+    print(f"✅ Loaded {len(df)} {'feature store rows' if from_store else 'booking records'}")
     
     # Preprocess
+    mark_stage('features')
     print("🔄 Preprocessing data...")
-    processed_df, route_mapping = preprocess_data(df)
+    processed_df, route_mapping = preprocess_feature_store(df) if from_store else preprocess_data(df)
     
     # Prepare features
     feature_cols = ['route_encoded', 'day_of_week', 'hour_of_day', 'fare', 'distance']
@@ -182,25 +240,35 @@ def run_knn_demand_prediction():
     X = processed_df[feature_cols].values
     y = processed_df[target_col].values
     
-    # Train-test split
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE
-    )
+    # Train-test split, stable per (route, day of week, hour) slot
+    route_ids = {idx: route for route, idx in route_mapping.items()}
+    slots = (processed_df['route_encoded'].map(route_ids).astype(str) + ':' +
+             processed_df['day_of_week'].astype(str) + ':' + processed_df['hour_of_day'].astype(str))
+    split = get_split('knn_demand_prediction', slots)
+    X_train, X_test, y_train, y_test = X[split.train], X[split.test], y[split.train], y[split.test]
     
     print(f"📈 Training set: {len(X_train)}, Test set: {len(X_test)}")
     
     # Train model
+    mark_stage('train')
     print("🤖 Training KNN model...")
+    train_start = time.perf_counter()
     knn, scaler, y_pred_train, y_pred_test = train_knn_model(X_train, y_train, X_test, y_test)
+    train_seconds = time.perf_counter() - train_start
     
     # Calculate metrics
+    mark_stage('evaluate')
     train_metrics = calculate_metrics(y_train, y_pred_train)
     test_metrics = calculate_metrics(y_test, y_pred_test)
     
     print("📊 Training Metrics:", train_metrics)
     print("📊 Testing Metrics:", test_metrics)
+    test_metrics['confidence_intervals'] = regression_intervals(y_test, y_pred_test)
+    importance = permutation_importance(lambda X: knn.predict(scaler.transform(X)), X_test, y_test,
+                                        feature_cols, 'R2_Score')
     
     # Create visualization
+    mark_stage('visualization')
     print("📈 Creating visualization...")
     viz_image = create_visualization(y_test, y_pred_test)
     
@@ -210,17 +278,30 @@ def run_knn_demand_prediction():
         'description': 'Passenger demand prediction based on route, time, and fare',
         'train_metrics': train_metrics,
         'test_metrics': test_metrics,
+        'split': split.summary(),
+        'sampling': describe_sampling(sampling, ROUTE_FEATURES_COLLECTION if from_store else BOOKINGS_COLLECTION,
+                                      len(df), fetch_seconds, train_seconds),
+        'feature_store': feature_store if from_store else None,
         'visualization': viz_image,
-        'feature_importance': {
-            'features': feature_cols,
-            'description': 'All features equally weighted in KNN'
-        },
+        'permutation_importance': importance,
         'hyperparameters': {
             'n_neighbors': 5,
             'weights': 'distance'
         }
     }
     
+    # Save trained model for batch scoring
+    mark_stage('artifact')
+    save_model_artifact('knn_demand_prediction', {
+        'model': knn,
+        'scaler': scaler,
+        'feature_cols': feature_cols,
+        'route_mapping': {str(route): idx for route, idx in route_mapping.items()},
+        'route_profile': processed_df.groupby('route_encoded')[['fare', 'distance']].mean().to_dict('index')
+    })
+    
+    report_data['memory'] = memory_summary()
+    
     # Save to MongoDB
     print("💾 Saving report to MongoDB...")
     report_id = save_model_report('knn_demand_prediction', report_data)
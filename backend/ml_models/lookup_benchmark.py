@@ -0,0 +1,161 @@
+"""
+Booking Lookup Benchmark
+========================
+Compares the two ways of attaching booking totals to trips:
+
+- array:   `$lookup` every booking into a `bookings` array, then `$sum` it
+- grouped: `$lookup` with a `$group` sub-pipeline (booking_totals_lookup),
+           one small document per trip
+
+It seeds a scratch database with trips that have thousands of bookings each,
+runs both pipelines, and reports server execution time (explain
+executionStats), wall time and the size of the largest intermediate trip
+document after the join (the memory each stage has to hold per trip). The
+scratch database is dropped afterwards unless --keep is given.
+
+Usage:
+    python lookup_benchmark.py [--trips 200] [--bookings-per-trip 100 1000 5000]
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+from config import *
+from utils import get_mongo_client, booking_totals_lookup, booking_total
+
+
+BENCHMARK_DB = f'{DB_NAME}_lookup_benchmark'
+INSERT_BATCH = 10000
+
+
+def array_lookup_stages():
+    """The original pattern: materialize all bookings, then sum the array"""
+    return [
+        {
+            '$lookup': {
+                'from': BOOKINGS_COLLECTION,
+                'localField': '_id',
+                'foreignField': 'trip',
+                'as': 'bookings'
+            }
+        },
+        {'$project': {'seats_booked': {'$sum': '$bookings.seats'}, 'revenue': {'$sum': '$bookings.fare'}}}
+    ], '$bookings'
+
+
+def grouped_lookup_stages():
+    """Totals grouped inside the join"""
+    return [
+        booking_totals_lookup(),
+        {'$project': {'seats_booked': booking_total('seats'), 'revenue': booking_total('revenue')}}
+    ], '$booking_totals'
+
+
+VARIANTS = {
+    'array': array_lookup_stages,
+    'grouped': grouped_lookup_stages,
+}
+
+
+def seed(db, n_trips, bookings_per_trip):
+    """Create trips with a fixed number of bookings each"""
+    db[TRIPS_COLLECTION].drop()
+    db[BOOKINGS_COLLECTION].drop()
+
+    trip_ids = [ObjectId() for _ in range(n_trips)]
+    db[TRIPS_COLLECTION].insert_many([{'_id': trip_id, 'bus': {'capacity': 50}} for trip_id in trip_ids])
+
+    batch = []
+    for trip_id in trip_ids:
+        for i in range(bookings_per_trip):
+            batch.append({'trip': trip_id, 'seats': 1 + i % 4, 'fare': 50.0 + i % 200, 'createdAt': datetime.utcnow()})
+            if len(batch) >= INSERT_BATCH:
+                db[BOOKINGS_COLLECTION].insert_many(batch)
+                batch = []
+    if batch:
+        db[BOOKINGS_COLLECTION].insert_many(batch)
+
+    db[BOOKINGS_COLLECTION].create_index('trip')
+
+
+def measure(db, variant):
+    """Server time, wall time and intermediate document size for one variant"""
+    stages, joined_field = VARIANTS[variant]()
+
+    explain = db.command(
+        'explain',
+        {'aggregate': TRIPS_COLLECTION, 'pipeline': stages, 'cursor': {}},
+        verbosity='executionStats'
+    )
+    server_ms = explain.get('executionStats', {}).get('executionTimeMillis')
+    if server_ms is None:
+        server_ms = max((stage.get('executionTimeMillisEstimate', 0) for stage in explain.get('stages', [])), default=None)
+
+    start = time.perf_counter()
+    rows = list(db[TRIPS_COLLECTION].aggregate(stages))
+    wall_seconds = time.perf_counter() - start
+
+    # Size of each trip document right after the join
+    sizes = list(db[TRIPS_COLLECTION].aggregate([
+        stages[0],
+        {'$project': {'bytes': {'$bsonSize': '$$ROOT'}, 'joined': {'$size': joined_field}}},
+        {'$group': {'_id': None, 'max_bytes': {'$max': '$bytes'}, 'avg_bytes': {'$avg': '$bytes'},
+                    'total_bytes': {'$sum': '$bytes'}}}
+    ]))[0]
+
+    return {
+        'server_ms': server_ms,
+        'wall_seconds': round(wall_seconds, 4),
+        'rows': len(rows),
+        'max_joined_doc_bytes': int(sizes['max_bytes']),
+        'avg_joined_doc_bytes': round(sizes['avg_bytes'], 1),
+        'total_joined_bytes': int(sizes['total_bytes']),
+        'seats_total': sum(row['seats_booked'] for row in rows)
+    }
+
+
+def run_benchmark(n_trips, bookings_per_trip_options, keep=False):
+    client = get_mongo_client()
+    db = client[BENCHMARK_DB]
+
+    results = []
+    try:
+        for bookings_per_trip in bookings_per_trip_options:
+            print(f"🌱 Seeding {n_trips} trips x {bookings_per_trip} bookings...")
+            seed(db, n_trips, bookings_per_trip)
+
+            point = {'trips': n_trips, 'bookings_per_trip': bookings_per_trip}
+            for variant in VARIANTS:
+                point[variant] = measure(db, variant)
+
+            if point['array']['seats_total'] != point['grouped']['seats_total']:
+                raise AssertionError(f"Totals differ: {point}")
+            results.append(point)
+
+            print(f"  array:   {point['array']['server_ms']} ms server, "
+                  f"max joined doc {point['array']['max_joined_doc_bytes'] / 1024:.1f} KB")
+            print(f"  grouped: {point['grouped']['server_ms']} ms server, "
+                  f"max joined doc {point['grouped']['max_joined_doc_bytes'] / 1024:.1f} KB")
+    finally:
+        if not keep:
+            client.drop_database(BENCHMARK_DB)
+        client.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark array vs grouped booking $lookup')
+    parser.add_argument('--trips', type=int, default=200)
+    parser.add_argument('--bookings-per-trip', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch database')
+    args = parser.parse_args()
+
+    run_benchmark(args.trips, args.bookings_per_trip, args.keep)
+
+
+if __name__ == '__main__':
+    main()
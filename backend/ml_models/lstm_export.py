@@ -0,0 +1,290 @@
+"""
+CPU Inference Export for the Demand LSTM
+========================================
+The demand LSTM (ml-research/demand_prediction_lstm.py) is saved as a Keras
+.h5 file, and serving it through Keras means importing all of TensorFlow
+(seconds, hundreds of MB) and paying model.predict's per-call setup. The
+model itself is small: LSTM(128) -> LSTM(64) -> Dense(32, relu) -> Dense(1).
+
+`export` reads the trained weights once, on a machine with TensorFlow, and
+writes them to a .npz file that NumpyLSTM runs with plain NumPy:
+
+- each LSTM layer projects every timestep's input in one matmul, then steps
+  through time with the recurrent matmul only (Keras gate order i, f, c, o)
+- Dropout layers are dropped (inference is identity)
+- batched: a (routes, days, features) window is one forward pass
+
+The export runs a parity check against the Keras model on random windows in
+the scaled [0, 1] input range and refuses to write a file that disagrees.
+`benchmark` compares load cost, memory and single/batched latency of the
+Keras model (model.predict and a direct call) against the NumPy export.
+
+/forecast/demand uses the export when it exists and is not older than the
+Keras file, so the service never imports TensorFlow for forecasting.
+
+Experimental: neither the parity check nor the Keras side of the benchmark
+has been run yet (TensorFlow was not available where this was written), so
+agreement with Keras and the latency gain over it are unverified. NumpyLSTM
+has only been timed on its own. Run `export` and `benchmark` on a machine
+with TensorFlow, and record the results in ML_SERVICE_PRODUCTION.md before
+serving an export in production.
+
+Usage:
+    python lstm_export.py export [--model PATH] [--out PATH]
+    python lstm_export.py benchmark [--batch 64] [--repeats 200]
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from scipy.special import expit
+
+from config import *
+
+
+SUPPORTED_ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'tanh': np.tanh,
+    'sigmoid': expit
+}
+PARITY_TOLERANCE = 1e-4  # max abs difference on scaled predictions
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _activation(name):
+    if name not in SUPPORTED_ACTIVATIONS:
+        raise ValueError(f"Unsupported activation '{name}'")
+    return name
+
+
+def keras_layer_spec(model):
+    """Layer list and weights of a Sequential LSTM/Dense model, or ValueError"""
+    spec, arrays = [], {}
+    for layer in model.layers:
+        kind = type(layer).__name__
+        config = layer.get_config()
+        if kind in ('Dropout', 'InputLayer'):
+            continue
+        index = len(spec)
+        if kind == 'LSTM':
+            if config.get('go_backwards') or config.get('stateful') or not config.get('use_bias', True):
+                raise ValueError(f"LSTM layer '{layer.name}' uses options the export does not support")
+            kernel, recurrent, bias = layer.get_weights()
+            spec.append({
+                'type': 'lstm',
+                'units': config['units'],
+                'activation': _activation(config['activation']),
+                'recurrent_activation': _activation(config['recurrent_activation']),
+                'return_sequences': config['return_sequences']
+            })
+            arrays.update({f'{index}_kernel': kernel, f'{index}_recurrent': recurrent, f'{index}_bias': bias})
+        elif kind == 'Dense':
+            weights = layer.get_weights()
+            spec.append({'type': 'dense', 'activation': _activation(config['activation'])})
+            arrays[f'{index}_kernel'] = weights[0]
+            arrays[f'{index}_bias'] = weights[1] if len(weights) > 1 else np.zeros(weights[0].shape[1])
+        else:
+            raise ValueError(f"Layer type {kind} is not supported by the NumPy export")
+    return spec, {name: np.asarray(value, dtype=np.float32) for name, value in arrays.items()}
+
+
+class NumpyLSTM:
+    """Forward pass of an exported Sequential LSTM/Dense model in NumPy (float32)"""
+
+    def __init__(self, spec, arrays, sequence_length):
+        self.spec = spec
+        self.arrays = arrays
+        self.sequence_length = sequence_length
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['spec']))
+            arrays = {name: data[name] for name in data.files if name != 'spec'}
+        return cls(meta['layers'], arrays, meta['sequence_length'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        meta = json.dumps({'layers': self.spec, 'sequence_length': self.sequence_length})
+        np.savez(path, spec=np.array(meta), **self.arrays)
+        return path
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def _lstm(self, x, index, layer):
+        kernel = self.arrays[f'{index}_kernel']
+        recurrent = self.arrays[f'{index}_recurrent']
+        units = layer['units']
+        activation = SUPPORTED_ACTIVATIONS[layer['activation']]
+        recurrent_activation = SUPPORTED_ACTIVATIONS[layer['recurrent_activation']]
+
+        # Input projection for all timesteps at once; only h @ U stays in the loop
+        projected = x @ kernel + self.arrays[f'{index}_bias']
+        h = np.zeros((x.shape[0], units), dtype=np.float32)
+        c = np.zeros_like(h)
+        outputs = []
+        for t in range(x.shape[1]):
+            z = projected[:, t, :] + h @ recurrent
+            i = recurrent_activation(z[:, :units])
+            f = recurrent_activation(z[:, units:2 * units])
+            g = activation(z[:, 2 * units:3 * units])
+            o = recurrent_activation(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * activation(c)
+            if layer['return_sequences']:
+                outputs.append(h)
+        return np.stack(outputs, axis=1) if layer['return_sequences'] else h
+
+    def __call__(self, X):
+        x = np.asarray(X, dtype=np.float32)
+        for index, layer in enumerate(self.spec):
+            if layer['type'] == 'lstm':
+                x = self._lstm(x, index, layer)
+            else:
+                x = SUPPORTED_ACTIVATIONS[layer['activation']](
+                    x @ self.arrays[f'{index}_kernel'] + self.arrays[f'{index}_bias']
+                )
+        return x
+
+    def predict(self, X):
+        return self(X).reshape(-1)
+
+
+def parity_check(keras_model, numpy_model, n_samples=256, seed=0):
+    """Max/mean abs difference between Keras and NumPy on random scaled windows"""
+    n_features = keras_model.input_shape[-1]
+    X = np.random.default_rng(seed).random((n_samples, numpy_model.sequence_length, n_features), dtype=np.float32)
+    expected = keras_model(X, training=False).numpy().reshape(-1)
+    actual = numpy_model.predict(X)
+    error = np.abs(expected - actual)
+    return {
+        'samples': n_samples,
+        'max_abs_error': float(error.max()),
+        'mean_abs_error': float(error.mean()),
+        'tolerance': PARITY_TOLERANCE,
+        'passed': bool(error.max() <= PARITY_TOLERANCE)
+    }
+
+
+def _load_keras(model_path):
+    try:
+        from tensorflow import keras
+    except ImportError:
+        raise RuntimeError("Exporting or benchmarking the Keras model needs TensorFlow, which is not installed")
+    return keras.models.load_model(model_path, compile=False)
+
+
+def export_numpy_lstm(model_path=DEMAND_MODEL_PATH, out_path=DEMAND_NUMPY_MODEL_PATH):
+    """Write the Keras LSTM's weights as a NumPy inference artifact after a parity check"""
+    keras_model = _load_keras(model_path)
+    spec, arrays = keras_layer_spec(keras_model)
+    numpy_model = NumpyLSTM(spec, arrays, keras_model.input_shape[1])
+
+    parity = parity_check(keras_model, numpy_model)
+    if not parity['passed']:
+        raise ValueError(f"NumPy export disagrees with Keras (max abs error {parity['max_abs_error']:.2e}); "
+                         f"not written")
+    numpy_model.save(out_path)
+    return {
+        'path': out_path,
+        'layers': [layer['type'] for layer in spec],
+        'sequence_length': numpy_model.sequence_length,
+        'bytes': os.path.getsize(out_path),
+        'parity': parity
+    }
+
+
+def _latency(fn, X, repeats):
+    fn(X)  # warm-up (graph tracing, allocator)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(X)
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return {'p50_ms': round(float(np.percentile(times, 50)), 3), 'p99_ms': round(float(np.percentile(times, 99)), 3)}
+
+
+def run_inference_benchmark(model_path=DEMAND_MODEL_PATH, numpy_path=DEMAND_NUMPY_MODEL_PATH,
+                            batch_sizes=(1, 64), repeats=200):
+    """Load cost, memory and latency of the NumPy export vs the Keras model
+
+    NumPy runs first so its memory delta does not include TensorFlow.
+    """
+    results = {}
+
+    rss, start = _rss_mb(), time.perf_counter()
+    numpy_model = NumpyLSTM.load(numpy_path)
+    results['numpy'] = {
+        'load_seconds': round(time.perf_counter() - start, 3),
+        'rss_delta_mb': round(_rss_mb() - rss, 1) if rss is not None else None,
+        'weights_mb': round(numpy_model.nbytes / 2**20, 2)
+    }
+
+    keras_model = None
+    rss, start = _rss_mb(), time.perf_counter()
+    try:
+        keras_model = _load_keras(model_path)
+        results['keras'] = {
+            'load_seconds': round(time.perf_counter() - start, 3),  # includes importing TensorFlow
+            'rss_delta_mb': round(_rss_mb() - rss, 1) if rss is not None else None
+        }
+    except (RuntimeError, OSError) as e:
+        print(f"Warning: Keras model not benchmarked: {e}")
+
+    n_features = keras_model.input_shape[-1] if keras_model is not None else \
+        numpy_model.arrays['0_kernel'].shape[0]
+    rng = np.random.default_rng(0)
+    for batch in batch_sizes:
+        X = rng.random((batch, numpy_model.sequence_length, n_features), dtype=np.float32)
+        results['numpy'][f'batch_{batch}'] = _latency(numpy_model.predict, X, repeats)
+        if keras_model is not None:
+            results['keras'][f'batch_{batch}_predict'] = _latency(lambda x: keras_model.predict(x, verbose=0), X, repeats)
+            results['keras'][f'batch_{batch}_call'] = _latency(lambda x: keras_model(x, training=False).numpy(), X, repeats)
+
+    if keras_model is not None:
+        results['parity'] = parity_check(keras_model, numpy_model)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the demand LSTM for NumPy inference, or benchmark it')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='Write the NumPy artifact after a parity check')
+    export_parser.add_argument('--model', default=DEMAND_MODEL_PATH)
+    export_parser.add_argument('--out', default=DEMAND_NUMPY_MODEL_PATH)
+    bench_parser = subparsers.add_parser('benchmark', help='Keras vs NumPy load cost, memory and latency')
+    bench_parser.add_argument('--model', default=DEMAND_MODEL_PATH)
+    bench_parser.add_argument('--numpy', default=DEMAND_NUMPY_MODEL_PATH)
+    bench_parser.add_argument('--batch', type=int, default=64)
+    bench_parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        summary = export_numpy_lstm(args.model, args.out)
+        print(f"✅ Exported {' -> '.join(summary['layers'])} to {summary['path']} ({summary['bytes']} bytes), "
+              f"max abs error vs Keras {summary['parity']['max_abs_error']:.2e}")
+    else:
+        results = run_inference_benchmark(args.model, args.numpy, (1, args.batch), args.repeats)
+        for backend in ('numpy', 'keras'):
+            if backend in results:
+                print(f"⏱️  {backend}: {results[backend]}")
+        if 'parity' in results:
+            print(f"🎯 parity: {results['parity']}")
+
+
+if __name__ == '__main__':
+    main()
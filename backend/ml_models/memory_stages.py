@@ -0,0 +1,185 @@
+"""
+Per-Stage Memory Accounting
+===========================
+Records how much memory each stage of a pipeline run uses, so container
+sizes can be chosen from measurements and the stages that need streaming or
+compaction stand out.
+
+For each stage (fetch, features, train, evaluate, visualization, artifact):
+
+- rss_delta_mb: change in the process's resident set size over the stage
+  (negative when the stage released more than it kept)
+- traced_peak_mb: with ML_MEMORY_TRACE=true, peak of Python and NumPy
+  allocations during the stage, above what was allocated when it started,
+  from tracemalloc. This catches short-lived buffers, such as the raw
+  aggregation result list or the PNG buffer, that are freed before the stage
+  ends and never show up in the RSS delta
+
+A stage whose RSS delta or traced peak exceeds MEMORY_WARN_MB is printed as
+a warning and listed in the summary's 'warnings'. tracemalloc slows down
+allocation-heavy code, so it is off by default and only the RSS figures are
+recorded; enable it for sizing runs, not for throughput measurements.
+
+Stages are sequential: mark_stage() ends the current stage and starts the
+next one, and memory_summary() ends the last one. Tracked runs are kept per
+thread, so runs in concurrent request threads (/score) record only their own
+stages. tracemalloc is process-wide: it stays on until the last traced run
+ends, and a traced peak taken while another run is active includes that
+run's allocations. RSS is process-wide as well.
+
+Usage:
+    @track_memory
+    def run_model(sampling=None):
+        mark_stage('fetch')
+        ...
+        mark_stage('train')
+        ...
+        report_data['memory'] = memory_summary()
+"""
+
+import functools
+import os
+import threading
+import time
+import tracemalloc
+
+from config import *
+
+
+MB = 2 ** 20
+
+_local = threading.local()
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+
+
+def rss_bytes(pid='self'):
+    """Resident set size of a process, or None where /proc is unavailable"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _mb(value):
+    return round(value / MB, 1) if value is not None else None
+
+
+class MemoryTracker:
+    """Sequential stages of one run with their RSS delta and traced allocation peak"""
+
+    def __init__(self, name, trace=MEMORY_TRACE, warn_mb=MEMORY_WARN_MB):
+        self.name = name
+        self.warn_mb = warn_mb
+        self.stages = []
+        self._current = None
+        self._tracing = bool(trace) and _start_tracing()
+        self.start_rss = rss_bytes()
+
+    def stage(self, name):
+        """End the current stage and start the next one"""
+        self._end_stage()
+        traced = 0
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            traced = tracemalloc.get_traced_memory()[0]
+        self._current = (name, rss_bytes(), traced, time.perf_counter())
+
+    def _end_stage(self):
+        if self._current is None:
+            return
+        name, start_rss, start_traced, start = self._current
+        end_rss = rss_bytes()
+        stage = {
+            'stage': name,
+            'rss_mb': _mb(end_rss),
+            'rss_delta_mb': _mb(end_rss - start_rss) if end_rss is not None and start_rss is not None else None,
+            'traced_peak_mb': _mb(tracemalloc.get_traced_memory()[1] - start_traced) if tracemalloc.is_tracing() else None,
+            'seconds': round(time.perf_counter() - start, 4)
+        }
+        self.stages.append(stage)
+        self._current = None
+
+        used = max(stage['rss_delta_mb'] or 0, stage['traced_peak_mb'] or 0)
+        if self.warn_mb and used > self.warn_mb:
+            print(f"Warning: Stage '{name}' of {self.name} used {used:.0f} MB "
+                  f"(threshold {self.warn_mb} MB)")
+
+    def summary(self):
+        """End the current stage; stage list plus the run's overall figures"""
+        self._end_stage()
+        end_rss = rss_bytes()
+        peaks = [stage['traced_peak_mb'] for stage in self.stages if stage['traced_peak_mb'] is not None]
+        return {
+            'stages': self.stages,
+            'start_rss_mb': _mb(self.start_rss),
+            'end_rss_mb': _mb(end_rss),
+            'traced_peak_mb': max(peaks) if peaks else None,
+            'warn_mb': self.warn_mb,
+            'warnings': [
+                stage['stage'] for stage in self.stages
+                if self.warn_mb and max(stage['rss_delta_mb'] or 0, stage['traced_peak_mb'] or 0) > self.warn_mb
+            ]
+        }
+
+    def close(self):
+        if self._tracing:
+            self._tracing = False
+            _stop_tracing()
+
+
+def _start_tracing():
+    """Count a traced run, starting tracemalloc for the first one; False if tracing was started elsewhere"""
+    global _tracing_runs
+    with _tracing_lock:
+        if _tracing_runs == 0 and tracemalloc.is_tracing():
+            return False
+        if _tracing_runs == 0:
+            tracemalloc.start()
+        _tracing_runs += 1
+        return True
+
+
+def _stop_tracing():
+    """Stop tracemalloc when the last traced run ends"""
+    global _tracing_runs
+    with _tracing_lock:
+        _tracing_runs -= 1
+        if _tracing_runs == 0:
+            tracemalloc.stop()
+
+
+def _trackers():
+    """Stack of this thread's tracked runs"""
+    if not hasattr(_local, 'trackers'):
+        _local.trackers = []
+    return _local.trackers
+
+
+def track_memory(fn):
+    """Decorator: run fn with a memory tracker that mark_stage/memory_summary report to"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        tracker = MemoryTracker(fn.__name__)
+        trackers = _trackers()
+        trackers.append(tracker)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            trackers.remove(tracker)
+            tracker.close()
+    return wrapper
+
+
+def mark_stage(name):
+    """Start the named stage of this thread's innermost tracked run (no-op outside one)"""
+    trackers = _trackers()
+    if trackers:
+        trackers[-1].stage(name)
+
+
+def memory_summary():
+    """Summary of this thread's innermost tracked run, or None outside one"""
+    trackers = _trackers()
+    return trackers[-1].summary() if trackers else None
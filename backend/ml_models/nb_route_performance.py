@@ -13,11 +13,26 @@ Output: Performance class (High/Medium/Low)
 
 Metrics: Accuracy, Precision, Recall, F1-Score
 Visualization: Confusion matrix heatmap
+
+Incremental mode keeps each trip's features, per-route running sums and
+per-class moments (count, mean, centered sum of squares) in a persisted
+state artifact. Each update fetches the trips changed since the last one
+(trip or booking `updatedAt`), removes their earlier contribution, adds the
+current one, moves the touched routes between classes, and rebuilds the
+scaler moments and the GaussianNB class means/variances from the class
+moments. Class thresholds stay fixed until the next full refit, which runs
+only on demand. Deleted trips leave no `updatedAt` trail; refit after bulk
+deletes.
+
+Routes with an undefined feature (no trip with a bus capacity) are left out
+of training and evaluation in both modes.
+
+Unsampled full runs read the trip-side rows of the route_daily_features store
+(per-route sums and counts) instead of joining every trip.
 """
 
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.naive_bayes import GaussianNB
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix
@@ -25,19 +40,31 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime, timedelta
 import base64
+import sys
+import time
 from io import BytesIO
 
 from config import *
-from utils import get_mongo_client, save_model_report
+from utils import get_mongo_client, save_model_report, save_model_artifact, load_model_artifact, booking_totals_lookup, booking_total
+from snapshot import load_training_data
+from splits import get_split, is_holdout
+from bootstrap import classification_intervals
+from importance import permutation_importance
+from memory_stages import track_memory, mark_stage, memory_summary
+from sampling import normalize_sampling, default_sampling, build_sampling_stages, describe_sampling
+from feature_store import use_feature_store, load_route_daily_features, route_totals
 
 
-def fetch_route_performance_data():
-    """Fetch route performance data from MongoDB"""
-    client = get_mongo_client()
-    db = client[DB_NAME]
-    
-    # Aggregate trips with route, booking, and fuel data
-    pipeline = [
+FEATURE_COLS = ['occupancy_percentage', 'fuel_per_km', 'delay_count', 'revenue_per_km']
+MEAN_FEATURES = ['occupancy_percentage', 'fuel_per_km', 'revenue_per_km']
+DELAY_THRESHOLD_MINUTES = 15
+INCREMENTAL_STATE = 'nb_route_performance_state'
+INCREMENTAL_STATE_VERSION = 2
+
+
+def build_route_performance_pipeline():
+    """Aggregation stages joining trips with route and booking totals"""
+    return [
         {
             '$lookup': {
                 'from': 'routes',
@@ -47,37 +74,49 @@ def fetch_route_performance_data():
             }
         },
         {'$unwind': '$route_info'},
-        {
-            '$lookup': {
-                'from': 'bookings',
-                'localField': '_id',
-                'foreignField': 'trip',
-                'as': 'bookings'
-            }
-        },
+        booking_totals_lookup(),
         {
             '$project': {
                 'route_id': '$route_info._id',
                 'route_name': '$route_info.name',
                 'distance': '$route_info.distance',
                 'capacity': '$bus.capacity',
-                'seats_booked': {'$sum': '$bookings.seats'},
-                'revenue': {'$sum': '$bookings.fare'},
+                'seats_booked': booking_total('seats'),
+                'revenue': booking_total('revenue'),
                 'scheduled_departure': '$scheduledDeparture',
                 'actual_departure': '$actualDeparture',
                 'fuel_cost': {'$ifNull': ['$fuelCost', 0]}
             }
         }
     ]
+
+
+def fetch_route_performance_data(sampling=None, changed_since=None):
+    """Fetch route performance data from MongoDB (optionally only trips changed since a time)
+
+    A trip counts as changed when it or one of its bookings was updated at or
+    after changed_since.
+    """
+    client = get_mongo_client()
+    db = client[DB_NAME]
+    
+    # Aggregate trips with route, booking, and fuel data
+    pipeline = build_route_performance_pipeline()
     
-    trips = list(db[TRIPS_COLLECTION].aggregate(pipeline))
+    pipeline[0:0] = build_sampling_stages(db[TRIPS_COLLECTION], sampling)
+    if changed_since is not None:
+        changed = {'updatedAt': {'$gte': changed_since}}
+        booked_trips = db[BOOKINGS_COLLECTION].distinct('trip', changed)
+        pipeline.insert(0, {'$match': {'$or': [changed, {'_id': {'$in': booked_trips}}]}})
+
+    trips = list(db[TRIPS_COLLECTION].aggregate(pipeline, allowDiskUse=bool(sampling)))
     client.close()
     
     return pd.DataFrame(trips)
 
 
-def calculate_performance_features(df):
-    """Calculate performance features for classification"""
+def calculate_trip_features(df):
+    """Calculate per-trip performance features"""
     # Occupancy percentage
     df['occupancy_percentage'] = (df['seats_booked'] / df['capacity'].replace(0, 1)) * 100
     df['occupancy_percentage'] = df['occupancy_percentage'].clip(0, 100)
@@ -94,11 +133,18 @@ def calculate_performance_features(df):
     # Fuel cost per km
     df['fuel_per_km'] = df['fuel_cost'] / df['distance'].replace(0, 1)
     
+    return df
+
+
+def calculate_performance_features(df):
+    """Calculate performance features for classification"""
+    df = calculate_trip_features(df)
+    
     # Group by route to get aggregate metrics
     route_metrics = df.groupby('route_id').agg({
         'occupancy_percentage': 'mean',
         'fuel_per_km': 'mean',
-        'delay_minutes': lambda x: (x > 15).sum(),  # Count delays > 15 min
+        'delay_minutes': lambda x: (x > DELAY_THRESHOLD_MINUTES).sum(),  # Count delays > 15 min
         'revenue_per_km': 'mean'
     }).reset_index()
     
@@ -107,23 +153,38 @@ def calculate_performance_features(df):
     return route_metrics
 
 
-def classify_performance(df):
-    """Classify routes into High/Medium/Low performance"""
-    # Composite score calculation
-    df['performance_score'] = (
+def performance_features_from_store(rows):
+    """Same per-route features as calculate_performance_features, from store rows"""
+    totals = route_totals(rows, [f'{feature}_{suffix}' for feature in MEAN_FEATURES for suffix in ('sum', 'n')] +
+                          ['delay_count'])
+    return route_features(totals).reset_index()
+
+
+def performance_score(df):
+    """Composite performance score per route"""
+    return (
         df['occupancy_percentage'] * 0.4 +
         df['revenue_per_km'] * 0.4 -
         df['delay_count'] * 2 -
         df['fuel_per_km'] * 0.2
     )
+
+
+def label_performance(scores, low_threshold, high_threshold):
+    """Map composite scores to High/Medium/Low"""
+    return np.where(scores >= high_threshold, 'High', np.where(scores <= low_threshold, 'Low', 'Medium'))
+
+
+def classify_performance(df):
+    """Classify routes into High/Medium/Low performance"""
+    # Composite score calculation
+    df['performance_score'] = performance_score(df)
     
     # Classify based on percentiles
     high_threshold = df['performance_score'].quantile(0.67)
     low_threshold = df['performance_score'].quantile(0.33)
     
-    df['performance_class'] = df['performance_score'].apply(
-        lambda x: 'High' if x >= high_threshold else ('Low' if x <= low_threshold else 'Medium')
-    )
+    df['performance_class'] = label_performance(df['performance_score'], low_threshold, high_threshold)
     
     return df
 
@@ -184,23 +245,35 @@ def create_confusion_matrix_heatmap(y_test, y_pred, class_labels):
     return f"data:image/png;base64,{image_base64}"
 
 
-def run_naive_bayes_classification():
+@track_memory
+def run_naive_bayes_classification(sampling=None):
     """Main function to run Naive Bayes route performance classification"""
     print("🚀 Starting Naive Bayes Route Performance Classification...")
     
+    sampling = normalize_sampling(sampling or default_sampling(), by='route', time_field='scheduledDeparture')
+
     # Fetch data
+    mark_stage('fetch')
+    from_store = use_feature_store(sampling)
     print("📊 Fetching trip data...")
-    df = fetch_route_performance_data()
+    fetch_start = time.perf_counter()
+    if from_store:
+        df, feature_store = load_route_daily_features('trips')
+    else:
+        df = load_training_data('nb_route_performance', fetch_route_performance_data, sampling)
+    fetch_seconds = time.perf_counter() - fetch_start
     
     if df.empty:
         print("❌ No trip data found!")
         return None
     
-    print(f"✅ Loaded {len(df)} trip records")
+    print(f"✅ Loaded {len(df)} {'feature store rows' if from_store else 'trip records'}")
     
     # Calculate features
+    mark_stage('features')
     print("🔄 Calculating performance features...")
-    route_metrics = calculate_performance_features(df)
+    route_metrics = performance_features_from_store(df) if from_store else calculate_performance_features(df)
+    route_metrics = route_metrics[complete_features(route_metrics[FEATURE_COLS].values)]
     
     # Classify performance
     route_metrics = classify_performance(route_metrics)
@@ -209,31 +282,38 @@ def run_naive_bayes_classification():
     print(route_metrics['performance_class'].value_counts())
     
     # Prepare features
-    feature_cols = ['occupancy_percentage', 'fuel_per_km', 'delay_count', 'revenue_per_km']
+    feature_cols = FEATURE_COLS
     target_col = 'performance_class'
     
     X = route_metrics[feature_cols].values
     y = route_metrics[target_col].values
     
-    # Train-test split
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y
-    )
+    # Train-test split, stable per route (the same holdout routes as the incremental update)
+    split = get_split('nb_route_performance', route_metrics['route_id'])
+    X_train, X_test, y_train, y_test = X[split.train], X[split.test], y[split.train], y[split.test]
     
     print(f"📈 Training set: {len(X_train)}, Test set: {len(X_test)}")
     
     # Train model
+    mark_stage('train')
     print("🤖 Training Naive Bayes model...")
+    train_start = time.perf_counter()
     nb, scaler, y_pred_train, y_pred_test = train_naive_bayes_model(X_train, y_train, X_test, y_test)
+    train_seconds = time.perf_counter() - train_start
     
     # Calculate metrics
+    mark_stage('evaluate')
     train_metrics = calculate_classification_metrics(y_train, y_pred_train)
     test_metrics = calculate_classification_metrics(y_test, y_pred_test)
     
     print("📊 Training Metrics:", train_metrics)
     print("📊 Testing Metrics:", test_metrics)
+    test_metrics['confidence_intervals'] = classification_intervals(y_test, y_pred_test, average='weighted')
+    importance = permutation_importance(lambda X: nb.predict(scaler.transform(X)), X_test, y_test,
+                                        feature_cols, 'Accuracy')
     
     # Create visualization
+    mark_stage('visualization')
     print("📈 Creating confusion matrix...")
     class_labels = sorted(route_metrics['performance_class'].unique())
     viz_image = create_confusion_matrix_heatmap(y_test, y_pred_test, class_labels)
@@ -244,14 +324,29 @@ def run_naive_bayes_classification():
         'description': 'Route performance classification (High/Medium/Low)',
         'train_metrics': train_metrics,
         'test_metrics': test_metrics,
+        'split': split.summary(),
+        'sampling': describe_sampling(sampling, ROUTE_FEATURES_COLLECTION if from_store else TRIPS_COLLECTION,
+                                      len(df), fetch_seconds, train_seconds),
+        'feature_store': feature_store if from_store else None,
         'visualization': viz_image,
         'class_distribution': route_metrics['performance_class'].value_counts().to_dict(),
         'feature_importance': {
             'features': feature_cols,
             'weights': [0.4, 0.2, 0.2, 0.4]
-        }
+        },
+        'permutation_importance': importance
     }
     
+    # Save trained model for batch scoring
+    mark_stage('artifact')
+    save_model_artifact('nb_route_performance', {
+        'model': nb,
+        'scaler': scaler,
+        'feature_cols': feature_cols
+    })
+    
+    report_data['memory'] = memory_summary()
+    
     # Save to MongoDB
     print("💾 Saving report to MongoDB...")
     report_id = save_model_report('nb_route_performance', report_data)
@@ -260,7 +355,302 @@ def run_naive_bayes_classification():
     return report_data
 
 
+
+def trip_contributions(trips):
+    """Per-trip rows that make up the route sums, indexed by trip id"""
+    return pd.DataFrame({
+        'route_id': trips['route_id'].astype(str).values,
+        **{feature: trips[feature].values for feature in MEAN_FEATURES},
+        'delay_minutes': trips['delay_minutes'].values
+    }, index=trips['_id'].astype(str).values)
+
+
+def accumulate_route_stats(trips, route_stats=None):
+    """Add a batch of per-trip features to the running per-route sums"""
+    trips = trips.assign(
+        route_id=trips['route_id'].astype(str),
+        delayed=(trips['delay_minutes'] > DELAY_THRESHOLD_MINUTES).astype(float)
+    )
+    grouped = trips.groupby('route_id')
+    batch = pd.concat(
+        [grouped.size().rename('trips'),
+         grouped[MEAN_FEATURES].sum().add_suffix('_sum'),
+         grouped[MEAN_FEATURES].count().add_suffix('_n'),
+         grouped['delayed'].sum().rename('delay_count')],
+        axis=1
+    ).astype(float)
+
+    if route_stats is None or route_stats.empty:
+        return batch
+    return route_stats.add(batch, fill_value=0)
+
+
+def route_features(route_stats):
+    """Per-route feature rows from running sums (same values as calculate_performance_features)"""
+    features = pd.DataFrame(index=route_stats.index)
+    for feature in MEAN_FEATURES:
+        features[feature] = route_stats[f'{feature}_sum'] / route_stats[f'{feature}_n'].replace(0, np.nan)
+    features['delay_count'] = route_stats['delay_count']
+    return features[FEATURE_COLS]
+
+
+def complete_features(X):
+    """Rows whose features are all defined; the others cannot be trained or scored"""
+    return ~np.isnan(np.asarray(X, dtype=np.float64)).any(axis=1)
+
+
+def is_holdout_route(route_id):
+    """Stable test-set membership by route id, so updates never reshuffle the split"""
+    return is_holdout(route_id)
+
+
+def _merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """Count, mean and centered sum of squares of two row sets combined (Chan et al.)"""
+    n = n_a + n_b
+    if n <= 0:
+        return 0.0, np.zeros_like(mean_a), np.zeros_like(m2_a)
+    delta = mean_b - mean_a
+    return n, mean_a + delta * (n_b / n), m2_a + m2_b + delta ** 2 * (n_a * n_b / n)
+
+
+def _remove_moments(n, mean, m2, n_b, mean_b, m2_b):
+    """Moments of a row set after removing a subset with moments (n_b, mean_b, m2_b)"""
+    n_a = n - n_b
+    if n_a <= 0:
+        return 0.0, np.zeros_like(mean), np.zeros_like(m2)
+    mean_a = (n * mean - n_b * mean_b) / n_a
+    delta = mean_b - mean_a
+    return n_a, mean_a, np.maximum(m2 - m2_b - delta ** 2 * (n_a * n_b / n), 0)
+
+
+def _fold_class_stats(class_stats, labels, X, sign):
+    """Add (sign=1) or remove (sign=-1) rows from per-class count/mean/centered sum of squares"""
+    complete = complete_features(X)
+    labels, X = labels[complete], X[complete]
+    for label in np.unique(labels):
+        rows = X[labels == label]
+        mean = rows.mean(axis=0)
+        batch = (float(len(rows)), mean, ((rows - mean) ** 2).sum(axis=0))
+        stats = class_stats.get(label, {'n': 0.0, 'mean': np.zeros(X.shape[1]), 'm2': np.zeros(X.shape[1])})
+        fold = _merge_moments if sign > 0 else _remove_moments
+        n, mean, m2 = fold(stats['n'], stats['mean'], stats['m2'], *batch)
+        class_stats[label] = {'n': n, 'mean': mean, 'm2': m2}
+
+
+def build_estimators(class_stats):
+    """Rebuild a fitted StandardScaler and GaussianNB from per-class moments
+
+    Equivalent to fitting the scaler on the training rows and GaussianNB on the
+    scaled rows: standardization is affine per feature, so class means and
+    variances are shifted and rescaled instead of recomputed from data. Only
+    the estimators' documented fitted attributes are set.
+    """
+    classes = sorted(label for label, stats in class_stats.items() if stats['n'] > 0)
+    counts = np.array([class_stats[label]['n'] for label in classes])
+    class_mean = np.array([class_stats[label]['mean'] for label in classes])
+    class_m2 = np.array([class_stats[label]['m2'] for label in classes])
+
+    n, mean, m2 = 0.0, np.zeros(class_mean.shape[1]), np.zeros(class_mean.shape[1])
+    for moments in zip(counts, class_mean, class_m2):
+        n, mean, m2 = _merge_moments(n, mean, m2, *moments)
+    var = m2 / n
+    scale = np.where(var > 0, np.sqrt(var), 1.0)
+
+    scaler = StandardScaler()
+    scaler.mean_, scaler.var_, scaler.scale_ = mean, var, scale
+    scaler.n_samples_seen_ = int(n)
+    scaler.n_features_in_ = len(mean)
+
+    class_var = class_m2 / counts[:, None]
+
+    nb = GaussianNB()
+    nb.epsilon_ = nb.var_smoothing * (var / scale ** 2).max()
+    nb.classes_ = np.array(classes)
+    nb.class_count_ = counts
+    nb.class_prior_ = counts / n
+    nb.theta_ = (class_mean - mean) / scale
+    nb.var_ = class_var / scale ** 2 + nb.epsilon_
+    nb.n_features_in_ = len(mean)
+
+    return nb, scaler
+
+
+def initialize_incremental_state(trips, watermark):
+    """Full refit: thresholds, holdout flags and class statistics from all trips"""
+    route_stats = accumulate_route_stats(trips)
+    features = route_features(route_stats)
+    scores = performance_score(features)
+    thresholds = (float(scores.quantile(0.33)), float(scores.quantile(0.67)))
+
+    route_stats['label'] = label_performance(scores, *thresholds)
+    route_stats['holdout'] = [is_holdout_route(route) for route in route_stats.index]
+
+    train = ~route_stats['holdout']
+    class_stats = {}
+    _fold_class_stats(class_stats, route_stats.loc[train, 'label'].values, features[train].values, 1)
+
+    return {
+        'version': INCREMENTAL_STATE_VERSION,
+        'trips': trip_contributions(trips),
+        'route_stats': route_stats,
+        'thresholds': thresholds,
+        'class_stats': class_stats,
+        'watermark': watermark,
+        'refit_at': datetime.utcnow(),
+        'updates_since_refit': 0
+    }
+
+
+def fold_changed_trips(state, trips, watermark):
+    """Replace the changed trips' contributions; cost depends on the trips and routes touched"""
+    route_stats = state['route_stats']
+    current = trip_contributions(trips)
+    current = current[~current.index.duplicated(keep='last')]
+    previous = state['trips'].loc[state['trips'].index.intersection(current.index)]
+    touched = pd.Index(current['route_id']).union(pd.Index(previous['route_id'])).unique()
+    known = route_stats.index.intersection(touched)
+
+    # Remove the touched routes' old rows from their classes
+    old = route_stats.loc[known]
+    old_train = ~old['holdout'].astype(bool)
+    _fold_class_stats(state['class_stats'], old.loc[old_train, 'label'].values,
+                      route_features(old[old_train]).values, -1)
+
+    # Swap each changed trip's earlier contribution for its current one
+    updated = old.drop(columns=['label', 'holdout'])
+    if not previous.empty:
+        updated = updated.sub(accumulate_route_stats(previous), fill_value=0)
+    updated = accumulate_route_stats(current, updated)
+    updated = updated[updated['trips'] > 0]
+    features = route_features(updated)
+    updated['label'] = label_performance(performance_score(features), *state['thresholds'])
+    updated['holdout'] = [is_holdout_route(route) for route in updated.index]
+
+    # Add them back with their new features and labels
+    train = ~updated['holdout']
+    _fold_class_stats(state['class_stats'], updated.loc[train, 'label'].values, features[train].values, 1)
+
+    state['route_stats'] = pd.concat([route_stats.drop(index=known), updated])
+    state['trips'] = pd.concat([state['trips'].drop(index=previous.index), current])
+    state['watermark'] = watermark
+    state['updates_since_refit'] += 1
+    return len(touched)
+
+
+@track_memory
+def run_naive_bayes_incremental(full_refit=False):
+    """Fold trips changed since the last update into the persisted model state"""
+    print("🚀 Starting incremental Naive Bayes route performance update...")
+
+    state = None
+    if not full_refit:
+        try:
+            state = load_model_artifact(INCREMENTAL_STATE)
+        except FileNotFoundError:
+            print("⚠️  No incremental state found, running a full refit")
+        if state is not None and state.get('version') != INCREMENTAL_STATE_VERSION:
+            print("⚠️  Incremental state is from an older format, running a full refit")
+            state = None
+    mode = 'incremental' if state is not None else 'full_refit'
+
+    mark_stage('fetch')
+    print("📊 Fetching trip data...")
+    # Changes made while this update runs are picked up again by the next one (folding is idempotent)
+    watermark = datetime.utcnow()
+    fetch_start = time.perf_counter()
+    df = fetch_route_performance_data(changed_since=state['watermark'] if state else None)
+    fetch_seconds = time.perf_counter() - fetch_start
+
+    if df.empty:
+        if state is None:
+            print("❌ No trip data found!")
+            return None
+        print("✅ No changed trips since the last update")
+        return {
+            'training_mode': mode,
+            'incremental': {'changed_trips': 0, 'routes_touched': 0, 'watermark': state['watermark']}
+        }
+
+    print(f"✅ Loaded {len(df)} {'changed ' if state else ''}trip records")
+
+    mark_stage('train')
+    update_start = time.perf_counter()
+    trips = calculate_trip_features(df)
+    if state is None:
+        state = initialize_incremental_state(trips, watermark)
+        routes_touched = len(state['route_stats'])
+    else:
+        routes_touched = fold_changed_trips(state, trips, watermark)
+    nb, scaler = build_estimators(state['class_stats'])
+    update_seconds = time.perf_counter() - update_start
+
+    # Evaluate on all routes with the current labels
+    mark_stage('evaluate')
+    route_stats = state['route_stats']
+    features = route_features(route_stats)
+    complete = complete_features(features.values)
+    route_stats, features = route_stats[complete], features[complete]
+    y_pred = nb.predict(scaler.transform(features.values))
+    y_true = route_stats['label'].values
+    holdout = route_stats['holdout'].astype(bool).values
+
+    train_metrics = calculate_classification_metrics(y_true[~holdout], y_pred[~holdout])
+    test_metrics = calculate_classification_metrics(y_true[holdout], y_pred[holdout]) if holdout.any() else {}
+
+    print("📊 Training Metrics:", train_metrics)
+    print("📊 Testing Metrics:", test_metrics)
+    if holdout.any():
+        test_metrics['confidence_intervals'] = classification_intervals(y_true[holdout], y_pred[holdout],
+                                                                        average='weighted')
+    importance = permutation_importance(lambda X: nb.predict(scaler.transform(X)), features.values[holdout],
+                                        y_true[holdout], FEATURE_COLS, 'Accuracy')
+
+    class_labels = sorted(np.unique(y_true))
+    report_data = {
+        'model_type': 'Gaussian Naive Bayes',
+        'description': 'Route performance classification (High/Medium/Low)',
+        'training_mode': mode,
+        'train_metrics': train_metrics,
+        'test_metrics': test_metrics,
+        'incremental': {
+            'changed_trips': int(len(df)),
+            'routes_touched': int(routes_touched),
+            'routes_total': int(len(route_stats)),
+            'fetch_seconds': round(fetch_seconds, 4),
+            'update_seconds': round(update_seconds, 4),
+            'updates_since_refit': state['updates_since_refit'],
+            'refit_at': state['refit_at'],
+            'thresholds': {'low': state['thresholds'][0], 'high': state['thresholds'][1]},
+            'watermark': state['watermark']
+        },
+        'visualization': create_confusion_matrix_heatmap(y_true[holdout], y_pred[holdout], class_labels) if holdout.any() else None,
+        'class_distribution': route_stats['label'].value_counts().to_dict(),
+        'feature_importance': {
+            'features': FEATURE_COLS,
+            'weights': [0.4, 0.2, 0.2, 0.4]
+        },
+        'permutation_importance': importance
+    }
+
+    mark_stage('artifact')
+    save_model_artifact(INCREMENTAL_STATE, state)
+    save_model_artifact('nb_route_performance', {
+        'model': nb,
+        'scaler': scaler,
+        'feature_cols': FEATURE_COLS
+    })
+    report_data['memory'] = memory_summary()
+
+    print("💾 Saving report to MongoDB...")
+    report_id = save_model_report('nb_route_performance', report_data)
+    print(f"✅ Report saved with ID: {report_id}")
+
+    return report_data
+
 if __name__ == '__main__':
-    result = run_naive_bayes_classification()
+    if '--incremental' in sys.argv or '--full-refit' in sys.argv:
+        result = run_naive_bayes_incremental(full_refit='--full-refit' in sys.argv)
+    else:
+        result = run_naive_bayes_classification()
     if result:
         print("\n✅ Naive Bayes Route Performance Classification completed successfully!")
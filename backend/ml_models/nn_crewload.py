@@ -9,6 +9,8 @@ Input Features:
 - rest_hours
 - consecutive_days_worked
 - avg_trip_duration
+- hours_7d, trips_7d, night_shifts_14d (trailing workload windows)
+- rest_gap_hours (since the end of the previous duty)
 
 Output: Crew fitness score (0-1, continuous)
 
@@ -18,13 +20,14 @@ Visualization: Training loss vs epoch curve
 
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime, timedelta
 import base64
+import os
+import time
 from io import BytesIO
 
 try:
@@ -37,16 +40,51 @@ except ImportError:
     print("Warning: TensorFlow not available. Using fallback model.")
 
 from config import *
-from utils import get_mongo_client, save_model_report
+from utils import get_mongo_client, save_model_report, save_model_artifact, load_model_artifact, artifact_path
+from snapshot import load_training_data
+from splits import get_split
+from bootstrap import regression_intervals
+from importance import permutation_importance
+from memory_stages import track_memory, mark_stage, memory_summary
+from sampling import normalize_sampling, default_sampling, build_sampling_stages, describe_sampling
+from crew_windows import compute_crew_windows, CrewWindowState, MAX_WINDOW_DAYS
 
 
-def fetch_crew_load_data():
-    """Fetch crew duty and trip data"""
-    client = get_mongo_client()
-    db = client[DB_NAME]
-    
-    # Aggregate duties with crew and trip info
-    pipeline = [
+CREW_WINDOW_STATE = 'crew_window_state'
+CREW_WINDOW_STATE_VERSION = 1
+
+
+def duty_trips_lookup():
+    """$lookup of a duty's trips as `trip_list`, each reduced to its route's distance
+
+    A trip stores only the route's id, so the distance comes from a nested
+    lookup on routes.
+    """
+    return {
+        '$lookup': {
+            'from': 'trips',
+            'localField': 'trips',
+            'foreignField': '_id',
+            'pipeline': [
+                {
+                    '$lookup': {
+                        'from': 'routes',
+                        'localField': 'route',
+                        'foreignField': '_id',
+                        'pipeline': [{'$project': {'distance': 1}}],
+                        'as': 'route_info'
+                    }
+                },
+                {'$project': {'distance': {'$first': '$route_info.distance'}}}
+            ],
+            'as': 'trip_list'
+        }
+    }
+
+
+def build_crew_load_pipeline():
+    """Aggregation stages joining duties with crew and trip info"""
+    return [
         {
             '$lookup': {
                 'from': 'drivers',
@@ -63,44 +101,115 @@ def fetch_crew_load_data():
                 'as': 'conductor_info'
             }
         },
-        {
-            '$lookup': {
-                'from': 'trips',
-                'localField': 'trips',
-                'foreignField': '_id',
-                'as': 'trip_list'
-            }
-        },
+        duty_trips_lookup(),
         {
             '$project': {
                 'crew_id': {'$ifNull': [{'$first': '$driver_info._id'}, {'$first': '$conductor_info._id'}]},
                 'crew_type': {'$cond': [{'$gt': [{'$size': '$driver_info'}, 0]}, 'driver', 'conductor']},
                 'date': '$date',
+                'start_time': '$scheduledStartTime',
                 'shift_hours': '$hours',
                 'trips_count': {'$size': '$trip_list'},
                 'rest_hours': {'$ifNull': ['$restHours', 8]},
-                'route_length': {'$avg': '$trip_list.route.distance'}
+                'depot_id': '$depot',
+                'route_length': {'$avg': '$trip_list.distance'}
             }
         }
     ]
+
+
+def fetch_crew_load_data(sampling=None):
+    """Fetch crew duty and trip data"""
+    client = get_mongo_client()
+    db = client[DB_NAME]
     
-    duties = list(db['duties'].aggregate(pipeline))
+    # Aggregate duties with crew and trip info
+    pipeline = build_crew_load_pipeline()
+    
+    pipeline[0:0] = build_sampling_stages(db[DUTIES_COLLECTION], sampling)
+
+    duties = list(db[DUTIES_COLLECTION].aggregate(pipeline, allowDiskUse=bool(sampling)))
     client.close()
     
     return pd.DataFrame(duties)
 
 
-def calculate_crew_features(df):
-    """Calculate crew workload features"""
-    # Convert date
-    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+def fetch_roster_duties(depot_id=None, crew_ids=None, changed_since=None, since=None):
+    """Fetch duty history for a depot, a crew list or everyone, one row per (duty, crew member)
+
+    Drivers and conductors each get their own rows, so a conductor who only
+    works alongside a driver still has a duty history. With changed_since,
+    only duties created or updated after it; with since, only duties dated
+    on or after it.
+    """
+    client = get_mongo_client()
+    db = client[DB_NAME]
     
-    # Sort by crew and date
-    df = df.sort_values(['crew_id', 'date'])
+    if crew_ids is not None:
+        match = {'$or': [{'driver': {'$in': crew_ids}}, {'conductor': {'$in': crew_ids}}]}
+    elif depot_id is not None:
+        match = {'depot': depot_id}
+    else:
+        match = {}
+    if changed_since is not None:
+        match['updatedAt'] = {'$gt': changed_since}
+    if since is not None:
+        match['date'] = {'$gte': since}
     
-    # Calculate consecutive days worked
+    pipeline = [
+        {'$match': match},
+        duty_trips_lookup(),
+        {
+            '$project': {
+                'crew': [
+                    {'id': '$driver', 'type': 'driver'},
+                    {'id': '$conductor', 'type': 'conductor'}
+                ],
+                'date': '$date',
+                'start_time': '$scheduledStartTime',
+                'shift_hours': '$hours',
+                'trips_count': {'$size': '$trip_list'},
+                'rest_hours': {'$ifNull': ['$restHours', 8]},
+                'depot_id': '$depot',
+                'route_length': {'$avg': '$trip_list.distance'}
+            }
+        },
+        {'$unwind': '$crew'},
+        {'$match': {'crew.id': {'$ne': None}}},
+        {
+            '$project': {
+                '_id': 0,
+                'duty_id': '$_id',
+                'crew_id': '$crew.id',
+                'crew_type': '$crew.type',
+                'date': 1,
+                'start_time': 1,
+                'shift_hours': 1,
+                'trips_count': 1,
+                'rest_hours': 1,
+                'depot_id': 1,
+                'route_length': 1
+            }
+        }
+    ]
+    
+    duties = list(db[DUTIES_COLLECTION].aggregate(pipeline, allowDiskUse=not match))
+    client.close()
+    
+    df = pd.DataFrame(duties)
+    if crew_ids is not None and not df.empty:
+        # A duty matched for one crew member also yields its partner; keep only requested crew
+        df = df[df['crew_id'].isin(crew_ids)]
+    return df
+
+
+def calculate_crew_features(df, windows_computed=False):
+    """Calculate crew workload features (on rows that already have their windows if windows_computed)"""
+    # Consecutive-day streaks, rolling workload and rest gaps for every crew at once
+    # (sorts by crew and start time; duty_number is the running duty count)
+    if not windows_computed:
+        df = compute_crew_windows(df)
     df['days_since_last'] = df.groupby('crew_id')['date'].diff().dt.days
-    df['consecutive_days'] = df.groupby('crew_id').cumcount() + 1
     
     # Calculate average trip duration (estimate based on route length)
     df['avg_trip_duration'] = df['route_length'] / 40  # Assume 40 km/hr avg speed
@@ -110,6 +219,8 @@ def calculate_crew_features(df):
     
     # Fill missing values
     df['rest_hours'] = df['rest_hours'].fillna(8)
+    # A crew member's first duty has no previous duty; use its declared rest
+    df['rest_gap_hours'] = df['rest_gap_hours'].fillna(df['rest_hours'])
     df['route_length'] = df['route_length'].fillna(df['route_length'].median())
     df['avg_trip_duration'] = df['avg_trip_duration'].fillna(df['avg_trip_duration'].median())
     
@@ -131,6 +242,151 @@ def calculate_crew_features(df):
     return df
 
 
+def latest_crew_features(crew_df):
+    """Most recent workload feature row per crew member"""
+    return crew_df.sort_values('date').groupby('crew_id', as_index=False).tail(1).reset_index(drop=True)
+
+
+def update_crew_window_state():
+    """Bring the persisted CrewWindowState up to date; returns (state, summary)
+
+    Folds in duties created or updated since the last update. Crews with a
+    late or changed duty are rebuilt from their full history, and the whole
+    state is rebuilt when there is none yet (or it is from an older format).
+    Deleted duties leave no `updatedAt` trail; delete the crew_window_state
+    artifact after bulk deletes.
+    """
+    try:
+        stored = load_model_artifact(CREW_WINDOW_STATE)
+    except FileNotFoundError:
+        stored = None
+    if stored is not None and stored.get('version') != CREW_WINDOW_STATE_VERSION:
+        stored = None
+
+    # Duties changed while this runs are folded again by the next update and rebuild their crews
+    watermark = datetime.utcnow()
+    if stored is None:
+        history = fetch_roster_duties()
+        windows = CrewWindowState.from_history(history)
+        summary = {'mode': 'rebuild', 'duties': len(history), 'crews_rebuilt': len(windows.latest)}
+    else:
+        windows = stored['windows']
+        changed = fetch_roster_duties(changed_since=stored['watermark'])
+        _, stale = windows.fold(changed)
+        if stale:
+            windows.rebuild(fetch_roster_duties(crew_ids=list(stale)))
+        summary = {'mode': 'incremental', 'duties': len(changed), 'crews_rebuilt': len(stale)}
+
+    save_model_artifact(CREW_WINDOW_STATE, {
+        'version': CREW_WINDOW_STATE_VERSION,
+        'watermark': watermark,
+        'windows': windows
+    })
+    summary['tail_duties'] = len(windows.tail)
+    return windows, summary
+
+
+_predictor_cache = {}
+
+
+def get_crew_fitness_predictor():
+    """Cached crew fitness predictor, reloaded when the artifact changes"""
+    mtime = os.path.getmtime(artifact_path('nn_crew_load_balancing'))
+    if _predictor_cache.get('mtime') != mtime:
+        _predictor_cache['predictor'] = load_crew_fitness_predictor()
+        _predictor_cache['mtime'] = mtime
+    return _predictor_cache['predictor']
+
+
+def roster_history_start(now=None):
+    """First duty date the roster reads: the longest workload window plus CREW_STREAK_CAP_DAYS before today"""
+    today = pd.Timestamp(now or datetime.utcnow()).normalize().to_pydatetime()
+    return today - timedelta(days=MAX_WINDOW_DAYS + CREW_STREAK_CAP_DAYS)
+
+
+def score_crew_roster(depot_id=None, crew_ids=None):
+    """Score every crew member of a depot (or crew list) in one vectorized pass
+
+    Reads only duties from roster_history_start() on, not the full history.
+    Every window of a duty in the last CREW_STREAK_CAP_DAYS days is complete.
+    consecutive_days is capped at the days read, and a crew member with no
+    duty in that range is not listed. The crew_fitness batch job keeps exact
+    values through the window state (update_crew_window_state).
+    """
+    if depot_id is None and crew_ids is None:
+        raise ValueError("Provide a depot_id or a list of crew_ids")
+    
+    start = time.perf_counter()
+    predict, artifact = get_crew_fitness_predictor()
+    
+    df = fetch_roster_duties(depot_id=depot_id, crew_ids=crew_ids, since=roster_history_start())
+    fetched = time.perf_counter()
+    
+    if df.empty:
+        return {'crew': [], 'count': 0, 'timings_ms': {'total': round((fetched - start) * 1000, 1)}}
+    
+    # Fill from training medians so small rosters with sparse data are not dropped
+    df['route_length'] = df['route_length'].fillna(artifact.get('feature_medians', {}).get('route_length', 0))
+    crew = latest_crew_features(calculate_crew_features(df))
+    
+    fitness = np.clip(predict(crew[artifact['feature_cols']].values), 0, 1)
+    order = np.argsort(-fitness)
+    scored = time.perf_counter()
+    
+    ranked_df = crew.iloc[order]
+    features = ranked_df[artifact['feature_cols']].astype(float).to_dict('records')
+    ranked = [
+        {
+            'rank': rank + 1,
+            'crew_id': str(crew_id),
+            'crew_type': crew_type,
+            'fitness_score': float(score),
+            'fatigue_score': float((1 - score) * 100),
+            'last_duty_date': date.isoformat() if pd.notna(date) else None,
+            'features': feature_row
+        }
+        for rank, (crew_id, crew_type, date, score, feature_row) in enumerate(zip(
+            ranked_df['crew_id'], ranked_df['crew_type'], ranked_df['date'], fitness[order], features
+        ))
+    ]
+    
+    total_ms = (time.perf_counter() - start) * 1000
+    return {
+        'crew': ranked,
+        'count': len(ranked),
+        'model_trained_at': artifact['trained_at'],
+        'timings_ms': {
+            'aggregation': round((fetched - start) * 1000, 1),
+            'scoring': round((scored - fetched) * 1000, 1),
+            'total': round(total_ms, 1)
+        },
+        'latency_target_ms': CREW_FITNESS_LATENCY_MS,
+        'within_target': total_ms <= CREW_FITNESS_LATENCY_MS
+    }
+
+
+def load_crew_fitness_predictor():
+    """Load the saved crew fitness model as a vectorized predict function"""
+    artifact = load_model_artifact('nn_crew_load_balancing')
+    
+    if artifact['framework'] == 'keras':
+        if not TF_AVAILABLE:
+            raise RuntimeError("Saved crew model needs TensorFlow, which is not installed")
+        model = keras.models.load_model(artifact['keras_path'])
+        scaler = artifact['scaler']
+        
+        # Direct call: one forward pass without model.predict's per-call setup
+        def predict(X):
+            return model(scaler.transform(X), training=False).numpy().flatten()
+    else:
+        model = artifact['model']
+        
+        def predict(X):
+            return model.predict(X)
+    
+    return predict, artifact
+
+
 def build_neural_network(input_dim):
     """Build neural network model"""
     if not TF_AVAILABLE:
@@ -247,13 +503,19 @@ def create_loss_curve_plot(history):
     return f"data:image/png;base64,{image_base64}"
 
 
-def run_neural_network_crew_load():
+@track_memory
+def run_neural_network_crew_load(sampling=None):
     """Main function to run Neural Network crew load balancing"""
     print("🚀 Starting Neural Network Crew Load Balancing...")
     
+    sampling = normalize_sampling(sampling or default_sampling(), by='driver', time_field='date')
+
     # Fetch data
+    mark_stage('fetch')
     print("📊 Fetching crew duty data...")
-    df = fetch_crew_load_data()
+    fetch_start = time.perf_counter()
+    df = load_training_data('nn_crew_load_balancing', fetch_crew_load_data, sampling)
+    fetch_seconds = time.perf_counter() - fetch_start
     
     if df.empty:
         print("❌ No crew duty data found!")
@@ -262,6 +524,7 @@ def run_neural_network_crew_load():
     print(f"✅ Loaded {len(df)} duty records")
     
     # Calculate features
+    mark_stage('features')
     print("🔄 Calculating crew workload features...")
     crew_df = calculate_crew_features(df)
     
@@ -269,31 +532,43 @@ def run_neural_network_crew_load():
     print(crew_df['fitness_score'].describe())
     
     # Prepare features
-    feature_cols = ['route_length', 'trips_per_day', 'rest_hours', 'consecutive_days', 'avg_trip_duration']
+    feature_cols = ['route_length', 'trips_per_day', 'rest_hours', 'consecutive_days', 'avg_trip_duration',
+                    'hours_7d', 'trips_7d', 'night_shifts_14d', 'rest_gap_hours']
     target_col = 'fitness_score'
     
     X = crew_df[feature_cols].values
     y = crew_df[target_col].values
     
-    # Train-test split
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE
-    )
+    # Train-test split by crew member, so no crew has duties on both sides
+    split = get_split('nn_crew_load_balancing', crew_df['crew_id'])
+    X_train, X_test, y_train, y_test = X[split.train], X[split.test], y[split.train], y[split.test]
     
     print(f"📈 Training set: {len(X_train)}, Test set: {len(X_test)}")
     
     # Train model
+    mark_stage('train')
     print("🤖 Training Neural Network model...")
+    train_start = time.perf_counter()
     model, scaler, y_pred_train, y_pred_test, history = train_neural_network(X_train, y_train, X_test, y_test)
+    train_seconds = time.perf_counter() - train_start
     
     # Calculate metrics
+    mark_stage('evaluate')
     train_metrics = calculate_regression_metrics(y_train, y_pred_train)
     test_metrics = calculate_regression_metrics(y_test, y_pred_test)
     
     print("📊 Training Metrics:", train_metrics)
     print("📊 Testing Metrics:", test_metrics)
+    test_metrics['confidence_intervals'] = regression_intervals(y_test, y_pred_test)
+    if scaler is None:
+        predict = model.predict
+    else:
+        # Direct calls are thread-safe and skip predict()'s per-call dataset setup
+        predict = lambda X: model(scaler.transform(X), training=False).numpy()
+    importance = permutation_importance(predict, X_test, y_test, feature_cols, 'R2_Score')
     
     # Create visualization
+    mark_stage('visualization')
     print("📈 Creating loss curve...")
     viz_image = create_loss_curve_plot(history)
     
@@ -303,15 +578,43 @@ def run_neural_network_crew_load():
         'description': 'Crew fitness score prediction for load balancing',
         'train_metrics': train_metrics,
         'test_metrics': test_metrics,
+        'split': split.summary(),
+        'sampling': describe_sampling(sampling, DUTIES_COLLECTION, len(df), fetch_seconds, train_seconds),
         'visualization': viz_image,
         'architecture': {
             'layers': [64, 32, 16, 1] if TF_AVAILABLE else 'Ridge Regression',
             'activation': 'relu, sigmoid',
             'dropout': 0.2
         } if TF_AVAILABLE else {'type': 'Ridge', 'alpha': 1.0},
-        'features': feature_cols
+        'features': feature_cols,
+        'permutation_importance': importance
     }
     
+    # Save trained model for batch scoring (Keras models are saved natively)
+    mark_stage('artifact')
+    if TF_AVAILABLE:
+        keras_path = artifact_path('nn_crew_load_balancing', 'keras')
+        os.makedirs(os.path.dirname(keras_path), exist_ok=True)
+        model.save(keras_path)
+        save_model_artifact('nn_crew_load_balancing', {
+            'model': None,
+            'keras_path': keras_path,
+            'framework': 'keras',
+            'scaler': scaler,
+            'feature_cols': feature_cols,
+            'feature_medians': crew_df[feature_cols].median().to_dict()
+        })
+    else:
+        save_model_artifact('nn_crew_load_balancing', {
+            'model': model,
+            'framework': 'sklearn',
+            'scaler': None,
+            'feature_cols': feature_cols,
+            'feature_medians': crew_df[feature_cols].median().to_dict()
+        })
+    
+    report_data['memory'] = memory_summary()
+    
     # Save to MongoDB
     print("💾 Saving report to MongoDB...")
     report_id = save_model_report('nn_crew_load_balancing', report_data)
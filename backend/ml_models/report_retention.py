@@ -0,0 +1,198 @@
+"""
+ml_reports Retention
+====================
+Every run stores a full report (metrics, base64 plots, importances, memory
+stages). Without a limit `ml_reports` grows forever, and so do the index and
+cache footprint behind every latest-report lookup.
+
+The newest REPORT_KEEP_FULL reports of each model stay complete. Older ones
+are handled by REPORT_RETENTION:
+
+- 'compact': the report is reduced to a metrics-only summary (SUMMARY_FIELDS)
+  and flagged `compacted`. Metric history keeps working, since it only reads
+  train_metrics/test_metrics
+- 'expire': the report gets `expires_at` (its timestamp + REPORT_TTL_DAYS) and
+  a TTL index on that field deletes it
+- 'off': nothing is done
+
+The policy is applied to the affected models after every report write. Use
+`compact` to apply it on demand to all models and report the BSON bytes
+reclaimed. MongoDB reuses the freed space for new documents; `--storage`
+also runs the `compact` command to return it to the filesystem. That command
+blocks the collection while it runs.
+
+Usage:
+    python report_retention.py status
+    python report_retention.py compact [--model NAME] [--keep N] [--dry-run] [--storage]
+"""
+
+import argparse
+from datetime import datetime
+
+import pymongo
+
+from config import *
+from utils import get_mongo_client
+
+
+# Report fields kept in a compacted summary
+SUMMARY_FIELDS = ('model_type', 'training_mode', 'train_metrics', 'test_metrics')
+
+
+def _summary_stage():
+    """Update/aggregation stage that reduces a report to its metrics-only summary"""
+    # $mergeObjects replaces `metrics` as a whole; $set would merge into the embedded document
+    return {'$replaceWith': {'$mergeObjects': ['$$ROOT', {
+        'metrics': {field: f'$metrics.{field}' for field in SUMMARY_FIELDS},
+        'compacted': True,
+        'compacted_at': datetime.utcnow()
+    }]}}
+
+
+def _bson_bytes(collection, query, stages=()):
+    """Total BSON size of the matching documents, optionally after extra stages"""
+    result = list(collection.aggregate([
+        {'$match': query},
+        *stages,
+        {'$group': {'_id': None, 'bytes': {'$sum': {'$bsonSize': '$$ROOT'}}}}
+    ]))
+    return result[0]['bytes'] if result else 0
+
+
+def _retention_cutoff(collection, model_name, keep):
+    """Timestamp of the model's keep-th newest report; older reports are beyond retention"""
+    newest = list(collection.find({'model_name': model_name}, {'timestamp': 1})
+                  .sort('timestamp', pymongo.DESCENDING).skip(keep - 1).limit(1))
+    return newest[0]['timestamp'] if newest else None
+
+
+def compact_reports(collection, model_name, keep=REPORT_KEEP_FULL, dry_run=False):
+    """Reduce the model's reports beyond the newest `keep` to metrics-only summaries"""
+    cutoff = _retention_cutoff(collection, model_name, keep)
+    if cutoff is None:
+        return {'model_name': model_name, 'compacted': 0, 'bytes_before': 0, 'bytes_after': 0, 'bytes_reclaimed': 0}
+
+    query = {'model_name': model_name, 'timestamp': {'$lt': cutoff}, 'compacted': {'$ne': True}}
+    ids = [doc['_id'] for doc in collection.find(query, {'_id': 1})]
+    by_id = {'_id': {'$in': ids}}
+    bytes_before = _bson_bytes(collection, by_id) if ids else 0
+
+    if not ids:
+        bytes_after = 0
+    elif dry_run:
+        bytes_after = _bson_bytes(collection, by_id, [_summary_stage()])
+    else:
+        collection.update_many(by_id, [_summary_stage()])
+        bytes_after = _bson_bytes(collection, by_id)
+
+    return {
+        'model_name': model_name,
+        'compacted': len(ids),
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'bytes_reclaimed': bytes_before - bytes_after
+    }
+
+
+def expire_reports(collection, model_name, keep=REPORT_KEEP_FULL, ttl_days=REPORT_TTL_DAYS):
+    """Schedule the model's reports beyond the newest `keep` for TTL deletion"""
+    collection.create_index([('expires_at', pymongo.ASCENDING)], expireAfterSeconds=0)
+    cutoff = _retention_cutoff(collection, model_name, keep)
+    if cutoff is None:
+        return {'model_name': model_name, 'expiring': 0}
+
+    result = collection.update_many(
+        {'model_name': model_name, 'timestamp': {'$lt': cutoff}, 'expires_at': {'$exists': False}},
+        [{'$set': {'expires_at': {'$add': ['$timestamp', ttl_days * 86400 * 1000]}}}]
+    )
+    return {'model_name': model_name, 'expiring': result.modified_count}
+
+
+def apply_retention(collection, model_names, mode=REPORT_RETENTION, keep=REPORT_KEEP_FULL):
+    """Apply the configured retention policy to the given models' reports"""
+    if mode == 'off':
+        return []
+    if mode not in ('compact', 'expire'):
+        raise ValueError("ML_REPORT_RETENTION must be 'compact', 'expire' or 'off'")
+
+    apply = compact_reports if mode == 'compact' else expire_reports
+    return [apply(collection, model_name, keep) for model_name in model_names]
+
+
+def retention_status(collection):
+    """Full and compacted report counts and BSON bytes per model"""
+    return list(collection.aggregate([
+        {'$group': {
+            '_id': '$model_name',
+            'full': {'$sum': {'$cond': [{'$eq': ['$compacted', True]}, 0, 1]}},
+            'compacted': {'$sum': {'$cond': [{'$eq': ['$compacted', True]}, 1, 0]}},
+            'expiring': {'$sum': {'$cond': [{'$ifNull': ['$expires_at', False]}, 1, 0]}},
+            'bytes': {'$sum': {'$bsonSize': '$$ROOT'}},
+            'latest': {'$max': '$timestamp'}
+        }},
+        {'$sort': {'_id': 1}}
+    ]))
+
+
+def run_compaction(model_name=None, keep=REPORT_KEEP_FULL, dry_run=False, storage=False):
+    """Compact every model's (or one model's) reports beyond retention; returns per-model bytes reclaimed"""
+    client = get_mongo_client()
+    db = client[DB_NAME]
+    collection = db[ML_REPORTS_COLLECTION]
+    model_names = [model_name] if model_name else sorted(collection.distinct('model_name'))
+    results = [compact_reports(collection, name, keep, dry_run) for name in model_names]
+
+    storage_result = None
+    if storage and not dry_run:
+        size_before = db.command('collStats', ML_REPORTS_COLLECTION)['storageSize']
+        db.command('compact', ML_REPORTS_COLLECTION)
+        size_after = db.command('collStats', ML_REPORTS_COLLECTION)['storageSize']
+        storage_result = {'storage_before': size_before, 'storage_after': size_after,
+                          'storage_reclaimed': size_before - size_after}
+    client.close()
+
+    return {
+        'keep': keep,
+        'dry_run': dry_run,
+        'models': results,
+        'compacted': sum(result['compacted'] for result in results),
+        'bytes_reclaimed': sum(result['bytes_reclaimed'] for result in results),
+        'storage': storage_result
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Retention and compaction of ml_reports')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help='Full/compacted reports and bytes per model')
+    compact_parser = subparsers.add_parser('compact', help='Compact reports beyond the newest N per model')
+    compact_parser.add_argument('--model', help='Only this model (default: all)')
+    compact_parser.add_argument('--keep', type=int, default=REPORT_KEEP_FULL, help='Full reports kept per model')
+    compact_parser.add_argument('--dry-run', action='store_true', help='Measure without changing anything')
+    compact_parser.add_argument('--storage', action='store_true',
+                                help="Also run MongoDB's compact command to return freed space to disk")
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        client = get_mongo_client()
+        for row in retention_status(client[DB_NAME][ML_REPORTS_COLLECTION]):
+            print(f"🗂️  {row['_id']}: {row['full']} full, {row['compacted']} compacted, "
+                  f"{row['expiring']} expiring, {row['bytes'] / 2**20:.2f} MB (latest {row['latest']})")
+        client.close()
+        return
+
+    if args.keep < 1:
+        parser.error('--keep must be at least 1')
+    result = run_compaction(args.model, args.keep, args.dry_run, args.storage)
+    for model in result['models']:
+        print(f"🗜️  {model['model_name']}: {model['compacted']} reports, "
+              f"{model['bytes_before'] / 2**20:.2f} MB -> {model['bytes_after'] / 2**20:.2f} MB")
+    action = 'Would reclaim' if args.dry_run else 'Reclaimed'
+    print(f"✅ {action} {result['bytes_reclaimed'] / 2**20:.2f} MB from {result['compacted']} reports "
+          f"(keeping the newest {args.keep} per model)")
+    if result['storage']:
+        print(f"💽 Storage: {result['storage']['storage_reclaimed'] / 2**20:.2f} MB returned to disk")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""
+Sampling Budgets
+================
+Builds aggregation stages that cap how many source documents a pipeline
+trains on, so training cost stays bounded as history accumulates. Sampling
+runs inside MongoDB: unsampled documents never leave the database.
+
+A sampling spec is a plain dict:
+    {
+        'strategy': 'uniform' | 'stratified' | 'time_decay',
+        'budget': 50000,              # max source documents
+        'by': 'route',                # stratified: field to stratify on
+        'min_per_stratum': 20,        # stratified: floor for rare strata
+        'time_field': 'createdAt',    # time_decay: document timestamp
+        'half_life_days': 90          # time_decay: weight halves every N days
+    }
+
+Strategies:
+- uniform:    `$sample` of `budget` documents
+- stratified: proportional allocation per stratum (random order within
+              each stratum via `$setWindowFields`), with a per-stratum floor.
+              When the floors push the total over `budget`, every stratum's
+              quota is scaled down by the same factor, so the budget holds
+- time_decay: weighted sampling without replacement (Efraimidis-Spirakis)
+              with weight exp(-ln2 * age / half_life), top-k by key
+
+Snapshot runs apply the same strategies to the loaded frame (sample_frame),
+reading the stratum or time column under its projected name (FRAME_COLUMNS).
+If the frame has no such column, the frame is sampled uniformly and the
+report says so.
+
+Usage:
+    python sampling.py sweep knn_demand_prediction --budgets 1000 5000 20000
+"""
+
+import argparse
+import importlib
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import *
+from utils import get_mongo_client, save_model_report
+
+
+SAMPLING_STRATEGIES = ('uniform', 'stratified', 'time_decay')
+
+DEFAULT_MIN_PER_STRATUM = 20
+DEFAULT_HALF_LIFE_DAYS = 90
+
+# MongoDB sampling field -> column of the projected frame (snapshot mode)
+FRAME_COLUMNS = {
+    'route': 'route_id',
+    'trip_info.route': 'route_id',
+    'driver': 'crew_id',
+    'scheduledDeparture': 'scheduled_departure',
+    'createdAt': 'booking_time',
+}
+
+
+def normalize_sampling(sampling, by=None, time_field=None):
+    """Validate a sampling spec and fill in pipeline-specific defaults"""
+    if not sampling:
+        return None
+
+    strategy = sampling.get('strategy', 'uniform')
+    if strategy not in SAMPLING_STRATEGIES:
+        raise ValueError(f"Unknown sampling strategy '{strategy}'. Use one of {SAMPLING_STRATEGIES}")
+
+    budget = int(sampling.get('budget', 0))
+    if budget <= 0:
+        raise ValueError("Sampling budget must be a positive integer")
+
+    spec = {'strategy': strategy, 'budget': budget}
+    if strategy == 'stratified':
+        spec['by'] = sampling.get('by') or by
+        spec['min_per_stratum'] = int(sampling.get('min_per_stratum', DEFAULT_MIN_PER_STRATUM))
+        if not spec['by']:
+            raise ValueError("Stratified sampling needs a 'by' field")
+    elif strategy == 'time_decay':
+        spec['time_field'] = sampling.get('time_field') or time_field
+        spec['half_life_days'] = float(sampling.get('half_life_days', DEFAULT_HALF_LIFE_DAYS))
+        if not spec['time_field']:
+            raise ValueError("Time-decayed sampling needs a 'time_field'")
+
+    return spec
+
+
+def default_sampling():
+    """Sampling spec from ML_SAMPLE_BUDGET / ML_SAMPLE_STRATEGY, if configured"""
+    if not SAMPLE_BUDGET:
+        return None
+    return {'strategy': SAMPLE_STRATEGY, 'budget': SAMPLE_BUDGET}
+
+
+def build_sampling_stages(collection, spec):
+    """Return aggregation stages implementing a normalized sampling spec"""
+    if not spec:
+        return []
+
+    budget = spec['budget']
+
+    if spec['strategy'] == 'uniform':
+        return [{'$sample': {'size': budget}}]
+
+    if spec['strategy'] == 'stratified':
+        population = collection.estimated_document_count() or 1
+        fraction = min(1.0, budget / population)
+        return [
+            {'$set': {'_sample_key': {'$rand': {}}}},
+            {
+                '$setWindowFields': {
+                    'partitionBy': f"${spec['by']}",
+                    'sortBy': {'_sample_key': 1},
+                    'output': {
+                        '_stratum_rank': {'$documentNumber': {}},
+                        '_stratum_size': {
+                            '$count': {},
+                            'window': {'documents': ['unbounded', 'unbounded']}
+                        }
+                    }
+                }
+            },
+            {
+                '$set': {
+                    '_stratum_quota': {'$max': [
+                        spec['min_per_stratum'],
+                        {'$ceil': {'$multiply': ['$_stratum_size', fraction]}}
+                    ]}
+                }
+            },
+            {'$match': {'$expr': {'$lte': ['$_stratum_rank', '$_stratum_quota']}}},
+            # Floors can exceed the budget; trim every stratum by the same share of its quota
+            {'$set': {'_quota_used': {'$divide': ['$_stratum_rank', '$_stratum_quota']}}},
+            {'$sort': {'_quota_used': 1, '_sample_key': 1}},
+            {'$limit': budget},
+            {'$unset': ['_sample_key', '_stratum_rank', '_stratum_size', '_stratum_quota', '_quota_used']}
+        ]
+
+    # time_decay: key = ln(-ln(u)) + ln2 * age / half_life, keep the `budget` smallest keys
+    age_days = {
+        '$divide': [
+            {'$subtract': ['$$NOW', {'$ifNull': [f"${spec['time_field']}", {'$toDate': 0}]}]},
+            86400000
+        ]
+    }
+    return [
+        {
+            '$set': {
+                '_sample_key': {
+                    '$add': [
+                        {'$ln': {'$max': [{'$multiply': [-1, {'$ln': {'$subtract': [1, {'$rand': {}}]}}]}, 1e-12]}},
+                        {'$multiply': [math.log(2) / spec['half_life_days'], age_days]}
+                    ]
+                }
+            }
+        },
+        {'$sort': {'_sample_key': 1}},
+        {'$limit': budget},
+        {'$unset': '_sample_key'}
+    ]
+
+
+def _frame_column(df, field):
+    """Frame column holding a MongoDB sampling field, or None"""
+    if field in df:
+        return field
+    column = FRAME_COLUMNS.get(field)
+    return column if column in df else None
+
+
+def _stratified_rows(df, column, budget, min_per_stratum, rng):
+    """Row positions of a stratified sample, with the same quotas as the aggregation"""
+    key = rng.random(len(df))
+    codes = pd.factorize(df[column])[0]
+    order = np.lexsort((key, codes))
+    strata = pd.Series(codes[order])
+    size = strata.map(strata.value_counts()).to_numpy()
+    rank = strata.groupby(strata).cumcount().to_numpy() + 1
+    quota = np.maximum(min_per_stratum, np.ceil(size * min(1.0, budget / len(df))))
+
+    keep = rank <= quota
+    selected = np.lexsort((key[order][keep], (rank / quota)[keep]))[:budget]
+    return np.sort(order[keep][selected])
+
+
+def _time_decay_rows(df, column, budget, half_life_days, rng):
+    """Row positions of an Efraimidis-Spirakis sample weighted by recency"""
+    times = pd.to_datetime(df[column], errors='coerce', utc=True).fillna(pd.Timestamp(0, tz='UTC'))
+    age_days = (pd.Timestamp.now(tz='UTC') - times).dt.total_seconds().to_numpy() / 86400
+    u = rng.random(len(df))
+    key = np.log(np.maximum(-np.log(1 - u), 1e-12)) + math.log(2) / half_life_days * age_days
+    return np.sort(np.argsort(key, kind='stable')[:budget])
+
+
+def sample_frame(df, spec):
+    """Apply a sampling spec to an already-loaded frame (snapshot mode)
+
+    Records the strategy actually applied in spec['applied_strategy'].
+    """
+    if not spec or len(df) <= spec['budget']:
+        return df
+
+    rng = np.random.default_rng(RANDOM_STATE)
+    strategy = spec['strategy']
+    field = spec.get('by') if strategy == 'stratified' else spec.get('time_field')
+    column = _frame_column(df, field) if strategy != 'uniform' else None
+    if strategy != 'uniform' and column is None:
+        print(f"Warning: Snapshot frame has no column for '{field}'; sampling uniformly")
+        strategy = 'uniform'
+
+    if strategy == 'stratified':
+        rows = _stratified_rows(df, column, spec['budget'], spec['min_per_stratum'], rng)
+    elif strategy == 'time_decay':
+        rows = _time_decay_rows(df, column, spec['budget'], spec['half_life_days'], rng)
+    else:
+        rows = np.sort(rng.choice(len(df), spec['budget'], replace=False))
+
+    spec['applied_strategy'] = strategy
+    return df.iloc[rows].reset_index(drop=True)
+
+
+def describe_sampling(spec, collection_name, rows_used, fetch_seconds, train_seconds):
+    """Summarize the sampling applied and the cost it incurred, for the report"""
+    population = None
+    if not SNAPSHOT_VERSION:
+        client = get_mongo_client()
+        population = client[DB_NAME][collection_name].estimated_document_count()
+        client.close()
+
+    summary = {
+        'strategy': spec.get('applied_strategy', spec['strategy']) if spec else 'none',
+        'budget': spec['budget'] if spec else None,
+        'source': 'snapshot' if SNAPSHOT_VERSION else 'mongodb',
+        'collection': collection_name,
+        'population_rows': population,
+        'rows_used': int(rows_used),
+        'sample_fraction': float(rows_used / population) if population else None,
+        'fetch_seconds': round(fetch_seconds, 4),
+        'train_seconds': round(train_seconds, 4)
+    }
+    if spec:
+        summary.update({k: v for k, v in spec.items() if k not in ('strategy', 'budget', 'applied_strategy')})
+        summary['within_budget'] = rows_used <= spec['budget']
+        if summary['strategy'] != spec['strategy']:
+            summary['requested_strategy'] = spec['strategy']
+            summary['note'] = 'Snapshot frame has no column to apply the requested strategy on'
+    return summary
+
+
+# Model name -> (module, run function)
+PIPELINES = {
+    'knn_demand_prediction': ('knn_demand', 'run_knn_demand_prediction'),
+    'nb_route_performance': ('nb_route_performance', 'run_naive_bayes_classification'),
+    'dt_delay_prediction': ('dt_delay', 'run_decision_tree_delay_prediction'),
+    'svm_route_optimization': ('svm_route_opt', 'run_svm_route_optimization'),
+    'nn_crew_load_balancing': ('nn_crewload', 'run_neural_network_crew_load'),
+}
+
+
+def run_sampling_sweep(model_name, budgets, strategy='uniform', **options):
+    """Train a model at several budgets and record accuracy against cost"""
+    module_name, run_name = PIPELINES[model_name]
+    run_fn = getattr(importlib.import_module(module_name), run_name)
+
+    points = []
+    for budget in budgets:
+        print(f"\n🎯 {model_name}: {strategy} sample, budget={budget}")
+        start = time.perf_counter()
+        result = run_fn(sampling={'strategy': strategy, 'budget': budget, **options})
+        elapsed = time.perf_counter() - start
+
+        if not result:
+            print(f"⚠️  No result at budget {budget}")
+            continue
+
+        points.append({
+            'budget': budget,
+            'rows_used': result['sampling']['rows_used'],
+            'total_seconds': round(elapsed, 4),
+            'fetch_seconds': result['sampling']['fetch_seconds'],
+            'train_seconds': result['sampling']['train_seconds'],
+            'test_metrics': result['test_metrics']
+        })
+
+    report_data = {
+        'model_type': 'Sampling Sweep',
+        'description': f'Accuracy vs cost for {model_name} under {strategy} sampling',
+        'model': model_name,
+        'strategy': strategy,
+        'points': points
+    }
+    save_model_report(f'{model_name}_sampling_sweep', report_data)
+
+    print("\n📊 Budget | Rows | Seconds | Test metrics")
+    for point in points:
+        print(f"{point['budget']:>8} | {point['rows_used']:>6} | {point['total_seconds']:>7.2f} | {point['test_metrics']}")
+
+    return report_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure accuracy vs cost across sampling budgets')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sweep_parser = subparsers.add_parser('sweep', help='Train a model at several budgets')
+    sweep_parser.add_argument('model', choices=list(PIPELINES.keys()))
+    sweep_parser.add_argument('--budgets', nargs='+', type=int, required=True)
+    sweep_parser.add_argument('--strategy', choices=SAMPLING_STRATEGIES, default='uniform')
+    sweep_parser.add_argument('--by', help='Stratification field')
+    sweep_parser.add_argument('--half-life-days', type=float)
+
+    args = parser.parse_args()
+
+    options = {}
+    if args.by:
+        options['by'] = args.by
+    if args.half_life_days:
+        options['half_life_days'] = args.half_life_days
+
+    run_sampling_sweep(args.model, args.budgets, args.strategy, **options)
+
+
+if __name__ == '__main__':
+    main()
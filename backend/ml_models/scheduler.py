@@ -0,0 +1,298 @@
+"""
+Change-Aware Retraining Scheduler
+=================================
+Periodically checks a cheap change signal on each model's input collections
+and retrains only the models whose data drifted past a threshold.
+
+Change signal per collection:
+- estimated document count (collection metadata, no scan)
+- max `updatedAt` and the number of documents updated since the last training
+
+Drift for a model is the largest fraction of changed documents across its
+input collections, relative to the counts recorded when it was last trained.
+Counting stops once the threshold is reached, so a reported drift at the
+threshold means "at least". Both reads rely on an `updatedAt` index on every
+input collection (see indexes.py).
+Due models run one at a time with a stagger delay, so retraining never
+competes with itself for cores.
+
+Baselines are stored in the `ml_training_state` collection so decisions
+survive service restarts. The scheduler runs in one gunicorn worker only, so
+it also persists its decisions (per model, `last_decision`) and its own
+schedule (the `_scheduler` document) there; status() reads them back, and
+any worker serves the same /scheduler view.
+"""
+
+import math
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import pymongo
+
+from config import *
+from utils import get_mongo_client
+
+
+# Model name -> collections its training data is built from
+MODEL_INPUTS = {
+    'knn_demand_prediction': [BOOKINGS_COLLECTION, TRIPS_COLLECTION, ROUTES_COLLECTION],
+    'nb_route_performance': [TRIPS_COLLECTION, ROUTES_COLLECTION, BOOKINGS_COLLECTION],
+    'dt_delay_prediction': [TRIPS_COLLECTION, ROUTES_COLLECTION, BOOKINGS_COLLECTION, DUTIES_COLLECTION],
+    'svm_route_optimization': [TRIPS_COLLECTION, ROUTES_COLLECTION, BOOKINGS_COLLECTION],
+    'nn_crew_load_balancing': [DUTIES_COLLECTION, DRIVERS_COLLECTION, CONDUCTORS_COLLECTION, TRIPS_COLLECTION],
+}
+
+# model_name of the ml_training_state document holding the scheduler's own schedule
+SCHEDULER_STATE_ID = '_scheduler'
+
+
+def collect_signals(db, collections):
+    """Read the cheap change signal for each collection"""
+    signals = {}
+    for name in collections:
+        latest = db[name].find_one(
+            {'updatedAt': {'$exists': True}},
+            projection={'updatedAt': 1},
+            sort=[('updatedAt', pymongo.DESCENDING)]
+        )
+        signals[name] = {
+            'count': db[name].estimated_document_count(),
+            'max_updated_at': latest['updatedAt'] if latest else None
+        }
+    return signals
+
+
+def measure_drift(db, baseline, threshold=None):
+    """Fraction of changed documents per collection since the baseline
+
+    With a threshold, updated documents are counted only up to the number
+    that reaches it.
+    """
+    drift = {}
+    for name, base in baseline.items():
+        current_count = db[name].estimated_document_count()
+        changed = abs(current_count - base['count'])
+
+        if base.get('max_updated_at'):
+            options = {}
+            if threshold is not None:
+                options['limit'] = max(math.ceil(threshold * max(base['count'], 1)), 1)
+            updated = db[name].count_documents({'updatedAt': {'$gt': base['max_updated_at']}}, **options)
+            changed = max(changed, updated)
+
+        drift[name] = changed / max(base['count'], 1)
+    return drift
+
+
+class RetrainScheduler:
+    """Background thread that retrains models whose inputs changed"""
+
+    def __init__(self, models, interval=SCHEDULER_INTERVAL, threshold=DRIFT_THRESHOLD,
+                 stagger=SCHEDULER_STAGGER):
+        self.models = models
+        self.interval = interval
+        self.threshold = threshold
+        self.stagger = stagger
+        self.decisions = {}
+        self.last_check = None
+        self.next_check = None
+        self.running_model = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _state_collection(self, client):
+        return client[DB_NAME][TRAINING_STATE_COLLECTION]
+
+    def _persist(self, decisions=None, **schedule):
+        """Write decisions and schedule fields to ml_training_state for status() in every worker"""
+        try:
+            client = get_mongo_client()
+            state = self._state_collection(client)
+            for model_name, decision in (decisions or {}).items():
+                state.update_one({'model_name': model_name}, {'$set': {'last_decision': decision}}, upsert=True)
+            if schedule:
+                schedule['owner'] = f"{socket.gethostname()}:{os.getpid()}"
+                state.update_one({'model_name': SCHEDULER_STATE_ID}, {'$set': schedule}, upsert=True)
+            client.close()
+        except Exception as e:
+            print(f"Warning: Could not persist scheduler state: {e}")
+
+    def record_training(self, model_name, signals=None):
+        """Store the input signals a model was trained on as its new baseline"""
+        client = get_mongo_client()
+        db = client[DB_NAME]
+        signals = signals or collect_signals(db, MODEL_INPUTS[model_name])
+        self._state_collection(client).update_one(
+            {'model_name': model_name},
+            {'$set': {'signals': signals, 'trained_at': datetime.utcnow()}},
+            upsert=True
+        )
+        client.close()
+
+    def evaluate(self, model_name, db, state):
+        """Decide whether a model needs retraining"""
+        if state is None or 'signals' not in state:
+            return {'action': 'retrain', 'reason': 'no baseline', 'drift': None}
+
+        drift = measure_drift(db, state['signals'], self.threshold)
+        max_drift = max(drift.values()) if drift else 0.0
+        action = 'retrain' if max_drift >= self.threshold else 'skip'
+        return {
+            'action': action,
+            'reason': f'max drift {max_drift:.2%} vs threshold {self.threshold:.2%}',
+            'drift': drift,
+            'baseline_trained_at': state.get('trained_at')
+        }
+
+    def check(self, dry_run=False):
+        """Evaluate every model and retrain the ones that drifted"""
+        client = get_mongo_client()
+        db = client[DB_NAME]
+        states = {
+            doc['model_name']: doc
+            for doc in self._state_collection(client).find({'model_name': {'$in': list(self.models)}})
+        }
+
+        decisions = {}
+        for model_name in self.models:
+            decision = self.evaluate(model_name, db, states.get(model_name))
+            decision['checked_at'] = datetime.utcnow()
+            decisions[model_name] = decision
+        client.close()
+
+        with self._lock:
+            self.last_check = datetime.utcnow()
+            if not dry_run:
+                self.decisions.update(decisions)
+
+        if dry_run:
+            return decisions
+        self._persist(decisions, last_check=self.last_check)
+
+        due = [name for name, decision in decisions.items() if decision['action'] == 'retrain']
+        for index, model_name in enumerate(due):
+            if self._stop.is_set():
+                break
+            if index > 0:
+                self._stop.wait(self.stagger)
+            self._retrain(model_name)
+
+        return decisions
+
+    def _retrain(self, model_name):
+        """Run one model and record the outcome in its decision"""
+        client = get_mongo_client()
+        signals = collect_signals(client[DB_NAME], MODEL_INPUTS[model_name])
+        client.close()
+
+        with self._lock:
+            self.running_model = model_name
+        self._persist(running_model=model_name, running_since=datetime.utcnow())
+
+        print(f"🔁 Scheduler retraining {model_name}...")
+        started = time.perf_counter()
+        try:
+            result = self.models[model_name]()
+            outcome = 'success' if result else 'no_results'
+            if result:
+                self.record_training(model_name, signals)
+        except Exception as e:
+            outcome = f'error: {e}'
+            traceback.print_exc()
+
+        with self._lock:
+            self.running_model = None
+            self.decisions[model_name].update({
+                'outcome': outcome,
+                'duration_seconds': round(time.perf_counter() - started, 2),
+                'finished_at': datetime.utcnow()
+            })
+            decision = dict(self.decisions[model_name])
+        self._persist({model_name: decision}, running_model=None, running_since=None)
+        print(f"✅ Scheduler finished {model_name}: {outcome}")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                print(f"❌ Scheduler check failed: {e}")
+                traceback.print_exc()
+
+            with self._lock:
+                self.next_check = datetime.utcnow() + timedelta(seconds=self.interval)
+            self._persist(next_check=self.next_check, interval_seconds=self.interval)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start the background scheduler thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='retrain-scheduler', daemon=True)
+        self._thread.start()
+        print(f"⏰ Retraining scheduler started (every {self.interval}s, threshold {self.threshold:.0%})")
+
+    def stop(self):
+        """Stop the scheduler after the current job"""
+        self._stop.set()
+        self._persist(next_check=None)
+
+    def _alive(self, schedule, now):
+        """Whether the persisted schedule belongs to a scheduler that is still running"""
+        if schedule.get('running_model'):
+            return now - schedule['running_since'] < timedelta(seconds=JOB_TIMEOUT + self.interval)
+        next_check = schedule.get('next_check')
+        return next_check is not None and now < next_check + timedelta(seconds=self.interval)
+
+    def status(self):
+        """Schedule and last decision per model, as persisted by the worker running the scheduler"""
+        with self._lock:
+            local = bool(self._thread and self._thread.is_alive())
+            schedule = {'last_check': self.last_check, 'next_check': self.next_check,
+                        'running_model': self.running_model}
+            decisions = dict(self.decisions)
+
+        try:
+            client = get_mongo_client()
+            docs = {
+                doc['model_name']: doc for doc in self._state_collection(client).find(
+                    {'model_name': {'$in': [*self.models, SCHEDULER_STATE_ID]}},
+                    {'model_name': 1, 'last_decision': 1, 'last_check': 1, 'next_check': 1,
+                     'running_model': 1, 'running_since': 1, 'owner': 1}
+                )
+            }
+            client.close()
+        except Exception as e:
+            print(f"Warning: Could not read scheduler state, showing this worker's: {e}")
+            docs = None
+
+        owner = None
+        enabled = local
+        if docs is not None:
+            persisted = docs.get(SCHEDULER_STATE_ID, {})
+            schedule = {key: persisted.get(key) for key in schedule}
+            owner = persisted.get('owner')
+            enabled = local or self._alive(persisted, datetime.utcnow())
+            decisions = {name: doc.get('last_decision') for name, doc in docs.items() if name in self.models}
+
+        return {
+            'enabled': enabled,
+            'owner': owner,
+            'interval_seconds': self.interval,
+            'drift_threshold': self.threshold,
+            'stagger_seconds': self.stagger,
+            **schedule,
+            'models': {
+                name: {
+                    'inputs': MODEL_INPUTS.get(name, []),
+                    'last_decision': decisions.get(name)
+                }
+                for name in self.models
+            }
+        }
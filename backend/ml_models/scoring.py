@@ -0,0 +1,263 @@
+"""
+Batch Scoring Jobs
+==================
+Scores entities with the trained model artifacts and writes predictions back
+to MongoDB in unordered `bulk_write` batches with upserts, so the Node API
+can read precomputed predictions instead of calling Python per request.
+
+Jobs:
+- delay_risk:   every upcoming trip          -> trip_delay_predictions
+- demand:       every route/day/hour slot    -> demandpredictions (DemandPrediction)
+- crew_fitness: every driver and conductor   -> crewfatigues (CrewFatigue);
+                workload windows are folded incrementally into a persisted
+                CrewWindowState (crew_windows.py) instead of re-reading
+                every duty
+
+Usage:
+    python scoring.py                 # all jobs
+    python scoring.py demand crew_fitness
+"""
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from config import *
+from utils import get_mongo_client, get_model_artifact, bulk_write_batches, save_model_report
+from memory_stages import track_memory, mark_stage, memory_summary
+from dt_delay import build_trip_delay_pipeline, preprocess_delay_data
+from nn_crewload import update_crew_window_state, calculate_crew_features, get_crew_fitness_predictor
+
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+DEMAND_LEVELS = ['very_low', 'low', 'medium', 'high', 'very_high']
+
+
+def _to_object_id(value):
+    """Convert stringified ids (e.g. from snapshots) back to ObjectId"""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
+def _model_version(artifact):
+    return artifact['trained_at'].strftime('%Y%m%d%H%M%S')
+
+
+def _throughput(job, documents, score_seconds, write_seconds, write_totals):
+    total_seconds = score_seconds + write_seconds
+    return {
+        'job': job,
+        'documents': int(documents),
+        'score_seconds': round(score_seconds, 4),
+        'write_seconds': round(write_seconds, 4),
+        'docs_per_second': round(documents / total_seconds, 1) if total_seconds else None,
+        **write_totals
+    }
+
+
+def score_delay_risk(batch_size=SCORING_BATCH_SIZE):
+    """Score delay risk for every trip that has not departed yet"""
+    artifact = get_model_artifact('dt_delay_prediction')
+    # Bulk rows: scikit-learn's Cython traversal beats the compiled tree, which is for single trips
+    model = artifact['model']
+    now = datetime.utcnow()
+
+    start = time.perf_counter()
+    client = get_mongo_client()
+    db = client[DB_NAME]
+    pipeline = [{'$match': {'scheduledDeparture': {'$gte': now}}}] + build_trip_delay_pipeline()
+    df = pd.DataFrame(list(db[TRIPS_COLLECTION].aggregate(pipeline)))
+
+    if df.empty:
+        client.close()
+        return _throughput('delay_risk', 0, 0, 0, {})
+
+    df = preprocess_delay_data(df)
+    X = df[artifact['feature_cols']].fillna(0).values
+    classes = list(artifact['model'].classes_)
+    risk = model.predict_proba(X)[:, classes.index(1)] if 1 in classes else np.zeros(len(X))
+    score_seconds = time.perf_counter() - start
+
+    version = _model_version(artifact)
+    operations = (
+        UpdateOne(
+            {'trip': trip_id},
+            {'$set': {
+                'trip': trip_id,
+                'delayRisk': float(p),
+                'isLikelyDelayed': bool(p >= 0.5),
+                'scheduledDeparture': departure.to_pydatetime() if pd.notna(departure) else None,
+                'modelVersion': version,
+                'scoredAt': now
+            }},
+            upsert=True
+        )
+        for trip_id, p, departure in zip(df['_id'], risk, df['scheduled_departure'])
+    )
+
+    start = time.perf_counter()
+    totals = bulk_write_batches(db[DELAY_PREDICTIONS_COLLECTION], operations, batch_size)
+    write_seconds = time.perf_counter() - start
+    client.close()
+
+    return _throughput('delay_risk', len(df), score_seconds, write_seconds, totals)
+
+
+def score_demand(batch_size=SCORING_BATCH_SIZE):
+    """Score passenger demand for every route x day-of-week x hour slot"""
+    artifact = get_model_artifact('knn_demand_prediction')
+    knn, scaler = artifact['model'], artifact['scaler']
+    now = datetime.utcnow()
+
+    start = time.perf_counter()
+    routes = list(artifact['route_mapping'].items())
+    route_ids = np.repeat([route for route, _ in routes], 7 * 24)
+    route_encoded = np.repeat([idx for _, idx in routes], 7 * 24)
+    day_of_week = np.tile(np.repeat(np.arange(7), 24), len(routes))
+    hour_of_day = np.tile(np.arange(24), 7 * len(routes))
+    profile = artifact['route_profile']
+    fare = np.array([profile[idx]['fare'] for idx in route_encoded])
+    distance = np.array([profile[idx]['distance'] for idx in route_encoded])
+
+    X = scaler.transform(np.column_stack([route_encoded, day_of_week, hour_of_day, fare, distance]))
+    predicted = np.clip(knn.predict(X), 0, None)
+    neighbor_distances, _ = knn.kneighbors(X)
+    confidence = 1 / (1 + neighbor_distances.mean(axis=1))
+
+    # Demand level by quintile across all slots
+    levels = np.digitize(predicted, np.quantile(predicted, [0.2, 0.4, 0.6, 0.8]))
+    score_seconds = time.perf_counter() - start
+
+    # Each day-of-week slot is written for its next calendar occurrence
+    today = datetime(now.year, now.month, now.day)
+    dates = [today + timedelta(days=(dow - today.weekday()) % 7) for dow in range(7)]
+    version = _model_version(artifact)
+
+    operations = (
+        UpdateOne(
+            {'routeId': _to_object_id(route), 'predictionDate': dates[dow], 'timeSlot': f"{hour:02d}:00"},
+            {
+                '$set': {
+                    'predictedPassengers': float(passengers),
+                    'confidenceScore': float(conf),
+                    'demandLevel': DEMAND_LEVELS[level],
+                    'contextFactors.dayOfWeek': DAY_NAMES[dow],
+                    'contextFactors.isWeekend': bool(dow >= 5),
+                    'contextFactors.isPeakHour': bool(7 <= hour <= 9 or 17 <= hour <= 19),
+                    'modelInfo.modelVersion': version,
+                    'modelInfo.algorithm': 'KNN',
+                    'modelInfo.trainedOn': artifact['trained_at'],
+                    'modelInfo.features': artifact['feature_cols'],
+                    'updatedAt': now
+                },
+                '$setOnInsert': {'createdAt': now}
+            },
+            upsert=True
+        )
+        for route, dow, hour, passengers, conf, level in zip(
+            route_ids, day_of_week, hour_of_day, predicted, confidence, levels
+        )
+    )
+
+    client = get_mongo_client()
+    start = time.perf_counter()
+    totals = bulk_write_batches(client[DB_NAME][DEMAND_PREDICTIONS_COLLECTION], operations, batch_size)
+    write_seconds = time.perf_counter() - start
+    client.close()
+
+    return _throughput('demand', len(predicted), score_seconds, write_seconds, totals)
+
+
+def score_crew_fitness(batch_size=SCORING_BATCH_SIZE):
+    """Score current fitness for every crew member with duty history"""
+    predict, artifact = get_crew_fitness_predictor()
+    now = datetime.utcnow()
+
+    start = time.perf_counter()
+    # Latest windows of every driver and conductor (one row per crew member, not per duty)
+    windows, update = update_crew_window_state()
+    if windows.latest.empty:
+        return _throughput('crew_fitness', 0, 0, 0, {})
+
+    crew = windows.latest.copy()
+    crew['route_length'] = crew['route_length'].fillna(artifact.get('feature_medians', {}).get('route_length', 0))
+    crew = calculate_crew_features(crew, windows_computed=True)
+    fitness = np.clip(predict(crew[artifact['feature_cols']].values), 0, 1)
+    score_seconds = time.perf_counter() - start
+
+    today = datetime(now.year, now.month, now.day)
+    version = _model_version(artifact)
+
+    def operations():
+        for row, score in zip(crew.itertuples(index=False), fitness):
+            fatigue = float((1 - score) * 100)
+            update = {
+                'crewType': row.crew_type,
+                'fatigueScore': fatigue,
+                'fitnessScore': float(score),
+                'workloadMetrics.dailyWorkingHours': float(0 if pd.isna(row.shift_hours) else row.shift_hours),
+                'workloadMetrics.consecutiveWorkingDays': int(row.consecutive_days),
+                'workloadMetrics.restHoursSinceLastShift': float(row.rest_hours),
+                'workloadMetrics.tripsCompletedToday': int(row.trips_per_day),
+                'eligibilityStatus.isEligible': fatigue < 70,
+                'calculatedAt': now,
+                'calculatedBy': f'ml_batch_scoring:{version}',
+                'updatedAt': now
+            }
+            if getattr(row, 'depot_id', None) is not None:
+                update['depotId'] = _to_object_id(row.depot_id)
+            yield UpdateOne(
+                {'crewId': _to_object_id(row.crew_id), 'date': today},
+                {'$set': update, '$setOnInsert': {'createdAt': now}},
+                upsert=True
+            )
+
+    client = get_mongo_client()
+    start = time.perf_counter()
+    totals = bulk_write_batches(client[DB_NAME][CREW_FATIGUE_COLLECTION], operations(), batch_size)
+    write_seconds = time.perf_counter() - start
+    client.close()
+
+    return {**_throughput('crew_fitness', len(crew), score_seconds, write_seconds, totals), 'windows': update}
+
+
+SCORING_JOBS = {
+    'delay_risk': score_delay_risk,
+    'demand': score_demand,
+    'crew_fitness': score_crew_fitness,
+}
+
+
+@track_memory
+def run_batch_scoring(jobs=None, batch_size=SCORING_BATCH_SIZE):
+    """Run scoring jobs and store their throughput and memory in ml_reports"""
+    results = {}
+    for job in jobs or SCORING_JOBS:
+        mark_stage(job)
+        print(f"🧮 Scoring {job}...")
+        results[job] = SCORING_JOBS[job](batch_size)
+        print(f"✅ {job}: {results[job]['documents']} docs at {results[job]['docs_per_second']} docs/s")
+
+    save_model_report('batch_scoring', {
+        'model_type': 'Batch Scoring',
+        'description': 'Precomputed predictions written back with bulk upserts',
+        'batch_size': batch_size,
+        'jobs': results,
+        'memory': memory_summary()
+    })
+    return results
+
+
+if __name__ == '__main__':
+    requested = sys.argv[1:] or None
+    unknown = [job for job in requested or [] if job not in SCORING_JOBS]
+    if unknown:
+        print(f"❌ Unknown jobs: {', '.join(unknown)}. Available: {', '.join(SCORING_JOBS)}")
+        sys.exit(1)
+    run_batch_scoring(requested)
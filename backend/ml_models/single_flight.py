@@ -0,0 +1,250 @@
+"""
+Single-Flight Training
+======================
+Coalesces concurrent training requests for the same model so that only one
+training runs and every caller receives its result.
+
+A flight is one (model, fingerprint, force) combination, so only requests
+with the same parameters (sampling, incremental/full_refit, data and code)
+share a result. A request without a fingerprint never joins another.
+
+- In-process: the first caller of a flight becomes the leader and trains;
+  callers arriving while it runs wait on the same flight and share its result.
+- Across processes (gunicorn workers): the leader takes a lease on the model's
+  `ml_training_state` document, which records the run's fingerprint. If
+  another run holds it, the leader waits for that run to finish: with the
+  same fingerprint it returns that run's report, otherwise it then trains.
+  Runs of one model therefore never overlap, whatever their parameters.
+- Minimum interval: a model trained on the same fingerprint less than
+  MIN_RETRAIN_INTERVAL seconds ago is not retrained (unless forced); callers
+  get the latest report.
+- Training cache: a caller that passes a fingerprint (training_cache.py) gets
+  the report of an earlier run with the same data, code and parameters
+  instead of a retrain (unless forced). Trained results are recorded under
+  their fingerprint, unless the caller writes the report later and records
+  it itself (record=False).
+
+Every call resolves to one of: 'trained', 'cached' (same fingerprint as an
+earlier run), 'coalesced' (joined an in-process flight), 'remote' (joined
+another process's run), 'throttled' (within the minimum interval). Leader
+errors are re-raised to every waiter and counted as 'failed'.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from config import *
+from utils import get_mongo_client, get_latest_report
+from training_cache import lookup_cached_result, record_cached_result
+
+
+OUTCOMES = ('trained', 'cached', 'coalesced', 'remote', 'throttled', 'failed')
+
+
+class _Flight:
+    def __init__(self, model_name, fingerprint, force):
+        self.model_name = model_name
+        self.fingerprint = fingerprint
+        self.force = force
+        self.done = threading.Event()
+        self.result = None
+        self.outcome = None
+        self.error = None
+        self.waiters = 0
+        self.started_at = datetime.utcnow()
+
+
+class SingleFlight:
+    """Per-model training coalescing with a minimum retrain interval"""
+
+    def __init__(self, min_interval=MIN_RETRAIN_INTERVAL, lease_seconds=TRAINING_LEASE_SECONDS,
+                 poll_seconds=TRAINING_LEASE_POLL):
+        self.min_interval = min_interval
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._token = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._last_trained = {}
+        self._counts = {}
+
+    @property
+    def owner(self):
+        """Lease owner id; uses the current pid since instances are created before fork"""
+        return f"{socket.gethostname()}:{os.getpid()}:{self._token}"
+
+    def _count(self, model_name, outcome):
+        counts = self._counts.setdefault(model_name, dict.fromkeys(OUTCOMES, 0))
+        counts[outcome] += 1
+
+    def run(self, model_name, fn, force=False, fingerprint=None, record=True):
+        """Run fn() for model_name unless a run is in flight, recent or cached; returns (result, outcome)"""
+        # Without a fingerprint the parameters are unknown, so the flight is never shared
+        key = (model_name, fingerprint or uuid.uuid4().hex, bool(force))
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight(model_name, fingerprint, bool(force))
+            else:
+                flight.waiters += 1
+                self._count(model_name, 'coalesced')
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.result, 'coalesced'
+
+        try:
+            flight.result, flight.outcome = self._lead(model_name, fn, force, fingerprint, record)
+            return flight.result, flight.outcome
+        except Exception as e:
+            flight.error = e
+            flight.outcome = 'failed'
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.outcome:
+                    self._count(model_name, flight.outcome)
+            flight.done.set()
+
+    def _lead(self, model_name, fn, force, fingerprint, record):
+        if fingerprint and not force:
+            cached = self._cached_result(model_name, fingerprint)
+            if cached is not None:
+                return cached, 'cached'
+
+        if not force:
+            recent = self._recent_result(model_name, fingerprint)
+            if recent is not None:
+                return recent, 'throttled'
+
+        while True:
+            lease = self._acquire_lease(model_name, fingerprint)
+            if lease is not False:
+                break
+            same, result = self._wait_for_remote(model_name, fingerprint)
+            if same:
+                return result, 'remote'
+            # A run with other parameters finished; take the lease for this one
+
+        try:
+            result = fn()
+        finally:
+            if lease:
+                self._release_lease(model_name, finished=bool(result), fingerprint=fingerprint)
+
+        if result:
+            self._last_trained[model_name] = (time.monotonic(), fingerprint)
+            if fingerprint and record:
+                self._record_cached(model_name, fingerprint)
+        return result, 'trained'
+
+    def _state(self):
+        client = get_mongo_client()
+        return client, client[DB_NAME][TRAINING_STATE_COLLECTION]
+
+    def _recent_result(self, model_name, fingerprint):
+        """Latest report if the model's last run used this fingerprint and finished within the minimum interval"""
+        if self.min_interval <= 0 or not fingerprint:
+            return None
+
+        trained, last_fingerprint = self._last_trained.get(model_name, (float('-inf'), None))
+        recent = last_fingerprint == fingerprint and time.monotonic() - trained < self.min_interval
+        try:
+            if not recent:
+                client, state = self._state()
+                doc = state.find_one({'model_name': model_name}, {'last_run': 1})
+                client.close()
+                last_run = (doc or {}).get('last_run') or {}
+                recent = last_run.get('fingerprint') == fingerprint and \
+                    datetime.utcnow() - last_run['finished_at'] < timedelta(seconds=self.min_interval)
+            report = get_latest_report(model_name) if recent else None
+        except Exception:
+            return None
+        return report['metrics'] if report else None
+
+    def _cached_result(self, model_name, fingerprint):
+        try:
+            return lookup_cached_result(model_name, fingerprint)
+        except Exception as e:
+            print(f"Warning: Could not read training cache for {model_name}: {e}")
+            return None
+
+    def _record_cached(self, model_name, fingerprint):
+        try:
+            record_cached_result(model_name, fingerprint)
+        except Exception as e:
+            print(f"Warning: Could not record training cache for {model_name}: {e}")
+
+    def _acquire_lease(self, model_name, fingerprint=None):
+        """True if acquired, False if another run holds it, None if MongoDB is unavailable"""
+        now = datetime.utcnow()
+        try:
+            client, state = self._state()
+            state.update_one({'model_name': model_name}, {'$setOnInsert': {'model_name': model_name}}, upsert=True)
+            acquired = state.find_one_and_update(
+                {'model_name': model_name, '$or': [{'lease': None}, {'lease.expires_at': {'$lt': now}}]},
+                {'$set': {'lease': {
+                    'owner': self.owner,
+                    'fingerprint': fingerprint,
+                    'started_at': now,
+                    'expires_at': now + timedelta(seconds=self.lease_seconds)
+                }}}
+            )
+            client.close()
+        except Exception as e:
+            print(f"Warning: Could not take training lease for {model_name}: {e}")
+            return None
+        return acquired is not None
+
+    def _release_lease(self, model_name, finished=False, fingerprint=None):
+        """Release the lease; a finished run also becomes the model's last run, with its fingerprint"""
+        update = {'$unset': {'lease': ''}}
+        if finished:
+            update['$set'] = {'last_run': {'fingerprint': fingerprint, 'finished_at': datetime.utcnow()}}
+        try:
+            client, state = self._state()
+            state.update_one({'model_name': model_name, 'lease.owner': self.owner}, update)
+            client.close()
+        except Exception as e:
+            print(f"Warning: Could not release training lease for {model_name}: {e}")
+
+    def _wait_for_remote(self, model_name, fingerprint):
+        """Wait for another run to finish; (True, its report) if it had this fingerprint, else (False, None)"""
+        print(f"⏳ {model_name} is training in another run, waiting for it to finish...")
+        same = False
+        deadline = time.monotonic() + self.lease_seconds
+        while time.monotonic() < deadline:
+            client, state = self._state()
+            doc = state.find_one({'model_name': model_name}, {'lease': 1})
+            client.close()
+            lease = doc.get('lease') if doc else None
+            if not lease or lease['expires_at'] < datetime.utcnow():
+                break
+            same = bool(fingerprint) and lease.get('fingerprint') == fingerprint
+            time.sleep(self.poll_seconds)
+
+        if not same:
+            return False, None
+        report = get_latest_report(model_name)
+        return True, report['metrics'] if report else None
+
+    def status(self):
+        """In-flight runs and outcome counts per model"""
+        with self._lock:
+            return {
+                'min_retrain_interval_seconds': self.min_interval,
+                'in_flight': [
+                    {'model': flight.model_name, 'fingerprint': flight.fingerprint, 'force': flight.force,
+                     'started_at': flight.started_at, 'waiters': flight.waiters}
+                    for flight in self._flights.values()
+                ],
+                'counts': {name: dict(counts) for name, counts in self._counts.items()}
+            }
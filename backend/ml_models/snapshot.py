@@ -0,0 +1,288 @@
+"""
+Dataset Snapshots
+=================
+Exports the joined training datasets used by each pipeline into versioned
+Arrow IPC files with a manifest, and loads them back through memory maps.
+
+Snapshots are written uncompressed so that a memory-mapped read is
+zero-copy: every process that opens the same snapshot shares one read-only
+copy of the data through the OS page cache.
+
+load_snapshot keeps that through to pandas (split_blocks, self_destruct) for
+numeric, boolean and timestamp columns without nulls: their arrays are
+read-only views of the mapped file. Copied on conversion: columns with
+nulls (including float columns that had NaN when exported, stored as
+nulls), strings and ids, and any column of a table read in several chunks.
+Assign new columns instead of writing into the loaded ones in place, or
+copy() the frame first.
+
+Layout:
+    <SNAPSHOT_DIR>/<version>/<dataset>.arrow
+    <SNAPSHOT_DIR>/<version>/manifest.json
+    <SNAPSHOT_DIR>/LATEST
+
+Usage:
+    python snapshot.py export [--datasets knn_demand_prediction ...] [--version v1]
+    python snapshot.py list
+    python snapshot.py show [version]
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from bson import ObjectId
+
+from config import *
+from utils import get_mongo_client, booking_totals_lookup, booking_total
+from sampling import sample_frame
+
+
+SNAPSHOT_FORMAT = 'arrow-ipc'
+LATEST_FILE = 'LATEST'
+MANIFEST_FILE = 'manifest.json'
+
+# Dataset name -> (module, fetch function). Names match the ml_service registry.
+DATASETS = {
+    'knn_demand_prediction': ('knn_demand', 'fetch_booking_data'),
+    'nb_route_performance': ('nb_route_performance', 'fetch_route_performance_data'),
+    'dt_delay_prediction': ('dt_delay', 'fetch_trip_delay_data'),
+    'svm_route_optimization': ('svm_route_opt', 'fetch_route_optimization_data'),
+    'nn_crew_load_balancing': ('nn_crewload', 'fetch_crew_load_data'),
+    'demand_training': ('snapshot', 'fetch_demand_training_data'),
+    'demand_daily': ('demand_forecast', 'fetch_demand_daily_data'),
+}
+
+
+def fetch_demand_training_data():
+    """Fetch per-trip demand rows in the shape the LSTM research scripts expect"""
+    client = get_mongo_client()
+    db = client[DB_NAME]
+
+    pipeline = [
+        booking_totals_lookup(),
+        {
+            '$project': {
+                'trip_id': '$_id',
+                'route_id': '$route',
+                'date': '$scheduledDeparture',
+                'capacity': {'$ifNull': ['$bus.capacity', 50]},
+                'passengers': booking_total('seats'),
+                'revenue': booking_total('revenue')
+            }
+        }
+    ]
+
+    trips = list(db[TRIPS_COLLECTION].aggregate(pipeline))
+    client.close()
+
+    df = pd.DataFrame(trips)
+    if df.empty:
+        return df
+
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df = df.dropna(subset=['date']).sort_values('date').reset_index(drop=True)
+    df['day_of_week'] = df['date'].dt.dayofweek
+    df['hour'] = df['date'].dt.hour
+    df['month'] = df['date'].dt.month
+    df['is_weekend'] = (df['day_of_week'] >= 5).astype(int)
+    df['is_holiday'] = 0
+    df['is_peak_hour'] = df['hour'].between(7, 9) | df['hour'].between(17, 19)
+    df['is_peak_hour'] = df['is_peak_hour'].astype(int)
+    df['utilization'] = (df['passengers'] / df['capacity'].replace(0, 1)) * 100
+
+    return df
+
+
+def _arrow_safe(df):
+    """Convert Mongo-specific values (ObjectId, mixed objects) to Arrow-friendly types"""
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        df[column] = df[column].map(lambda v: str(v) if isinstance(v, ObjectId) else v)
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[column] = df[column].map(lambda v: None if v is None else str(v))
+    return df
+
+
+def _file_sha256(path):
+    """Hash a snapshot file in 1 MB chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _replace_with(path, write):
+    """Write a file next to path, then swap it in, so readers never see a partial file"""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_text(text):
+    def write(path):
+        with open(path, 'w') as f:
+            f.write(text)
+    return write
+
+
+def write_table(df, path):
+    """Write a DataFrame as an uncompressed Arrow IPC file"""
+    table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+
+    def write(tmp_path):
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    _replace_with(path, write)
+    return table
+
+
+def export_snapshot(datasets=None, version=None, snapshot_dir=SNAPSHOT_DIR):
+    """Export training datasets from MongoDB into a new snapshot version"""
+    datasets = datasets or list(DATASETS.keys())
+    unknown = [name for name in datasets if name not in DATASETS]
+    if unknown:
+        raise ValueError(f"Unknown datasets: {', '.join(unknown)}")
+
+    version = version or datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    version_dir = os.path.join(snapshot_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    manifest = {
+        'version': version,
+        'format': SNAPSHOT_FORMAT,
+        'created_at': datetime.utcnow().isoformat(),
+        'source': {'db': DB_NAME},
+        'datasets': {}
+    }
+
+    for name in datasets:
+        module_name, fetch_name = DATASETS[name]
+        fetch_fn = getattr(importlib.import_module(module_name), fetch_name)
+
+        print(f"📊 Exporting {name}...")
+        df = fetch_fn()
+        filename = f"{name}.arrow"
+        path = os.path.join(version_dir, filename)
+        table = write_table(df, path)
+
+        manifest['datasets'][name] = {
+            'file': filename,
+            'rows': table.num_rows,
+            'columns': {field.name: str(field.type) for field in table.schema},
+            'bytes': os.path.getsize(path),
+            'sha256': _file_sha256(path)
+        }
+        print(f"✅ {name}: {table.num_rows} rows -> {filename}")
+
+    # The manifest, then the LATEST pointer, are swapped in only once the data files are complete
+    _replace_with(os.path.join(version_dir, MANIFEST_FILE), _write_text(json.dumps(manifest, indent=2)))
+    _replace_with(os.path.join(snapshot_dir, LATEST_FILE), _write_text(version))
+
+    print(f"💾 Snapshot {version} written to {version_dir}")
+    return manifest
+
+
+def resolve_version(version=None, snapshot_dir=SNAPSHOT_DIR):
+    """Resolve 'latest' (or None) to a concrete snapshot version"""
+    if version and version != 'latest':
+        return version
+
+    latest_path = os.path.join(snapshot_dir, LATEST_FILE)
+    if not os.path.exists(latest_path):
+        raise FileNotFoundError(f"No snapshots found in {snapshot_dir}")
+
+    with open(latest_path) as f:
+        return f.read().strip()
+
+
+def read_manifest(version=None, snapshot_dir=SNAPSHOT_DIR):
+    """Read the manifest of a snapshot version"""
+    version = resolve_version(version, snapshot_dir)
+    with open(os.path.join(snapshot_dir, version, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def list_snapshots(snapshot_dir=SNAPSHOT_DIR):
+    """List available snapshot versions, newest first"""
+    if not os.path.isdir(snapshot_dir):
+        return []
+
+    versions = [
+        name for name in os.listdir(snapshot_dir)
+        if os.path.exists(os.path.join(snapshot_dir, name, MANIFEST_FILE))
+    ]
+    return sorted(versions, reverse=True)
+
+
+def open_snapshot_table(dataset, version=None, snapshot_dir=SNAPSHOT_DIR):
+    """Memory-map a snapshot dataset as a zero-copy pyarrow Table"""
+    manifest = read_manifest(version, snapshot_dir)
+    if dataset not in manifest['datasets']:
+        raise KeyError(f"Dataset '{dataset}' not in snapshot {manifest['version']}")
+
+    path = os.path.join(snapshot_dir, manifest['version'], manifest['datasets'][dataset]['file'])
+    source = pa.memory_map(path, 'r')
+    return ipc.open_file(source).read_all()
+
+
+def load_snapshot(dataset, version=None, columns=None, snapshot_dir=SNAPSHOT_DIR):
+    """Load a snapshot dataset into a DataFrame; null-free numeric columns stay zero-copy (read-only)"""
+    table = open_snapshot_table(dataset, version, snapshot_dir)
+    if columns:
+        table = table.select(columns)
+    # One block per column, so pandas can wrap the mapped buffers instead of consolidating copies
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def load_training_data(dataset, fetch_fn, sampling=None):
+    """Load pipeline input from the configured snapshot, or fetch it from MongoDB"""
+    if SNAPSHOT_VERSION:
+        print(f"📦 Loading {dataset} from snapshot '{SNAPSHOT_VERSION}'...")
+        return sample_frame(load_snapshot(dataset, SNAPSHOT_VERSION), sampling)
+    return fetch_fn(sampling)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export and inspect ML dataset snapshots')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Export datasets from MongoDB')
+    export_parser.add_argument('--datasets', nargs='+', choices=list(DATASETS.keys()))
+    export_parser.add_argument('--version', help='Snapshot version (default: UTC timestamp)')
+
+    subparsers.add_parser('list', help='List snapshot versions')
+
+    show_parser = subparsers.add_parser('show', help='Print a snapshot manifest')
+    show_parser.add_argument('version', nargs='?', default='latest')
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_snapshot(args.datasets, args.version)
+    elif args.command == 'list':
+        for version in list_snapshots():
+            print(version)
+    elif args.command == 'show':
+        print(json.dumps(read_manifest(args.version), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Split Registry
+==============
+Stable train/test and cross-validation fold assignments, stored per dataset
+by entity key (trip id, route id, crew id) instead of redrawn by
+train_test_split on every run.
+
+- An entity's assignment comes from the MD5 of its key. It is test when
+  hash % 1000 < TEST_SIZE * 1000, the rule the incremental Naive Bayes
+  update already uses. Otherwise it is training fold (hash // 1000) % SPLIT_FOLDS
+- Assignments are stored in SPLIT_DIR/<dataset>.arrow. Known entities keep
+  their stored assignment, and only new keys are hashed and appended. A
+  growing dataset therefore never reshuffles existing rows, and every run
+  and hyperparameter trial is evaluated on the same entities
+- Rows that share a key (all duties of one crew member) land on the same side
+- assign() returns row index arrays (train, test, folds). Callers index
+  their own arrays; the registry never copies the data
+
+If a dataset is so small that every entity falls on one side, the entity
+nearest the threshold is moved for that run only (reported as 'adjusted').
+
+Usage:
+    python splits.py show [dataset]
+    python splits.py reset <dataset>
+"""
+
+import argparse
+import hashlib
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from config import *
+
+
+HASH_BUCKETS = 1000
+
+
+def _digests(keys):
+    return [int(hashlib.md5(key.encode()).hexdigest(), 16) for key in keys]
+
+
+def hash_assignments(keys, test_size=TEST_SIZE, n_folds=SPLIT_FOLDS):
+    """(is_test, fold, bucket) per string key; fold is -1 for test keys"""
+    digests = _digests(keys)
+    buckets = np.array([digest % HASH_BUCKETS for digest in digests], dtype=np.int16)
+    folds = np.array([(digest // HASH_BUCKETS) % n_folds for digest in digests], dtype=np.int8)
+    test = buckets < test_size * HASH_BUCKETS
+    return test, np.where(test, -1, folds).astype(np.int8), buckets
+
+
+def is_holdout(key, test_size=TEST_SIZE):
+    """Whether a single entity belongs to the test set"""
+    return bool(hash_assignments([str(key)], test_size)[0][0])
+
+
+def key_strings(keys):
+    """Entity keys as strings, so ObjectIds and their snapshot strings agree"""
+    return pd.Index(keys).astype(str)
+
+
+class Split:
+    """Row index arrays of one dataset's train/test split and training folds"""
+
+    def __init__(self, dataset, row_folds, row_test, n_folds, entities, new_entities, adjusted):
+        self.dataset = dataset
+        self.row_folds = row_folds
+        self.n_folds = n_folds
+        self.train = np.flatnonzero(~row_test)
+        self.test = np.flatnonzero(row_test)
+        self.entities = entities
+        self.new_entities = new_entities
+        self.adjusted = adjusted
+
+    def fold_indices(self):
+        """(training rows, validation rows) per cross-validation fold of the training entities"""
+        for fold in range(self.n_folds):
+            validation = np.flatnonzero(self.row_folds == fold)
+            if len(validation):
+                yield np.flatnonzero((self.row_folds >= 0) & (self.row_folds != fold)), validation
+
+    def summary(self):
+        return {
+            'registry': self.dataset,
+            'train_rows': int(len(self.train)),
+            'test_rows': int(len(self.test)),
+            'entities': self.entities,
+            'new_entities': self.new_entities,
+            'folds': self.n_folds,
+            'adjusted': self.adjusted
+        }
+
+
+_registry_cache = {}
+
+
+class SplitRegistry:
+    """Stored split assignments of one dataset, extended as new entities appear"""
+
+    def __init__(self, dataset, test_size=TEST_SIZE, n_folds=SPLIT_FOLDS, split_dir=SPLIT_DIR):
+        self.dataset = dataset
+        self.test_size = test_size
+        self.n_folds = n_folds
+        self.path = os.path.join(split_dir, f'{dataset}.arrow')
+
+    def _load(self):
+        """(keys index, test flags, folds, buckets, metadata), cached until the file changes"""
+        if not os.path.exists(self.path):
+            return None
+        mtime = os.path.getmtime(self.path)
+        cached = _registry_cache.get(self.path)
+        if cached is None or cached[0] != mtime:
+            table = ipc.open_file(pa.memory_map(self.path, 'r')).read_all()
+            metadata = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+            stored = (
+                pd.Index(table.column('key').to_pylist()),
+                table.column('test').to_numpy(),
+                table.column('fold').to_numpy(),
+                table.column('bucket').to_numpy(),
+                metadata
+            )
+            _registry_cache[self.path] = cached = (mtime, stored)
+        return cached[1]
+
+    def _save(self, keys, test, folds, buckets, metadata):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        table = pa.table({'key': pa.array(keys, pa.string()), 'test': test, 'fold': folds, 'bucket': buckets})
+        table = table.replace_schema_metadata(metadata)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, self.path)  # readers never see a partial file
+
+    def assign(self, keys):
+        """Split for rows with the given entity keys (one key per row)"""
+        codes, unique = pd.factorize(key_strings(keys))
+        stored = self._load()
+
+        if stored is None:
+            metadata = {'test_size': str(self.test_size), 'folds': str(self.n_folds),
+                        'created_at': datetime.utcnow().isoformat()}
+            known_keys = pd.Index([], dtype=object)
+            known_test = np.zeros(0, dtype=bool)
+            known_folds = np.zeros(0, dtype=np.int8)
+            known_buckets = np.zeros(0, dtype=np.int16)
+        else:
+            known_keys, known_test, known_folds, known_buckets, metadata = stored
+            if (float(metadata['test_size']), int(metadata['folds'])) != (self.test_size, self.n_folds):
+                print(f"Warning: Split registry '{self.dataset}' uses test_size={metadata['test_size']}, "
+                      f"folds={metadata['folds']}; keeping its assignments. "
+                      f"Run `python splits.py reset {self.dataset}` to re-split.")
+        test_size, n_folds = float(metadata['test_size']), int(metadata['folds'])
+
+        positions = known_keys.get_indexer(unique)
+        new = positions < 0
+        if new.any():
+            new_keys = unique[new]
+            new_test, new_folds, new_buckets = hash_assignments(new_keys, test_size, n_folds)
+            known_keys = known_keys.append(new_keys)
+            known_test = np.concatenate([known_test, new_test])
+            known_folds = np.concatenate([known_folds, new_folds])
+            known_buckets = np.concatenate([known_buckets, new_buckets])
+            self._save(known_keys, known_test, known_folds, known_buckets, metadata)
+            positions = known_keys.get_indexer(unique)
+
+        entity_test = known_test[positions].copy()
+        entity_folds = known_folds[positions].copy()
+        adjusted = False
+        if len(unique) > 1 and (entity_test.all() or not entity_test.any()):
+            # Every entity on one side: move the one nearest the threshold, for this run only
+            buckets = known_buckets[positions]
+            index = int(np.argmin(buckets)) if not entity_test.any() else int(np.argmax(buckets))
+            entity_test[index] = not entity_test[index]
+            entity_folds[index] = -1 if entity_test[index] else 0
+            adjusted = True
+
+        return Split(self.dataset, entity_folds[codes], entity_test[codes], n_folds,
+                     entities=int(len(unique)), new_entities=int(new.sum()), adjusted=adjusted)
+
+
+def get_split(dataset, keys):
+    """Train/test row indices for a dataset's rows, keyed by entity"""
+    split = SplitRegistry(dataset).assign(keys)
+    if split.new_entities:
+        print(f"🔀 Split registry '{dataset}': {split.new_entities} new of {split.entities} entities assigned")
+    return split
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or reset stored train/test split assignments')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help='Entities per side and fold')
+    show_parser.add_argument('dataset', nargs='?')
+    reset_parser = subparsers.add_parser('reset', help='Delete a registry; the next run re-splits from scratch')
+    reset_parser.add_argument('dataset')
+    args = parser.parse_args()
+
+    if args.command == 'reset':
+        path = SplitRegistry(args.dataset).path
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"🗑️  Reset split registry '{args.dataset}'")
+        return
+
+    datasets = [args.dataset] if args.dataset else sorted(
+        name[:-len('.arrow')] for name in os.listdir(SPLIT_DIR) if name.endswith('.arrow')
+    ) if os.path.isdir(SPLIT_DIR) else []
+    for dataset in datasets:
+        stored = SplitRegistry(dataset)._load()
+        if stored is None:
+            print(f"{dataset}: no registry")
+            continue
+        keys, test, folds, _, metadata = stored
+        fold_counts = np.bincount(folds[folds >= 0], minlength=int(metadata['folds']))
+        print(f"🔀 {dataset}: {len(keys)} entities, {int(test.sum())} test, "
+              f"folds {fold_counts.tolist()} (test_size {metadata['test_size']}, since {metadata['created_at']})")
+
+
+if __name__ == '__main__':
+    main()
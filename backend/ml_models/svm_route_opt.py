@@ -13,11 +13,13 @@ Output: Binary class (Optimized / Needs Optimization)
 
 Metrics: Accuracy, Precision, Recall, F1-Score
 Visualization: Decision boundary plot (2D projection)
+
+Unsampled runs read the trip-side rows of the route_daily_features store
+instead of joining every trip.
 """
 
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.svm import SVC
 from sklearn.decomposition import PCA
@@ -26,19 +28,23 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 import base64
+import time
 from io import BytesIO
 
 from config import *
-from utils import get_mongo_client, save_model_report
+from utils import get_mongo_client, save_model_report, save_model_artifact, booking_totals_lookup, booking_total
+from snapshot import load_training_data
+from splits import get_split
+from bootstrap import classification_intervals
+from importance import permutation_importance
+from memory_stages import track_memory, mark_stage, memory_summary
+from sampling import normalize_sampling, default_sampling, build_sampling_stages, describe_sampling
+from feature_store import use_feature_store, load_route_daily_features, route_totals, mean_from_sums
 
 
-def fetch_route_optimization_data():
-    """Fetch route data for optimization analysis"""
-    client = get_mongo_client()
-    db = client[DB_NAME]
-    
-    # Aggregate trips with route and booking data
-    pipeline = [
+def build_route_optimization_pipeline():
+    """Aggregation stages joining trips with route and booking totals"""
+    return [
         {
             '$lookup': {
                 'from': 'routes',
@@ -48,30 +54,34 @@ def fetch_route_optimization_data():
             }
         },
         {'$unwind': '$route_info'},
-        {
-            '$lookup': {
-                'from': 'bookings',
-                'localField': '_id',
-                'foreignField': 'trip',
-                'as': 'bookings'
-            }
-        },
+        booking_totals_lookup(),
         {
             '$project': {
                 'route_id': '$route_info._id',
                 'route_name': '$route_info.name',
                 'distance': '$route_info.distance',
                 'capacity': '$bus.capacity',
-                'seats_booked': {'$sum': '$bookings.seats'},
-                'revenue': {'$sum': '$bookings.fare'},
+                'seats_booked': booking_total('seats'),
+                'revenue': booking_total('revenue'),
                 'scheduled_departure': '$scheduledDeparture',
                 'actual_departure': '$actualDeparture',
                 'fuel_cost': {'$ifNull': ['$fuelCost', 0]}
             }
         }
     ]
+
+
+def fetch_route_optimization_data(sampling=None):
+    """Fetch route data for optimization analysis"""
+    client = get_mongo_client()
+    db = client[DB_NAME]
+    
+    # Aggregate trips with route and booking data
+    pipeline = build_route_optimization_pipeline()
     
-    trips = list(db[TRIPS_COLLECTION].aggregate(pipeline))
+    pipeline[0:0] = build_sampling_stages(db[TRIPS_COLLECTION], sampling)
+
+    trips = list(db[TRIPS_COLLECTION].aggregate(pipeline, allowDiskUse=bool(sampling)))
     client.close()
     
     return pd.DataFrame(trips)
@@ -108,6 +118,22 @@ def calculate_optimization_features(df):
     return route_stats
 
 
+def optimization_features_from_store(rows):
+    """Same per-route features as calculate_optimization_features, from store rows"""
+    totals = route_totals(rows, [
+        'trips', 'abs_delay_minutes_sum',
+        'occupancy_percentage_sum', 'occupancy_percentage_n',
+        'fuel_per_km_sum', 'fuel_per_km_n',
+        'revenue_per_km_sum', 'revenue_per_km_n'
+    ])
+    return pd.DataFrame({
+        'occupancy_rate': mean_from_sums(totals, 'occupancy_percentage'),
+        'avg_delay_minutes': totals['abs_delay_minutes_sum'] / totals['trips'],
+        'fuel_per_km': mean_from_sums(totals, 'fuel_per_km'),
+        'revenue_per_km': mean_from_sums(totals, 'revenue_per_km')
+    }).reset_index()
+
+
 def classify_optimization_need(df):
     """Classify routes as needing optimization or not"""
     # Optimization score (higher is better)
@@ -205,23 +231,34 @@ def create_decision_boundary_plot(X, y, model, scaler, feature_names):
     return f"data:image/png;base64,{image_base64}"
 
 
-def run_svm_route_optimization():
+@track_memory
+def run_svm_route_optimization(sampling=None):
     """Main function to run SVM route optimization"""
     print("🚀 Starting SVM Route Optimization Suggestion...")
     
+    sampling = normalize_sampling(sampling or default_sampling(), by='route', time_field='scheduledDeparture')
+
     # Fetch data
+    mark_stage('fetch')
+    from_store = use_feature_store(sampling)
     print("📊 Fetching route data...")
-    df = fetch_route_optimization_data()
+    fetch_start = time.perf_counter()
+    if from_store:
+        df, feature_store = load_route_daily_features('trips')
+    else:
+        df = load_training_data('svm_route_optimization', fetch_route_optimization_data, sampling)
+    fetch_seconds = time.perf_counter() - fetch_start
     
     if df.empty:
         print("❌ No route data found!")
         return None
     
-    print(f"✅ Loaded {len(df)} trip records")
+    print(f"✅ Loaded {len(df)} {'feature store rows' if from_store else 'trip records'}")
     
     # Calculate features
+    mark_stage('features')
     print("🔄 Calculating optimization features...")
-    route_stats = calculate_optimization_features(df)
+    route_stats = optimization_features_from_store(df) if from_store else calculate_optimization_features(df)
     
     # Classify optimization need
     route_stats = classify_optimization_need(route_stats)
@@ -239,9 +276,8 @@ def run_svm_route_optimization():
     
     # Train-test split
     if len(y) > 10:
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y
-        )
+        split = get_split('svm_route_optimization', route_stats['route_id'])
+        X_train, X_test, y_train, y_test = X[split.train], X[split.test], y[split.train], y[split.test]
     else:
         print("❌ Insufficient data for training!")
         return None
@@ -249,17 +285,25 @@ def run_svm_route_optimization():
     print(f"📈 Training set: {len(X_train)}, Test set: {len(X_test)}")
     
     # Train model
+    mark_stage('train')
     print("🤖 Training SVM model...")
+    train_start = time.perf_counter()
     svm, scaler, y_pred_train, y_pred_test = train_svm_model(X_train, y_train, X_test, y_test)
+    train_seconds = time.perf_counter() - train_start
     
     # Calculate metrics
+    mark_stage('evaluate')
     train_metrics = calculate_classification_metrics(y_train, y_pred_train)
     test_metrics = calculate_classification_metrics(y_test, y_pred_test)
     
     print("📊 Training Metrics:", train_metrics)
     print("📊 Testing Metrics:", test_metrics)
+    test_metrics['confidence_intervals'] = classification_intervals(y_test, y_pred_test)
+    importance = permutation_importance(lambda X: svm.predict(scaler.transform(X)), X_test, y_test,
+                                        feature_cols, 'Accuracy')
     
     # Create visualization
+    mark_stage('visualization')
     print("📈 Creating decision boundary plot...")
     viz_image = create_decision_boundary_plot(X, y, svm, scaler, feature_cols)
     
@@ -269,7 +313,12 @@ def run_svm_route_optimization():
         'description': 'Route optimization suggestion (Optimized vs Needs Optimization)',
         'train_metrics': train_metrics,
         'test_metrics': test_metrics,
+        'split': split.summary(),
+        'sampling': describe_sampling(sampling, ROUTE_FEATURES_COLLECTION if from_store else TRIPS_COLLECTION,
+                                      len(df), fetch_seconds, train_seconds),
+        'feature_store': feature_store if from_store else None,
         'visualization': viz_image,
+        'permutation_importance': importance,
         'hyperparameters': {
             'kernel': 'rbf',
             'C': 1.0,
@@ -287,6 +336,16 @@ def run_svm_route_optimization():
         }
     }
     
+    # Save trained model for batch scoring
+    mark_stage('artifact')
+    save_model_artifact('svm_route_optimization', {
+        'model': svm,
+        'scaler': scaler,
+        'feature_cols': feature_cols
+    })
+    
+    report_data['memory'] = memory_summary()
+    
     # Save to MongoDB
     print("💾 Saving report to MongoDB...")
     report_id = save_model_report('svm_route_optimization', report_data)
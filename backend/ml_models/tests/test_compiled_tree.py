@@ -0,0 +1,61 @@
+"""CompiledTree must reproduce scikit-learn's DecisionTreeClassifier exactly"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from sklearn.tree import DecisionTreeClassifier
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from compiled_tree import CompiledTree  # noqa: E402
+
+
+def _data(n_rows, n_features, seed, missing=0.0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features)) * 20 + 10
+    y = (X[:, 0] + 0.5 * X[:, 1] + rng.normal(scale=5, size=n_rows) > 15).astype(int)
+    if missing:
+        X[rng.random(X.shape) < missing] = np.nan
+    return X, y
+
+
+@pytest.mark.parametrize('missing', [0.0, 0.1])
+@pytest.mark.parametrize('max_depth', [1, 5, 12])
+def test_matches_sklearn(missing, max_depth):
+    X, y = _data(5000, 6, seed=max_depth, missing=missing)
+    model = DecisionTreeClassifier(max_depth=max_depth, random_state=42).fit(X, y)
+    compiled = CompiledTree.from_sklearn(model)
+
+    # Fresh rows, with NaNs also on nodes that saw none in training
+    X_test, _ = _data(2000, 6, seed=100 + max_depth, missing=0.1)
+    np.testing.assert_array_equal(compiled.predict(X_test), model.predict(X_test))
+    np.testing.assert_array_equal(compiled.predict_proba(X_test), model.predict_proba(X_test))
+    np.testing.assert_array_equal(compiled.apply(X_test), model.apply(X_test))
+    np.testing.assert_array_equal(np.array([compiled.predict_one(row) for row in X_test[:200]]),
+                                  model.predict_proba(X_test[:200]))
+
+
+def test_float32_threshold_ties():
+    # Values that only differ from a threshold below float32 precision
+    X, y = _data(2000, 3, seed=7)
+    model = DecisionTreeClassifier(max_depth=4, random_state=42).fit(X, y)
+    compiled = CompiledTree.from_sklearn(model)
+    internal = model.tree_.feature >= 0
+    X_test = X[:internal.sum()].copy()
+    X_test[np.arange(internal.sum()), model.tree_.feature[internal]] = model.tree_.threshold[internal] + 1e-9
+
+    np.testing.assert_array_equal(compiled.apply(X_test), model.apply(X_test))
+    np.testing.assert_array_equal(compiled.predict_proba(X_test), model.predict_proba(X_test))
+
+
+def test_multiclass():
+    rng = np.random.default_rng(3)
+    X = rng.normal(size=(3000, 4))
+    y = np.digitize(X[:, 0] + X[:, 2], [-1, 0, 1])
+    model = DecisionTreeClassifier(max_depth=6, random_state=42).fit(X, y)
+    compiled = CompiledTree.from_sklearn(model)
+
+    np.testing.assert_array_equal(compiled.predict(X), model.predict(X))
+    np.testing.assert_array_equal(compiled.predict_proba(X), model.predict_proba(X))
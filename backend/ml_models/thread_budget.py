@@ -0,0 +1,263 @@
+"""
+CPU Thread Budget
+=================
+TensorFlow, BLAS-backed NumPy/scikit-learn and joblib each size their thread
+pools to every core, so concurrent trainings and the HTTP workers next to
+them oversubscribe the CPU. The budget splits the cores instead:
+
+- SERVING_CORES are reserved for request handling; the service's own BLAS and
+  TensorFlow pools are limited to that many threads
+- the other cores are divided into JOB_SLOTS equal shares. A training job
+  takes a slot: its worker process gets BLAS/OpenMP/joblib/TensorFlow pools
+  sized to the share, is pinned to the slot's cores and runs niced
+- slots are lock files, so the budget holds across gunicorn workers; a job
+  waits for a free slot instead of oversubscribing
+
+Usage:
+    python thread_budget.py                     # show the budget
+    python thread_budget.py benchmark [--jobs 4] [--size 1024] [--repeats 40]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: slots are only shared within one process
+    fcntl = None
+
+from config import *
+
+
+# Thread pool sizes read by the native libraries when they initialize
+BLAS_ENV_VARS = (
+    'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+    'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS'
+)
+MAX_INTER_OP_THREADS = 2
+
+
+def available_cores():
+    """Cores this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def thread_env(threads):
+    """Environment that sizes every native thread pool to `threads`"""
+    env = {var: str(threads) for var in BLAS_ENV_VARS}
+    env['LOKY_MAX_CPU_COUNT'] = str(threads)  # joblib process/thread pools
+    env['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    env['TF_NUM_INTEROP_THREADS'] = str(min(threads, MAX_INTER_OP_THREADS))
+    return env
+
+
+class Slot:
+    def __init__(self, index, cores, lock_file=None):
+        self.index = index
+        self.cores = cores
+        self.threads = len(cores)
+        self._lock_file = lock_file
+
+    def env(self):
+        return thread_env(self.threads)
+
+    def release(self):
+        if self._lock_file is not None:
+            self._lock_file.close()  # closing drops the flock
+            self._lock_file = None
+
+
+class ThreadBudget:
+    """Divides the cores between the HTTP path and a fixed number of job slots"""
+
+    def __init__(self, cores=None, serving_cores=SERVING_CORES, slots=JOB_SLOTS, nice=JOB_NICE,
+                 lock_dir=THREAD_BUDGET_DIR, poll_seconds=0.25):
+        cores = list(cores or available_cores())
+        if len(cores) > serving_cores:
+            self.serving_cores, job_cores = cores[:serving_cores], cores[serving_cores:]
+        else:
+            # Too few cores to reserve any: everything shares them
+            self.serving_cores = job_cores = cores
+        self.job_cores = job_cores
+
+        share = max(1, len(job_cores) // slots)
+        self.slot_cores = [
+            job_cores[i * share:(i + 1) * share] if len(job_cores) >= slots else [job_cores[i % len(job_cores)]]
+            for i in range(slots)
+        ]
+        self.nice = nice
+        self.lock_dir = lock_dir
+        self.poll_seconds = poll_seconds
+        self._held = set()
+        self._lock = threading.Lock()
+
+    @property
+    def serving_threads(self):
+        return len(self.serving_cores)
+
+    def _try_slot(self, index):
+        if fcntl is None:
+            with self._lock:
+                if index in self._held:
+                    return None
+                self._held.add(index)
+            return Slot(index, self.slot_cores[index])
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.lock_dir, f'slot-{index}.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return Slot(index, self.slot_cores[index], lock_file)
+
+    def acquire(self, should_stop=None):
+        """Wait for a free slot; returns None if should_stop() turns true first"""
+        while True:
+            for index in range(len(self.slot_cores)):
+                slot = self._try_slot(index)
+                if slot is not None:
+                    return slot
+            if should_stop and should_stop():
+                return None
+            time.sleep(self.poll_seconds)
+
+    def release(self, slot):
+        slot.release()
+        with self._lock:
+            self._held.discard(slot.index)
+
+    def pin(self, pid, slot):
+        """Restrict a worker process to its slot's cores"""
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(pid, slot.cores)
+            except OSError as e:
+                print(f"Warning: Could not pin pid {pid} to cores {slot.cores}: {e}")
+
+    def status(self):
+        slots = []
+        for index, cores in enumerate(self.slot_cores):
+            slot = self._try_slot(index)
+            if slot is not None:
+                self.release(slot)
+            slots.append({'slot': index, 'cores': cores, 'threads': len(cores), 'busy': slot is None})
+        return {
+            'cores': len(available_cores()),
+            'serving_cores': self.serving_cores,
+            'job_nice': self.nice,
+            'slots': slots
+        }
+
+
+def limit_serving_threads(budget):
+    """Size this process's BLAS and TensorFlow pools to the serving share"""
+    from threadpoolctl import threadpool_limits
+
+    for var in ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ.setdefault(var, str(budget.serving_threads))
+    return threadpool_limits(limits=budget.serving_threads)
+
+
+def _benchmark_workload(size, repeats):
+    """BLAS-bound stand-in for a training run"""
+    rng = np.random.default_rng(0)
+    a = rng.standard_normal((size, size))
+    for _ in range(repeats):
+        a = np.tanh(a @ a / size)
+    return {'checksum': float(a.sum())}
+
+
+def _probe_latency(stop, samples):
+    """A request-sized task (a few ms of NumPy) repeated while jobs run"""
+    rng = np.random.default_rng(1)
+    x = rng.standard_normal((256, 256))
+    while not stop.is_set():
+        start = time.perf_counter()
+        for _ in range(4):
+            np.tanh(x @ x)
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.02)
+
+
+def _latency_summary(samples):
+    latencies = np.array(samples) * 1000
+    return {
+        'probe_p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'probe_p99_ms': round(float(np.percentile(latencies, 99)), 2)
+    }
+
+
+def run_budget_benchmark(n_jobs=4, size=1024, repeats=40):
+    """Throughput of n concurrent jobs, and serving latency, with and without the budget"""
+    from jobs import JobSupervisor
+
+    stop, samples = threading.Event(), []
+    timer = threading.Timer(3.0, stop.set)
+    timer.start()
+    _probe_latency(stop, samples)
+    results = {'idle': _latency_summary(samples)}
+    print(f"⏱️  idle: {results['idle']}")
+
+    for mode in ('unbudgeted', 'budgeted'):
+        lock_dir = tempfile.mkdtemp(prefix='yatrik-ml-slots-')
+        budget = ThreadBudget(lock_dir=lock_dir) if mode == 'budgeted' else None
+        supervisor = JobSupervisor(budget=budget)
+
+        stop, samples = threading.Event(), []
+        probe = threading.Thread(target=_probe_latency, args=(stop, samples), daemon=True)
+        probe.start()
+
+        start = time.perf_counter()
+        threads = [
+            threading.Thread(target=supervisor.run, args=(f'benchmark_{i}', _benchmark_workload,
+                                                          {'size': size, 'repeats': repeats}))
+            for i in range(n_jobs)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        stop.set()
+        probe.join()
+
+        results[mode] = {
+            'wall_seconds': round(wall, 2),
+            'jobs_per_minute': round(n_jobs * 60 / wall, 2),
+            **_latency_summary(samples),
+            'statuses': [job['status'] for job in supervisor.list()]
+        }
+        print(f"⏱️  {mode}: {results[mode]}")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the CPU thread budget or benchmark it')
+    subparsers = parser.add_subparsers(dest='command')
+    bench_parser = subparsers.add_parser('benchmark', help='Concurrent job throughput with and without budgeting')
+    bench_parser.add_argument('--jobs', type=int, default=4)
+    bench_parser.add_argument('--size', type=int, default=1024)
+    bench_parser.add_argument('--repeats', type=int, default=40)
+    args = parser.parse_args()
+
+    if args.command == 'benchmark':
+        run_budget_benchmark(args.jobs, args.size, args.repeats)
+    else:
+        status = ThreadBudget().status()
+        print(f"🧮 {status['cores']} cores, serving on {status['serving_cores']}")
+        for slot in status['slots']:
+            print(f"  slot {slot['slot']}: cores {slot['cores']} ({'busy' if slot['busy'] else 'free'})")
+
+
+if __name__ == '__main__':
+    main()
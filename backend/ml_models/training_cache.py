@@ -0,0 +1,176 @@
+"""
+Content-Addressed Training Cache
+================================
+A training run is identified by a fingerprint of everything that determines
+its result:
+
+- data: the scheduler's cheap change signal for each input collection
+  (estimated count and max `updatedAt`), or the snapshot file's sha256 when
+  training from a snapshot
+- code: sha256 of the model's module and the shared feature code it uses
+- parameters: the run's arguments (function, sampling, full_refit) and the
+  split/sampling settings from config
+
+After a successful run, the fingerprint is stored in `ml_training_cache`
+with the report id and the artifact's modification time. A later run with
+the same fingerprint returns that report without fetching or fitting, as
+long as the report still exists and the artifact has not been replaced
+since. SingleFlight reports this as the 'cached' outcome; `force` skips
+the lookup.
+
+The signal has the scheduler's blind spot: an in-place edit that does not
+touch `updatedAt` leaves the fingerprint unchanged. Use force after such
+bulk edits.
+
+Usage:
+    python training_cache.py show [model_name]
+    python training_cache.py clear [model_name]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from config import *
+from utils import get_mongo_client, artifact_path
+
+
+# Model name -> module whose code (with SHARED_CODE) shapes its training result
+MODEL_MODULES = {
+    'knn_demand_prediction': 'knn_demand.py',
+    'nb_route_performance': 'nb_route_performance.py',
+    'dt_delay_prediction': 'dt_delay.py',
+    'svm_route_optimization': 'svm_route_opt.py',
+    'nn_crew_load_balancing': 'nn_crewload.py',
+}
+SHARED_CODE = ['utils.py', 'feature_store.py', 'sampling.py', 'splits.py', 'snapshot.py',
+               'crew_windows.py', 'compiled_tree.py', 'bootstrap.py', 'importance.py']
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_code_versions = {}
+
+
+def code_version(model_name):
+    """sha256 of the model's module and shared feature code, cached until a file changes"""
+    paths = [os.path.join(CODE_DIR, name) for name in [MODEL_MODULES[model_name]] + SHARED_CODE]
+    mtimes = tuple(os.path.getmtime(path) for path in paths if os.path.exists(path))
+    cached = _code_versions.get(model_name)
+    if cached is None or cached[0] != mtimes:
+        digest = hashlib.sha256()
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        _code_versions[model_name] = cached = (mtimes, digest.hexdigest()[:16])
+    return cached[1]
+
+
+def data_signature(model_name):
+    """Cheap description of the model's current input data"""
+    if SNAPSHOT_VERSION:
+        from snapshot import read_manifest
+        manifest = read_manifest(SNAPSHOT_VERSION)
+        dataset = manifest['datasets'].get(model_name, {})
+        return {'snapshot': manifest['version'], 'sha256': dataset.get('sha256')}
+
+    from scheduler import MODEL_INPUTS, collect_signals
+    client = get_mongo_client()
+    try:
+        return collect_signals(client[DB_NAME], MODEL_INPUTS[model_name])
+    finally:
+        client.close()
+
+
+def training_fingerprint(model_name, params=None):
+    """(fingerprint, parts) of a run on the current data, code and parameters"""
+    parts = {
+        'data': data_signature(model_name),
+        'code': code_version(model_name),
+        'params': {
+            **(params or {}),
+            'test_size': TEST_SIZE,
+            'random_state': RANDOM_STATE,
+            'split_folds': SPLIT_FOLDS,
+            'feature_store': FEATURE_STORE_ENABLED,
+            'sample_budget': SAMPLE_BUDGET,
+            'sample_strategy': SAMPLE_STRATEGY,
+            'bootstrap': [BOOTSTRAP_REPLICATES, BOOTSTRAP_CONFIDENCE],
+            'importance': [IMPORTANCE_REPEATS, IMPORTANCE_MAX_ROWS]
+        }
+    }
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:24], parts
+
+
+def _artifact_mtime(model_name):
+    path = artifact_path(model_name)
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def lookup_cached_result(model_name, fingerprint):
+    """Metrics of the report trained on this fingerprint, or None if not reusable"""
+    client = get_mongo_client()
+    try:
+        db = client[DB_NAME]
+        entry = db[TRAINING_CACHE_COLLECTION].find_one({'_id': f'{model_name}:{fingerprint}'})
+        if entry is None or entry.get('artifact_mtime') != _artifact_mtime(model_name):
+            return None
+        report = db[ML_REPORTS_COLLECTION].find_one({'_id': entry['report_id']}, {'metrics': 1, 'compacted': 1})
+    finally:
+        client.close()
+    # A compacted report no longer holds the full result (report_retention.py)
+    return report['metrics'] if report and not report.get('compacted') else None
+
+
+def record_cached_result(model_name, fingerprint):
+    """Store the model's latest report and artifact as the result of this fingerprint"""
+    client = get_mongo_client()
+    try:
+        db = client[DB_NAME]
+        report = db[ML_REPORTS_COLLECTION].find_one(
+            {'model_name': model_name}, {'_id': 1}, sort=[('timestamp', -1)]
+        )
+        if report is None:
+            return
+        db[TRAINING_CACHE_COLLECTION].update_one(
+            {'_id': f'{model_name}:{fingerprint}'},
+            {'$set': {
+                'model_name': model_name,
+                'fingerprint': fingerprint,
+                'report_id': report['_id'],
+                'artifact_mtime': _artifact_mtime(model_name),
+                'created_at': datetime.utcnow()
+            }},
+            upsert=True
+        )
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or clear the training cache')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help='Cached fingerprints per model')
+    show_parser.add_argument('model_name', nargs='?')
+    clear_parser = subparsers.add_parser('clear', help='Forget cached fingerprints')
+    clear_parser.add_argument('model_name', nargs='?')
+    args = parser.parse_args()
+
+    query = {'model_name': args.model_name} if args.model_name else {}
+    client = get_mongo_client()
+    cache = client[DB_NAME][TRAINING_CACHE_COLLECTION]
+    if args.command == 'clear':
+        print(f"🗑️  Cleared {cache.delete_many(query).deleted_count} cache entries")
+    else:
+        for model_name in args.model_name and [args.model_name] or MODEL_MODULES:
+            entries = list(cache.find({'model_name': model_name}, sort=[('created_at', -1)]))
+            print(f"🧾 {model_name}: code {code_version(model_name)}, {len(entries)} cached runs")
+            for entry in entries[:5]:
+                print(f"  {entry['fingerprint']} -> report {entry['report_id']} ({entry['created_at']})")
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
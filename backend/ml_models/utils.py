@@ -1,32 +1,66 @@
 """
 Utility functions for ML models
 """
+import os
 import pymongo
+import joblib
+from contextlib import contextmanager
 from datetime import datetime
+from bson import ObjectId
 import numpy as np
 import pandas as pd
-from config import MONGO_URI, DB_NAME, ML_REPORTS_COLLECTION
+from config import MONGO_URI, DB_NAME, ML_REPORTS_COLLECTION, ARTIFACT_DIR, BOOKINGS_COLLECTION
 
 def get_mongo_client():
     """Get MongoDB client connection"""
     return pymongo.MongoClient(MONGO_URI)
 
+_report_buffers = []
+
+@contextmanager
+def buffered_reports():
+    """Collect the reports saved inside the block instead of inserting them
+
+    The documents get their ids up front; write them later with save_reports().
+    """
+    reports = []
+    _report_buffers.append(reports)
+    try:
+        yield reports
+    finally:
+        _report_buffers.remove(reports)
+
 def save_model_report(model_name, metrics, timestamp=None):
     """Save model metrics to ml_reports collection"""
-    client = get_mongo_client()
-    db = client[DB_NAME]
-    collection = db[ML_REPORTS_COLLECTION]
-    
     report = {
+        '_id': ObjectId(),
         'model_name': model_name,
         'metrics': metrics,
         'timestamp': timestamp or datetime.utcnow(),
         'status': 'completed'
     }
     
-    result = collection.insert_one(report)
+    if _report_buffers:
+        _report_buffers[-1].append(report)
+        return str(report['_id'])
+    return save_reports([report])[0]
+
+def save_reports(reports):
+    """Insert report documents in one bulk write, then apply the retention policy"""
+    if not reports:
+        return []
+    
+    client = get_mongo_client()
+    collection = client[DB_NAME][ML_REPORTS_COLLECTION]
+    result = collection.insert_many(reports, ordered=False)
+    
+    from report_retention import apply_retention
+    try:
+        apply_retention(collection, sorted({report['model_name'] for report in reports}))
+    except Exception as e:
+        print(f"Warning: Could not apply report retention: {e}")
     client.close()
-    return str(result.inserted_id)
+    return [str(report_id) for report_id in result.inserted_ids]
 
 def get_latest_report(model_name):
     """Get latest report for a model"""
@@ -44,6 +78,109 @@ def get_latest_report(model_name):
         report['_id'] = str(report['_id'])
     return report
 
+def booking_totals_lookup(as_field='booking_totals'):
+    """$lookup that sums a trip's booked seats and fares inside the join
+    
+    Returns at most one small document per trip instead of materializing every
+    booking into an array on the trip (which can hit the 100 MB stage limit).
+    """
+    return {
+        '$lookup': {
+            'from': BOOKINGS_COLLECTION,
+            'localField': '_id',
+            'foreignField': 'trip',
+            'pipeline': [
+                {'$group': {'_id': None, 'seats': {'$sum': '$seats'}, 'revenue': {'$sum': '$fare'}}}
+            ],
+            'as': as_field
+        }
+    }
+
+def booking_total(field, as_field='booking_totals'):
+    """Projection expression for a total from booking_totals_lookup (0 for no bookings)"""
+    return {'$ifNull': [{'$first': f'${as_field}.{field}'}, 0]}
+
+HISTORY_BUCKET_UNITS = ('minute', 'hour', 'day', 'week', 'month', 'year')
+HISTORY_METRIC_SETS = ('test_metrics', 'train_metrics')
+
+def _report_time_range(collection, model_name):
+    """First and last report timestamp for a model (index-backed)"""
+    first = collection.find_one({'model_name': model_name}, {'timestamp': 1}, sort=[('timestamp', pymongo.ASCENDING)])
+    last = collection.find_one({'model_name': model_name}, {'timestamp': 1}, sort=[('timestamp', pymongo.DESCENDING)])
+    return (first['timestamp'], last['timestamp']) if first else (None, None)
+
+def get_metric_history(model_name, start=None, end=None, bucket='day', metric_set='test_metrics'):
+    """Min/mean/max of each numeric metric per time bucket
+    
+    bucket is a calendar unit ('hour', 'day', ...) or a number of equal-width
+    buckets between start and end. Only the metric fields are projected, so
+    report images never leave the database, and the output size depends on
+    the number of buckets, not the number of runs.
+    """
+    if metric_set not in HISTORY_METRIC_SETS:
+        raise ValueError(f"metric_set must be one of {HISTORY_METRIC_SETS}")
+    
+    buckets = int(bucket) if isinstance(bucket, int) or str(bucket).isdigit() else None
+    if buckets is None and bucket not in HISTORY_BUCKET_UNITS:
+        raise ValueError(f"bucket must be a number of buckets or one of {HISTORY_BUCKET_UNITS}")
+    if buckets is not None and buckets <= 0:
+        raise ValueError("Number of buckets must be positive")
+    
+    client = get_mongo_client()
+    collection = client[DB_NAME][ML_REPORTS_COLLECTION]
+    
+    if buckets is not None:
+        if start is None or end is None:
+            first, last = _report_time_range(collection, model_name)
+            start, end = start or first, end or last or datetime.utcnow()
+        if start is None or end is None:
+            client.close()
+            return []
+        width_ms = max((end - start).total_seconds() * 1000 / buckets, 1)
+        bucket_expr = {'$add': [start, {'$multiply': [width_ms, {'$min': [buckets - 1, {'$floor': {
+            '$divide': [{'$subtract': ['$timestamp', start]}, width_ms]
+        }}]}]}]}
+    else:
+        bucket_expr = {'$dateTrunc': {'date': '$timestamp', 'unit': bucket}}
+    
+    match = {'model_name': model_name}
+    if start or end:
+        match['timestamp'] = {}
+        if start:
+            match['timestamp']['$gte'] = start
+        if end:
+            match['timestamp']['$lte'] = end
+    
+    pipeline = [
+        {'$match': match},
+        {'$project': {
+            '_id': 0,
+            'timestamp': 1,
+            'metric': {'$objectToArray': {'$ifNull': [f'$metrics.{metric_set}', {}]}}
+        }},
+        {'$unwind': '$metric'},
+        {'$match': {'metric.v': {'$type': 'number'}}},
+        {'$group': {
+            '_id': {'bucket': bucket_expr, 'metric': '$metric.k'},
+            'min': {'$min': '$metric.v'},
+            'mean': {'$avg': '$metric.v'},
+            'max': {'$max': '$metric.v'},
+            'runs': {'$sum': 1}
+        }},
+        {'$group': {
+            '_id': '$_id.bucket',
+            'runs': {'$max': '$runs'},
+            'metrics': {'$push': {'k': '$_id.metric', 'v': {'min': '$min', 'mean': '$mean', 'max': '$max'}}}
+        }},
+        {'$sort': {'_id': 1}},
+        {'$project': {'_id': 0, 'bucket_start': '$_id', 'runs': 1, 'metrics': {'$arrayToObject': '$metrics'}}}
+    ]
+    
+    # The $match is served by the (model_name, timestamp) index from indexes.py
+    history = list(collection.aggregate(pipeline))
+    client.close()
+    return history
+
 def encode_categorical(df, column):
     """Encode categorical column"""
     unique_vals = df[column].unique()
@@ -55,3 +192,58 @@ def prepare_features(df, feature_columns, target_column):
     X = df[feature_columns].values
     y = df[target_column].values
     return X, y
+
+def artifact_path(model_name, extension='joblib'):
+    """Path of a model's trained artifact"""
+    return os.path.join(ARTIFACT_DIR, f"{model_name}.{extension}")
+
+def save_model_artifact(model_name, artifact):
+    """Persist a trained model (estimator, scaler, encodings) for scoring"""
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    artifact = dict(artifact, model_name=model_name, trained_at=datetime.utcnow())
+    path = artifact_path(model_name)
+    joblib.dump(artifact, path)
+    return path
+
+def load_model_artifact(model_name):
+    """Load a trained model artifact saved by save_model_artifact"""
+    path = artifact_path(model_name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No trained artifact for '{model_name}'. Run the model first.")
+    return joblib.load(path)
+
+_artifact_cache = {}
+
+def get_model_artifact(model_name):
+    """Cached load_model_artifact, reloaded when the artifact file changes
+    
+    Artifacts loaded before a fork (gunicorn preload) are shared by every worker.
+    """
+    path = artifact_path(model_name)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    cached = _artifact_cache.get(model_name)
+    if cached is None or cached[0] != mtime:
+        _artifact_cache[model_name] = (mtime, load_model_artifact(model_name))
+    return _artifact_cache[model_name][1]
+
+def bulk_write_batches(collection, operations, batch_size=1000):
+    """Write an iterable of operations in unordered bulk_write batches"""
+    totals = {'upserted': 0, 'modified': 0, 'matched': 0, 'batches': 0}
+    batch = []
+    
+    def flush():
+        result = collection.bulk_write(batch, ordered=False)
+        totals['upserted'] += result.upserted_count
+        totals['modified'] += result.modified_count
+        totals['matched'] += result.matched_count
+        totals['batches'] += 1
+        batch.clear()
+    
+    for operation in operations:
+        batch.append(operation)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    
+    return totals
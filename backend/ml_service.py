@@ -3,35 +3,73 @@ Flask ML Microservice
 =====================
 Provides REST API endpoints to run ML models and fetch results.
 
+Development: python ml_service.py (Flask dev server with debugger/reloader)
+Production:  gunicorn -c gunicorn.conf.py ml_service:app (see ML_SERVICE_PRODUCTION.md)
+
 Endpoints:
 - GET /health - Health check
-- POST /run_all - Run all 5 ML models
+- POST /run_all - Run all 5 ML models; their reports are written in one bulk write at the end
 - POST /run/<model_name> - Run specific model
+  (both accept an optional JSON body {"sampling": {"strategy": ..., "budget": ...}};
+   /run/nb_route_performance also accepts {"incremental": true, "full_refit": false};
+   "force": true skips the minimum retrain interval and the training cache. Concurrent runs of
+   a model are coalesced; a run on unchanged data, code and parameters returns the cached
+   report with outcome "cached".
+   Each run is a supervised job; /run/<model_name> accepts "timeout_seconds" and "memory_mb")
+- GET /jobs - Training jobs started by this process and the CPU slot budget
+- GET /jobs/<job_id> - Job status (queued, running, succeeded, failed, timeout, oom, cancelled, crashed),
+  peak RSS and, once succeeded, the run's per-stage memory (ML_MEMORY_WARN_MB flags large stages)
+- DELETE /jobs/<job_id> - Cancel a running job and stop its worker process
+- GET /training - In-flight trainings and cached/coalesced/throttled counts per model
 - GET /metrics/<model_name> - Get latest metrics for a model
+- GET /metrics/<model_name>/history?from=&to=&bucket=&set= - Bucketed min/mean/max metric history
 - GET /metrics/all - Get all model metrics
 - GET /comparison - Compare all model results
+- POST /crew/fitness - Ranked fitness scores for a depot or list of crew
+- POST /score - Run batch scoring jobs and write predictions to MongoDB
+- POST /reports/compact - Compact ml_reports beyond the newest N per model
+  ({"keep": 20, "model": ..., "dry_run": false}); returns the bytes reclaimed
+- GET|POST /forecast/demand - N-day passenger forecast for one, many or all routes
+  (?routes=id1,id2&horizon=7 or {"routes": [...], "horizon": 7}); cached per route
+  until new bookings arrive
+- GET /scheduler - Retraining schedule and last decision per model
+- POST /scheduler/check - Evaluate input drift without retraining
 """
 
 import sys
 import os
 
-# Add ml_models to path
+# Add ml_models to path. Its modules import each other by plain name (`from utils import ...`),
+# so they are imported the same way here: `ml_models.utils` would be a second copy of `utils`
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'ml_models'))
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
 import traceback
 
 # Import ML models
 try:
-    from ml_models.knn_demand import run_knn_demand_prediction
-    from ml_models.nb_route_performance import run_naive_bayes_classification
-    from ml_models.dt_delay import run_decision_tree_delay_prediction
-    from ml_models.svm_route_opt import run_svm_route_optimization
-    from ml_models.nn_crewload import run_neural_network_crew_load
-    from ml_models.utils import get_latest_report, get_mongo_client
-    from ml_models.config import DB_NAME, ML_REPORTS_COLLECTION
+    from knn_demand import run_knn_demand_prediction
+    from nb_route_performance import run_naive_bayes_classification, run_naive_bayes_incremental
+    from dt_delay import run_decision_tree_delay_prediction
+    from svm_route_opt import run_svm_route_optimization
+    from nn_crewload import run_neural_network_crew_load
+    from utils import get_latest_report, get_mongo_client, get_metric_history, get_model_artifact, save_reports
+    from report_retention import run_compaction
+    from config import (DB_NAME, ML_REPORTS_COLLECTION, SCHEDULER_ENABLED, REPORT_KEEP_FULL,
+                        INDEX_CHECK_ON_STARTUP, CREATE_MISSING_INDEXES, THREAD_BUDGET_ENABLED)
+    from scheduler import RetrainScheduler
+    from single_flight import SingleFlight
+    from training_cache import training_fingerprint, record_cached_result
+    from jobs import JobSupervisor, JobError, ACTIVE_STATUSES
+    from thread_budget import ThreadBudget, limit_serving_threads
+    from scoring import run_batch_scoring, SCORING_JOBS
+    from nn_crewload import score_crew_roster, get_crew_fitness_predictor
+    from indexes import run_index_advisor
+    from demand_forecast import DemandForecaster
 except ImportError as e:
     print(f"Warning: Could not import ML models: {e}")
     print("Make sure to install requirements: pip install -r ml_models/requirements.txt")
@@ -47,7 +85,8 @@ MODELS = {
     },
     'nb_route_performance': {
         'name': 'Naive Bayes Route Performance',
-        'function': run_naive_bayes_classification
+        'function': run_naive_bayes_classification,
+        'incremental': run_naive_bayes_incremental
     },
     'dt_delay_prediction': {
         'name': 'Decision Tree Trip Delay',
@@ -63,6 +102,110 @@ MODELS = {
     }
 }
 
+# Spawned job workers re-import the script run as `python ml_service.py` under this name to
+# unpickle their target. They only need the pipeline modules: no serving thread limit (it would
+# clamp the training's BLAS pools), supervisor, forecaster or scheduler
+SERVICE_PROCESS = __name__ != '__mp_main__'
+
+if SERVICE_PROCESS:
+    # One training per model at a time; concurrent requests share its result
+    training = SingleFlight()
+
+    # Trainings get a share of the cores; request handling keeps the reserved ones
+    budget = ThreadBudget() if THREAD_BUDGET_ENABLED else None
+    if budget is not None:
+        limit_serving_threads(budget)
+
+    # Every training runs in a worker process with a deadline, memory ceiling and CPU share
+    jobs = JobSupervisor(budget=budget)
+
+    # Batched route demand forecasts, cached until new bookings arrive
+    forecaster = DemandForecaster()
+
+# HTTP status per failed job outcome
+JOB_ERROR_STATUS = {'timeout': 504, 'cancelled': 409}
+
+
+def supervised(model_name, fn, timeout=None, memory_mb=None, reports=None, **kwargs):
+    """Training callable that runs fn(**kwargs) as a supervised job
+
+    With a reports list, the job's reports are collected there for the caller
+    to write instead of being inserted by the worker.
+    """
+    return lambda: jobs.run(model_name, fn, kwargs, timeout=timeout, memory_mb=memory_mb, reports=reports)
+
+
+def fingerprint(model_name, fn, **params):
+    """Training cache key of fn(**params) on the current data, or None if it cannot be read"""
+    try:
+        return training_fingerprint(model_name, {'function': fn.__name__, **params})[0]
+    except Exception as e:
+        print(f"Warning: Could not fingerprint training data for {model_name}: {e}")
+        return None
+
+
+def _scheduled_run(model_name, fn):
+    """Scheduler entry: bypass the minimum interval and cache (drift decided it) but still coalesce"""
+    return lambda: training.run(model_name, supervised(model_name, fn), force=True,
+                                fingerprint=fingerprint(model_name, fn))[0]
+
+
+# Scheduled retrains use the incremental update where a model has one
+if SERVICE_PROCESS:
+    scheduler = RetrainScheduler({
+        key: _scheduled_run(key, info.get('incremental', info['function']))
+        for key, info in MODELS.items()
+    })
+
+
+def check_indexes_on_startup():
+    """Warn about (or create) missing indexes before the first large pipeline run"""
+    try:
+        result = run_index_advisor(create=CREATE_MISSING_INDEXES, explain=False)
+    except Exception as e:
+        print(f"Warning: Could not check MongoDB indexes: {e}")
+        return
+    
+    for name in result['created']:
+        print(f"🆕 Created index {name}")
+    if result['missing']:
+        print(f"⚠️  Missing indexes: {', '.join(result['missing'])}")
+        print("   Run: python ml_models/indexes.py --create (or set ML_CREATE_INDEXES=true)")
+    else:
+        print("✅ All indexes used by the ML pipelines are present")
+
+
+def preload_models():
+    """Load trained artifacts into memory so forked workers share them copy-on-write"""
+    # The serving and scoring paths must read the cache filled here, not a second copy of utils
+    import scoring
+    if scoring.get_model_artifact is not get_model_artifact:
+        raise RuntimeError("ml_models modules are loaded twice (as 'utils' and 'ml_models.utils'); "
+                           "preloaded artifacts would not be shared with the workers")
+
+    loaded = []
+    for model_name in MODELS:
+        try:
+            artifact = get_model_artifact(model_name)
+            loaded.append(model_name)
+        except FileNotFoundError:
+            continue
+        
+        # Keras models start TensorFlow thread pools, which do not survive fork; load those lazily
+        if model_name == 'nn_crew_load_balancing' and artifact.get('framework') != 'keras':
+            get_crew_fitness_predictor()
+    
+    print(f"📦 Preloaded {len(loaded)}/{len(MODELS)} model artifacts: {', '.join(loaded) or 'none'}")
+    return loaded
+
+
+def record_training(model_name):
+    """Update the scheduler baseline after a manual run"""
+    try:
+        scheduler.record_training(model_name)
+    except Exception as e:
+        print(f"Warning: Could not record training state for {model_name}: {e}")
+
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -80,6 +223,12 @@ def run_all_models():
     """Run all ML models sequentially"""
     results = {}
     errors = {}
+    body = request.get_json(silent=True) or {}
+    sampling = body.get('sampling')
+    force = bool(body.get('force'))
+    # Reports of the models trained here, written together at the end
+    reports = []
+    trained = {}
     
     print("=" * 60)
     print("🚀 Running all ML models...")
@@ -88,24 +237,54 @@ def run_all_models():
     for model_key, model_info in MODELS.items():
         try:
             print(f"\n▶️  Running {model_info['name']}...")
-            result = model_info['function']()
+            key = fingerprint(model_key, model_info['function'], sampling=sampling)
+            result, outcome = training.run(
+                model_key, supervised(model_key, model_info['function'], reports=reports, sampling=sampling),
+                force=force, fingerprint=key, record=False
+            )
             
             if result:
                 results[model_key] = {
                     'status': 'success',
                     'name': model_info['name'],
+                    'outcome': outcome,
+                    'fingerprint': key,
+                    'sampling': result.get('sampling'),
+                    'memory': result.get('memory'),
                     'timestamp': datetime.utcnow().isoformat()
                 }
+                if outcome == 'trained':
+                    trained[model_key] = key
                 print(f"✅ {model_info['name']} completed successfully!")
             else:
                 errors[model_key] = 'Model returned no results'
                 print(f"⚠️  {model_info['name']} returned no results")
                 
+        except JobError as e:
+            errors[model_key] = str(e)
+            print(f"❌ {model_info['name']}: {e}")
         except Exception as e:
             errors[model_key] = str(e)
             print(f"❌ Error running {model_info['name']}: {e}")
             traceback.print_exc()
     
+    # One bulk write for the whole batch; the scheduler baseline and training cache read the new reports
+    try:
+        written = len(save_reports(reports))
+        print(f"💾 Saved {written} reports to MongoDB in one bulk write")
+    except Exception as e:
+        written = 0
+        errors['ml_reports'] = f'Could not save {len(reports)} reports: {e}'
+        print(f"❌ {errors['ml_reports']}")
+        trained = {}
+    for model_key, key in trained.items():
+        record_training(model_key)
+        if key:
+            try:
+                record_cached_result(model_key, key)
+            except Exception as e:
+                print(f"Warning: Could not record training cache for {model_key}: {e}")
+    
     print("\n" + "=" * 60)
     print(f"✅ Completed: {len(results)}/{len(MODELS)} models")
     print("=" * 60)
@@ -114,6 +293,7 @@ def run_all_models():
         'status': 'completed',
         'results': results,
         'errors': errors,
+        'reports_written': written,
         'total_models': len(MODELS),
         'successful': len(results),
         'failed': len(errors)
@@ -130,15 +310,50 @@ def run_specific_model(model_name):
             'available_models': list(MODELS.keys())
         }), 404
     
+    body = request.get_json(silent=True) or {}
+    sampling = body.get('sampling')
+    incremental = bool(body.get('incremental'))
+    force = bool(body.get('force'))
+    try:
+        limits = {
+            'timeout': float(body['timeout_seconds']) if body.get('timeout_seconds') else None,
+            'memory_mb': int(body['memory_mb']) if body.get('memory_mb') else None
+        }
+    except (TypeError, ValueError):
+        return jsonify({
+            'status': 'error',
+            'message': 'timeout_seconds and memory_mb must be numbers'
+        }), 400
+    
+    if incremental and 'incremental' not in MODELS[model_name]:
+        return jsonify({
+            'status': 'error',
+            'message': f'Model "{model_name}" does not support incremental updates'
+        }), 400
+    
     try:
         print(f"🚀 Running {MODELS[model_name]['name']}...")
-        result = MODELS[model_name]['function']()
+        if incremental:
+            fn, params = MODELS[model_name]['incremental'], {'full_refit': bool(body.get('full_refit'))}
+        else:
+            fn, params = MODELS[model_name]['function'], {'sampling': sampling}
+        key = fingerprint(model_name, fn, **params)
+        result, outcome = training.run(model_name, supervised(model_name, fn, **limits, **params),
+                                       force=force, fingerprint=key)
         
         if result:
+            if outcome == 'trained':
+                record_training(model_name)
             return jsonify({
                 'status': 'success',
                 'model': model_name,
                 'name': MODELS[model_name]['name'],
+                'outcome': outcome,
+                'fingerprint': key,
+                'sampling': result.get('sampling'),
+                'training_mode': result.get('training_mode', 'full'),
+                'incremental': result.get('incremental'),
+                'memory': result.get('memory'),
                 'timestamp': datetime.utcnow().isoformat()
             })
         else:
@@ -147,6 +362,16 @@ def run_specific_model(model_name):
                 'message': 'Model returned no results'
             }), 500
             
+    except JobError as e:
+        if e.job.error_type == 'ValueError':
+            code = 400
+        else:
+            code = JOB_ERROR_STATUS.get(e.job.status, 500)
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'job': e.job.to_dict()
+        }), code
     except Exception as e:
         print(f"❌ Error running {model_name}: {e}")
         traceback.print_exc()
@@ -181,6 +406,43 @@ def get_model_metrics(model_name):
         }), 500
 
 
+@app.route('/metrics/<model_name>/history', methods=['GET'])
+def get_model_metric_history(model_name):
+    """Get bucketed metric history for a model"""
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Invalid date (use ISO 8601): {e}'
+        }), 400
+    
+    bucket = request.args.get('bucket', 'day')
+    metric_set = request.args.get('set', 'test_metrics')
+    
+    try:
+        history = get_metric_history(model_name, start, end, bucket, metric_set)
+        return jsonify({
+            'status': 'success',
+            'model': model_name,
+            'bucket': bucket,
+            'set': metric_set,
+            'history': history,
+            'count': len(history)
+        })
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
 @app.route('/metrics/all', methods=['GET'])
 def get_all_metrics():
     """Get latest metrics for all models"""
@@ -231,6 +493,221 @@ def compare_models():
     })
 
 
+@app.route('/crew/fitness', methods=['POST'])
+def crew_fitness():
+    """Rank every crew member of a depot (or a crew list) by predicted fitness"""
+    body = request.get_json(silent=True) or {}
+    
+    try:
+        depot_id = ObjectId(body['depot_id']) if body.get('depot_id') else None
+        crew_ids = [ObjectId(crew_id) for crew_id in body['crew_ids']] if body.get('crew_ids') else None
+    except (InvalidId, TypeError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Invalid id: {e}'
+        }), 400
+    
+    try:
+        result = score_crew_roster(depot_id=depot_id, crew_ids=crew_ids)
+        return jsonify({
+            'status': 'success',
+            **result
+        })
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except FileNotFoundError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 409
+    except Exception as e:
+        print(f"❌ Error scoring crew fitness: {e}")
+        traceback.print_exc()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/score', methods=['POST'])
+def run_scoring():
+    """Score upcoming trips, demand slots and crew with the trained models"""
+    body = request.get_json(silent=True) or {}
+    jobs = body.get('jobs') or list(SCORING_JOBS.keys())
+    
+    unknown = [job for job in jobs if job not in SCORING_JOBS]
+    if unknown:
+        return jsonify({
+            'status': 'error',
+            'message': f'Unknown scoring jobs: {", ".join(unknown)}',
+            'available_jobs': list(SCORING_JOBS.keys())
+        }), 400
+    
+    try:
+        results = run_batch_scoring(jobs)
+        return jsonify({
+            'status': 'success',
+            'results': results,
+            'timestamp': datetime.utcnow().isoformat()
+        })
+    except FileNotFoundError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 409
+    except Exception as e:
+        print(f"❌ Error running batch scoring: {e}")
+        traceback.print_exc()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/reports/compact', methods=['POST'])
+def compact_reports():
+    """Compact ml_reports beyond the newest N per model and report the bytes reclaimed"""
+    body = request.get_json(silent=True) or {}
+    try:
+        keep = int(body['keep']) if body.get('keep') is not None else REPORT_KEEP_FULL
+    except (TypeError, ValueError):
+        keep = 0
+    if keep < 1:
+        return jsonify({
+            'status': 'error',
+            'message': 'keep must be a positive number'
+        }), 400
+    
+    try:
+        result = run_compaction(body.get('model'), keep=keep, dry_run=bool(body.get('dry_run')))
+        return jsonify({
+            'status': 'success',
+            **result,
+            'timestamp': datetime.utcnow().isoformat()
+        })
+    except Exception as e:
+        print(f"❌ Error compacting reports: {e}")
+        traceback.print_exc()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/forecast/demand', methods=['GET', 'POST'])
+def forecast_demand():
+    """Forecast daily passengers for the next `horizon` days for routes (all by default)"""
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        routes, horizon = body.get('routes'), body.get('horizon', 7)
+    else:
+        routes = request.args.get('routes')
+        routes = routes.split(',') if routes else None
+        horizon = request.args.get('horizon', 7)
+    
+    try:
+        result = forecaster.forecast(routes=routes or None, horizon=int(horizon))
+        return jsonify({
+            'status': 'success',
+            **result
+        })
+    except (InvalidId, TypeError, ValueError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except FileNotFoundError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 409
+    except Exception as e:
+        print(f"❌ Error forecasting demand: {e}")
+        traceback.print_exc()
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/scheduler', methods=['GET'])
+def scheduler_status():
+    """Get the retraining schedule and last decision per model"""
+    return jsonify({
+        'status': 'success',
+        'scheduler': scheduler.status()
+    })
+
+
+@app.route('/scheduler/check', methods=['POST'])
+def scheduler_check():
+    """Evaluate input drift for every model without retraining"""
+    try:
+        return jsonify({
+            'status': 'success',
+            'decisions': scheduler.check(dry_run=True)
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/training', methods=['GET'])
+def training_status():
+    """Get in-flight trainings and coalesced/throttled counts per model"""
+    return jsonify({
+        'status': 'success',
+        'training': training.status()
+    })
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """List training jobs started by this process, newest first"""
+    return jsonify({
+        'status': 'success',
+        'jobs': jobs.list(),
+        'thread_budget': budget.status() if budget is not None else None
+    })
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get a training job's status and resource usage"""
+    try:
+        job = jobs.get(job_id)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Job "{job_id}" not found'}), 404
+    return jsonify({'status': 'success', 'job': job})
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a running training job; its worker process is stopped"""
+    try:
+        job = jobs.cancel(job_id)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Job "{job_id}" not found'}), 404
+    if job['status'] not in ACTIVE_STATUSES:
+        return jsonify({
+            'status': 'error',
+            'message': f'Job "{job_id}" already finished',
+            'job': job
+        }), 409
+    return jsonify({'status': 'success', 'message': 'Cancellation requested', 'job': job}), 202
+
+
 @app.route('/models', methods=['GET'])
 def list_models():
     """List all available models"""
@@ -269,4 +746,11 @@ if __name__ == '__main__':
         print(f"  - {info['name']} ({key})")
     print("=" * 60)
     
+    # The debug reloader imports this module twice; only start in the serving process
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        if INDEX_CHECK_ON_STARTUP:
+            check_indexes_on_startup()
+        if SCHEDULER_ENABLED:
+            scheduler.start()
+    
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -189,6 +189,8 @@ const MLVisualization = () => {
     if (!modelData || !modelData.metrics) return null;
 
     const { visualization } = modelData.metrics;
+    const testMetrics = modelData.metrics.test_metrics || {};
+    const intervals = testMetrics.confidence_intervals;
 
     return (
       <div className="bg-white rounded-lg shadow-md p-6 mb-6">
@@ -201,12 +203,17 @@ const MLVisualization = () => {
         )}
 
         <div className="grid grid-cols-2 md:grid-cols-4 gap-4 mt-4">
-          {Object.entries(modelData.metrics.test_metrics || {}).map(([key, value]) => (
+          {Object.entries(testMetrics).filter(([key]) => key !== 'confidence_intervals').map(([key, value]) => (
             <div key={key} className="bg-gray-50 rounded-lg p-4">
               <p className="text-xs text-gray-500 uppercase">{key.replace('_', ' ')}</p>
               <p className="text-lg font-bold text-gray-900">
                 {typeof value === 'number' ? value.toFixed(4) : value}
               </p>
+              {intervals?.[key] && (
+                <p className="text-xs text-gray-500">
+                  {Math.round(intervals.confidence * 100)}% CI {intervals[key].low.toFixed(4)} – {intervals[key].high.toFixed(4)}
+                </p>
+              )}
             </div>
           ))}
         </div>